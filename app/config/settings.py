@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -52,6 +53,14 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Метрики запросов для /api/metrics и лог медленных запросов (REQUEST_METRICS=0 - отключить),
+# медленным считается запрос дольше SLOW_REQUEST_THRESHOLD секунд
+REQUEST_METRICS_ENABLED = os.environ.get('REQUEST_METRICS', '1') == '1'
+SLOW_REQUEST_THRESHOLD = float(os.environ.get('SLOW_REQUEST_THRESHOLD', 1.0))
+
+if REQUEST_METRICS_ENABLED:
+    MIDDLEWARE.insert(0, 'main.middleware.RequestMetricsMiddleware')
+
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
@@ -76,17 +85,61 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# DB_POOL=1 - соединения берутся из пула внутри процесса (движок main.pool),
+# иначе соединение живет DB_CONN_MAX_AGE секунд и переиспользуется между запросами
+DB_POOL = os.environ.get('DB_POOL') == '1'
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 2))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 20))
+# Сколько ждать свободного соединения и как часто проверять простаивающие, секунд
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+DB_POOL_CHECK_INTERVAL = float(os.environ.get('DB_POOL_CHECK_INTERVAL', 30))
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'HOST': 'db',
-        'PORT': 5432,
-        'NAME': 'postgres',
-        'USER': 'postgres',
-        'PASSWORD': 'postgres',
+        'ENGINE': 'main.pool' if DB_POOL else 'django.db.backends.postgresql',
+        'HOST': os.environ.get('DB_HOST', 'db'),
+        'PORT': int(os.environ.get('DB_PORT', 5432)),
+        'NAME': os.environ.get('DB_NAME', 'postgres'),
+        'USER': os.environ.get('DB_USER', 'postgres'),
+        'PASSWORD': os.environ.get('DB_PASSWORD', 'postgres'),
+        'CONN_MAX_AGE': 0 if DB_POOL else int(os.environ.get('DB_CONN_MAX_AGE', 60)),
     }
 }
 
+# DB_ENGINE=sqlite - локальная БД в файле, например для замеров без Postgres
+if os.environ.get('DB_ENGINE') == 'sqlite':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': str(BASE_DIR / 'db.sqlite3'),
+    }
+
+# DB_REPLICAS - реплики для чтения через запятую: хосты Postgres
+# или, при DB_ENGINE=sqlite, файлы SQLite
+REPLICA_DATABASES = []
+# Таймаут проверки реплики (подключение и SELECT 1), в секундах
+REPLICA_PROBE_TIMEOUT = 2
+# Как часто проверять соединение с репликой перед чтением, в секундах
+REPLICA_PROBE_INTERVAL = 5
+for number, replica in enumerate(filter(None, os.environ.get('DB_REPLICAS', '').split(','))):
+    alias = f'replica_{number}'
+    if DATABASES['default']['ENGINE'].endswith('sqlite3'):
+        replica_options = {'NAME': replica, 'OPTIONS': {'timeout': REPLICA_PROBE_TIMEOUT}}
+    else:
+        # tcp_user_timeout ограничивает ожидание ответа от упавшего сервера и для уже открытого соединения
+        replica_options = {'HOST': replica, 'OPTIONS': {
+            'connect_timeout': REPLICA_PROBE_TIMEOUT,
+            'tcp_user_timeout': REPLICA_PROBE_TIMEOUT * 1000,
+        }}
+    DATABASES[alias] = dict(DATABASES['default'], TEST={'MIRROR': 'default'}, **replica_options)
+    REPLICA_DATABASES.append(alias)
+
+DATABASE_ROUTERS = ['main.routers.ReplicaRouter']
+# Сколько секунд не направлять чтение на недоступную реплику
+REPLICA_RETRY_INTERVAL = 30
+
+if REPLICA_DATABASES:
+    MIDDLEWARE.insert(0, 'main.middleware.PrimaryPinMiddleware')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -114,9 +167,26 @@ REST_FRAMEWORK = {
         'main.authentication.JWTAuthentication',
     ),
     'DATETIME_FORMAT': "%Y-%m-%dT%H:%M:%S",
-    'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend']
+    'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
+    'DEFAULT_PAGINATION_CLASS': 'main.pagination.KeysetPagination',
+    'PAGE_SIZE': 100,
 }
 
+# Максимальный размер страницы, который можно запросить параметром page_size
+MAX_PAGE_SIZE = 1000
+
+
+# Как часто перечитывать список заблокированных пользователей
+# для токенов, проверяемых без обращения к БД, в секундах
+REVOKED_USERS_TTL = 30
+
+# Проверка паролей при входе: число потоков, предел очереди (сверх него - 429)
+# и кэш недавно проверенных паролей
+LOGIN_WORKERS = os.cpu_count() or 1
+LOGIN_QUEUE_LIMIT = LOGIN_WORKERS * 4
+LOGIN_CACHE_SIZE = 10000
+LOGIN_CACHE_TTL = 300
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/3.2/topics/i18n/
@@ -127,8 +197,6 @@ TIME_ZONE = 'UTC'
 
 USE_I18N = True
 
-USE_L10N = True
-
 USE_TZ = True
 
 
@@ -142,10 +210,108 @@ STATIC_ROOT = 'static'
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
-DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 
 SUPERUSER_LOGIN = 'superuser'
 SUPERUSER_PASSWORD = 'superuser_password'
 SUPERUSER_EMAIL = 'superuser@admin.ru'
 ADMIN_LOGIN = 'admin'
 ADMIN_PASSWORD = 'admin_password'
+
+# Write-behind очередь прохождений опросов
+# При включении take только проверяет ответы и кладет их в очередь,
+# в БД их переносит команда flush_answers
+ANSWER_QUEUE_ENABLED = False
+ANSWER_QUEUE_PATH = BASE_DIR / 'queue' / 'answers.sqlite3'
+ANSWER_QUEUE_BATCH_SIZE = 1000
+ANSWER_QUEUE_FLUSH_INTERVAL = 1.0
+
+# Число прохождений в одной пачке записи при пакетной выгрузке /api/surveys/sync
+SYNC_BATCH_SIZE = 500
+
+# Сколько дней хранить ключи идемпотентности прохождений (команда purge_submission_keys)
+SUBMISSION_KEY_RETENTION_DAYS = 30
+
+# Кэш JSON-описаний опросов: число опросов в памяти процесса
+# и необязательный общий кэш из CACHES для нескольких процессов
+SURVEY_CACHE_SIZE = 1024
+SURVEY_CACHE_BACKEND = None
+# Без общего кэша изменения из других процессов видны не позже чем через столько секунд
+SURVEY_CACHE_TTL = 30
+# Не дольше скольких секунд процесс использует закэшированный список открытых опросов
+OPEN_SURVEYS_TTL = 60
+
+# Размер порции строк при потоковой отдаче ответов пользователя
+ANSWER_STREAM_CHUNK_SIZE = 2000
+
+# Размер кэша external_id -> id пользователя для повторно отвечающих респондентов
+RESPONDENT_CACHE_SIZE = 100000
+
+# Хранение ответов: 'rows' - строка Answer на каждый ответ,
+# 'compact' - строка Submission на прохождение с упакованными вариантами ответа
+ANSWER_STORAGE = os.environ.get('ANSWER_STORAGE', 'rows')
+
+# Размер порции строк при выгрузке ответов (export_answers, /api/surveys/{id}/export)
+EXPORT_CHUNK_SIZE = 10000
+
+# Число опросов в одной пачке вставки при пакетной загрузке
+IMPORT_BATCH_SIZE = 500
+
+# Помесячные секции таблицы ответов (Postgres 12+) создаются командой answer_partitions
+# на ANSWER_PARTITIONS_AHEAD месяцев вперед
+ANSWER_PARTITIONS_AHEAD = 3
+# На сколько частей по хешу survey_id делится каждая месячная секция
+ANSWER_PARTITION_SURVEY_BUCKETS = 8
+
+# Журнал отклоненных запросов пишется в файл фоновым потоком через очередь
+# на LOG_QUEUE_SIZE записей, при переполнении записи отбрасываются.
+# Файл ротируется раз в LOG_ROTATE_WHEN и по достижении LOG_MAX_BYTES
+LOG_FILE = BASE_DIR / 'logs' / 'requests.log'
+LOG_QUEUE_SIZE = 10000
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_ROTATE_WHEN = 'midnight'
+LOG_BACKUP_COUNT = 7
+# Не больше LOG_SAMPLE_LIMIT записей в секунду от одного view,
+# LOG_SAMPLE_LIMITS - пределы для отдельных view, например {'SurveyViewset.take': 5}
+LOG_SAMPLE_LIMIT = 20
+LOG_SAMPLE_LIMITS = {}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'endpoint_sampler': {
+            '()': 'main.logqueue.EndpointSampler',
+            'limit': LOG_SAMPLE_LIMIT,
+            'limits': LOG_SAMPLE_LIMITS,
+        },
+    },
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'requests': {
+            'class': 'main.logqueue.QueueFileHandler',
+            'filename': str(LOG_FILE),
+            'queue_size': LOG_QUEUE_SIZE,
+            'max_bytes': LOG_MAX_BYTES,
+            'when': LOG_ROTATE_WHEN,
+            'backup_count': LOG_BACKUP_COUNT,
+            'formatter': 'message',
+            'filters': ['endpoint_sampler'],
+            'level': 'INFO',
+        },
+    },
+    'loggers': {
+        'main.serializers': {
+            'handlers': ['requests'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'main.middleware': {
+            'handlers': ['requests'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
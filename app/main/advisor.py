@@ -0,0 +1,118 @@
+"""
+Проверка планов канонических запросов приложения
+
+Каждый запрос горячего пути регистрируется декоратором canonical_query
+и получает синтетические данные benchmarks.data.Dataset. Команда
+index_advisor выполняет их под EXPLAIN и сообщает о полных просмотрах таблиц.
+Новый эндпоинт с новым видом запроса добавляет сюда свою функцию.
+"""
+import re
+from datetime import date
+
+from django.db import connection
+
+from .answers import filter_answers
+from .cache import open_surveys_queryset
+from .export import export_queryset
+from .models import AnswerChoice, Question, Survey, SurveyResult, User
+
+CANONICAL_QUERIES = {}
+
+POSTGRES_SCAN = re.compile(r'Seq Scan on (\w+)')
+SQLITE_SCAN = re.compile(r'\bSCAN (?:TABLE )?(\w+)(?! USING)(?:\s|$)')
+
+
+def canonical_query(name):
+    """
+    Регистрирует функцию dataset -> QuerySet как канонический запрос
+    """
+    def register(func):
+        CANONICAL_QUERIES[name] = func
+        return func
+    return register
+
+
+@canonical_query('user_by_external_id')
+def user_by_external_id(dataset):
+    return User.objects.filter(external_id=dataset.user_ids[0])
+
+
+@canonical_query('user_by_login')
+def user_by_login(dataset):
+    return User.objects.filter(login='admin')
+
+
+@canonical_query('answers_by_user')
+def answers_by_user(dataset):
+    user_id = User.objects.filter(external_id=dataset.user_ids[0]).values_list('id', flat=True).first()
+    return filter_answers(user_id).order_by('-created', '-id')[:100]
+
+
+@canonical_query('survey_list')
+def survey_list(dataset):
+    return Survey.objects.order_by('-created', '-id')[:100]
+
+
+@canonical_query('open_surveys')
+def open_surveys(dataset):
+    return open_surveys_queryset(date.today())
+
+
+@canonical_query('survey_questions')
+def survey_questions(dataset):
+    return Question.objects.filter(survey_id=dataset.survey_ids[0], is_deleted=False).order_by('created', 'id')
+
+
+@canonical_query('question_list')
+def question_list(dataset):
+    return Question.objects.filter(is_deleted=False).order_by('created', 'id')[:100]
+
+
+@canonical_query('question_choices')
+def question_choices(dataset):
+    return AnswerChoice.objects.filter(question_id__in=[
+        question_id for question_id, _ in dataset.questions[dataset.survey_ids[0]]
+    ])
+
+
+@canonical_query('survey_export')
+def survey_export(dataset):
+    return export_queryset(dataset.survey_ids[0])
+
+
+@canonical_query('survey_results')
+def survey_results(dataset):
+    return SurveyResult.objects.filter(survey_id=dataset.survey_ids[0])
+
+
+def explain(queryset, analyze=False):
+    """
+    План запроса текстом, ANALYZE только для Postgres
+    """
+    if connection.vendor == 'postgresql':
+        return queryset.explain(analyze=analyze)
+    return queryset.explain()
+
+
+def sequential_scans(plan):
+    """
+    Таблицы, которые план читает полным просмотром
+    """
+    pattern = POSTGRES_SCAN if connection.vendor == 'postgresql' else SQLITE_SCAN
+    return sorted(set(pattern.findall(plan)))
+
+
+def advise(dataset, analyze=False, names=None):
+    """
+    :return: список (имя запроса, таблицы с полным просмотром, план)
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+    report = []
+    for name, func in CANONICAL_QUERIES.items():
+        if names and name not in names:
+            continue
+        plan = explain(func(dataset), analyze)
+        report.append((name, sequential_scans(plan), plan))
+    return report
@@ -0,0 +1,197 @@
+"""
+Выборка ответов пользователя для /api/surveys/answers
+
+Строки читаются через values() с аннотациями, сразу в виде полей ответа API,
+без создания экземпляров моделей. Параметр fields оставляет только нужные
+поля (и нужные JOIN). Ответы сгруппированы по опросам, group_by=none
+отдает их одним списком.
+"""
+import json
+from collections import OrderedDict
+
+from django.db.models import F, TextField, Value
+from django.db.models.functions import Coalesce, NullIf
+
+from .models import Answer, Submission
+from .submissions import aexpand, compact_storage, expand, iter_expanded
+
+ANSWER_OUTPUT = ('survey_id', 'question_id', 'question', 'answer')
+# Поле ответа API -> колонка values() для хранения строкой на ответ
+ANSWER_COLUMNS = {
+    'survey_id': 'survey_id',
+    'question_id': 'question_id',
+    'question': 'question_text',
+    'answer': 'answer',
+}
+ANSWER_ANNOTATIONS = {
+    'question_text': F('question__body'),
+    'answer': Coalesce(NullIf('body', Value('')), 'choice__body', output_field=TextField()),
+}
+SUBMISSION_COLUMNS = ('id', 'survey_id', 'choices', 'created', 'user_id')
+
+GROUP_BY_SURVEY = 'survey'
+GROUP_BY_NONE = 'none'
+
+STREAM_JSON = 'json'
+STREAM_NDJSON = 'ndjson'
+STREAM_CONTENT_TYPES = {
+    STREAM_JSON: 'application/json',
+    STREAM_NDJSON: 'application/x-ndjson',
+}
+
+
+def filter_answers(user_id, survey_id=None, since=None):
+    """
+    Ответы пользователя с фильтрами, выполняемыми в SQL
+    :param int user_id: id пользователя (не external_id)
+    :param int survey_id: только ответы на этот опрос
+    :param datetime since: только ответы, данные не раньше этого момента
+    :return: QuerySet ответов или, при компактном хранении, прохождений
+    """
+    if compact_storage():
+        answers = Submission.objects.filter(user_id=user_id)
+        if survey_id is not None:
+            answers = answers.filter(survey_id=survey_id)
+    else:
+        answers = Answer.objects.filter(user_id=user_id)
+        if survey_id is not None:
+            answers = answers.filter(survey_id=survey_id)
+    if since is not None:
+        answers = answers.filter(created__gte=since)
+    return answers
+
+
+def select_fields(fields, group_by=None):
+    """
+    Поля, которые нужно прочитать: при группировке по опросу survey_id нужен всегда
+    """
+    fields = tuple(fields or ANSWER_OUTPUT)
+    if group_by == GROUP_BY_SURVEY and 'survey_id' not in fields:
+        fields += ('survey_id',)
+    return fields
+
+
+def answer_values(answers, fields):
+    """
+    values() с колонками для полей fields, а также id и created для пагинации
+    :param answers: результат filter_answers
+    """
+    if compact_storage():
+        return answers.values(*SUBMISSION_COLUMNS)
+    columns = [ANSWER_COLUMNS[field] for field in fields]
+    return answers.annotate(**{
+        column: ANSWER_ANNOTATIONS[column] for column in columns if column in ANSWER_ANNOTATIONS
+    }).values('id', 'created', *columns)
+
+
+def row_item(row, fields):
+    return {field: row[ANSWER_COLUMNS[field]] for field in fields}
+
+
+def compact_item(item, fields):
+    item = dict(item, answer=item['body'] if item['body'] else item['choice'])
+    return {field: item[field] for field in fields}
+
+
+def answer_items(rows, fields):
+    """
+    Ответы API для страницы строк answer_values
+    """
+    if compact_storage():
+        return [compact_item(item, fields) for item in expand([
+            tuple(row[column] for column in SUBMISSION_COLUMNS) for row in rows
+        ])]
+    return [row_item(row, fields) for row in rows]
+
+
+async def aanswer_items(rows, fields):
+    """
+    answer_items для async view
+    """
+    if compact_storage():
+        return [compact_item(item, fields) for item in await aexpand([
+            tuple(row[column] for column in SUBMISSION_COLUMNS) for row in rows
+        ])]
+    return answer_items(rows, fields)
+
+
+def answer_rows(answers, chunk_size, fields=ANSWER_OUTPUT, group_by=None):
+    """
+    Поток ответов API от новых к старым, при группировке - подряд по опросам
+    :param answers: результат filter_answers
+    """
+    ordering = ('survey_id', '-created', '-id') if group_by == GROUP_BY_SURVEY else ('-created', '-id')
+    rows = answer_values(answers.order_by(*ordering), fields).iterator(chunk_size=chunk_size)
+    if not compact_storage():
+        return (row_item(row, fields) for row in rows)
+    submissions = (tuple(row[column] for column in SUBMISSION_COLUMNS) for row in rows)
+    return (compact_item(item, fields) for item in iter_expanded(submissions, chunk_size))
+
+
+def group_by_survey(items, fields):
+    """
+    Группирует ответы по survey_id в порядке первого появления опроса
+    survey_id остается только в группе
+    """
+    groups = OrderedDict()
+    for item in items:
+        groups.setdefault(item['survey_id'], []).append(item)
+    return [
+        {'survey_id': survey_id, 'answers': [strip_survey(item, fields) for item in group]}
+        for survey_id, group in groups.items()
+    ]
+
+
+def strip_survey(item, fields):
+    return {field: item[field] for field in fields if field != 'survey_id'}
+
+
+def consecutive_groups(items, fields):
+    """
+    Группы подряд идущих ответов одного опроса, для потока, упорядоченного по опросу
+    """
+    survey_id = None
+    group = []
+    for item in items:
+        if group and item['survey_id'] != survey_id:
+            yield {'survey_id': survey_id, 'answers': group}
+            group = []
+        survey_id = item['survey_id']
+        group.append(strip_survey(item, fields))
+    if group:
+        yield {'survey_id': survey_id, 'answers': group}
+
+
+def stream_answers(external_id, answers, stream_format, chunk_size, fields=None, group_by=None):
+    """
+    Генератор ответа для StreamingHttpResponse
+    Строки читаются курсором порциями по chunk_size, поэтому память
+    процесса не зависит от числа ответов пользователя
+    :param stream_format: STREAM_JSON - тот же объект, что и без потоковой отдачи,
+        STREAM_NDJSON - по одному ответу (или группе опроса) в строке
+    :param fields: поля ответа, по умолчанию ANSWER_OUTPUT
+    :param group_by: GROUP_BY_SURVEY - ответы сгруппированы по опросам
+    """
+    output = tuple(fields or ANSWER_OUTPUT)
+    items = answer_rows(answers, chunk_size, select_fields(fields, group_by), group_by)
+    if group_by == GROUP_BY_SURVEY:
+        items = consecutive_groups(items, output)
+    buffer = []
+    if stream_format == STREAM_JSON:
+        yield f'{{"user_id":{json.dumps(external_id)},"results":['
+        separator = ''
+        for item in items:
+            buffer.append(separator + json.dumps(item, ensure_ascii=False))
+            separator = ','
+            if len(buffer) >= chunk_size:
+                yield ''.join(buffer)
+                buffer = []
+        buffer.append(']}')
+    else:
+        for item in items:
+            buffer.append(json.dumps(item, ensure_ascii=False) + '\n')
+            if len(buffer) >= chunk_size:
+                yield ''.join(buffer)
+                buffer = []
+    if buffer:
+        yield ''.join(buffer)
@@ -0,0 +1,170 @@
+"""
+Асинхронные версии самых частых запросов респондентов
+
+Те же ответы, что у SurveyViewset.retrieve, take и get_answers, но view
+написаны на async def и читают БД асинхронным ORM, поэтому под ASGI
+(uvicorn config.asgi:application) ожидание БД не занимает поток на запрос.
+DRF не поддерживает асинхронные view, поэтому это обычные view Django:
+аутентификация, проверка параметров и ответы об ошибках сделаны вручную
+в том же формате, что и у DRF. Через sync_to_async выполняются только записи
+в БД и разбор старых токенов без роли в claims.
+"""
+import json
+from collections import OrderedDict
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotAllowed
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+
+from .answers import aanswer_items, answer_values, filter_answers, select_fields, group_by_survey, \
+    ANSWER_OUTPUT, GROUP_BY_SURVEY
+from .authentication import JWTAuthentication, has_user_claims, revoked_users
+from .cache import aget_survey_definition, survey_is_open
+from .ingestion import afind_user_id, asurvey_questions, get_answer_queue, idempotency_key, write_submissions
+from .models import Survey
+from .pagination import AnswerPagination
+from .renderers import render_json
+from .responses import SURVEY_CLOSED, STREAM_NOT_SUPPORTED
+from .serializers import AnswerSerializerRequest, TakeSurveySerializer, ValidationError
+
+
+def async_view(*methods):
+    """
+    Ограничивает методы view и, как APIView, отключает проверку CSRF
+    require_http_methods и csrf_exempt в Django 4.2 не поддерживают async def
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            return await view(request, *args, **kwargs)
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+def json_response(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(render_json(data), status=status_code, content_type='application/json')
+
+
+def error_response(exc):
+    """
+    Ответ об ошибке в формате обработчика исключений DRF
+    """
+    detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return json_response(detail, exc.status_code)
+
+
+async def authenticate(request):
+    """
+    Пользователь по JWT, как у JWTAuthentication в DRF
+    Токен с ролью и id пользователя разбирается без обращения к БД, в поток уходят
+    только старые токены без этих claims
+    :return: пользователь или None
+    """
+    backend = JWTAuthentication()
+    header = backend.get_header(request)
+    raw_token = backend.get_raw_token(header) if header is not None else None
+    if raw_token is None:
+        return None
+    try:
+        validated_token = backend.get_validated_token(raw_token)
+        if has_user_claims(validated_token):
+            await revoked_users.arefresh()
+            return backend.get_user(validated_token)
+        return await sync_to_async(backend.get_user)(validated_token)
+    except exceptions.APIException:
+        return None
+
+
+@async_view('GET')
+async def retrieve(request, pk):
+    """
+    Получение опроса, как SurveyViewset.retrieve
+    """
+    if await authenticate(request) is None:
+        return error_response(exceptions.NotAuthenticated())
+    definition = await aget_survey_definition(pk)
+    if definition is None:
+        return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+    response = get_conditional_response(request, etag=definition.etag, last_modified=definition.last_modified)
+    if response is None:
+        response = HttpResponse(definition.content, content_type='application/json')
+    response['ETag'] = definition.etag
+    response['Last-Modified'] = http_date(definition.last_modified)
+    return response
+
+
+@async_view('POST')
+async def take(request, pk):
+    """
+    Прохождение опроса, как SurveyViewset.take
+    """
+    survey = await Survey.objects.filter(id=pk).afirst()
+    if survey is None or not survey_is_open(survey, timezone.localdate()):
+        return error_response(ValidationError(detail=SURVEY_CLOSED, status_code=status.HTTP_404_NOT_FOUND))
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return error_response(exceptions.ParseError())
+    questions = await asurvey_questions([survey.id])
+    serializer = TakeSurveySerializer(data=data, context={'questions': questions[survey.id]})
+    try:
+        if not serializer.is_valid():
+            return json_response(serializer.errors, status.HTTP_400_BAD_REQUEST)
+    except exceptions.APIException as e:
+        return error_response(e)
+    key = idempotency_key(request.headers.get('Idempotency-Key'))
+    if settings.ANSWER_QUEUE_ENABLED:
+        await sync_to_async(get_answer_queue().put)(dict(serializer.validated_data, survey_id=survey.id), key=key)
+        return HttpResponse(status=status.HTTP_202_ACCEPTED)
+    await sync_to_async(write_submissions)([dict(serializer.validated_data, survey_id=survey.id, key=key)])
+    return HttpResponse(status=status.HTTP_201_CREATED)
+
+
+@async_view('GET')
+async def get_answers(request):
+    """
+    Ответы пользователя по страницам, как SurveyViewset.get_answers без потоковой выдачи
+    """
+    params = AnswerSerializerRequest(data=request.GET)
+    try:
+        if not params.is_valid():
+            return json_response(params.errors, status.HTTP_400_BAD_REQUEST)
+    except exceptions.APIException as e:
+        return error_response(e)
+    if params.validated_data.get('stream'):
+        return json_response({'stream': [STREAM_NOT_SUPPORTED]}, status.HTTP_400_BAD_REQUEST)
+    external_id = params.validated_data['user_id']
+    user_id = await afind_user_id(external_id)
+    if user_id is None:
+        return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+    answers = filter_answers(
+        user_id,
+        survey_id=params.validated_data.get('survey_id'),
+        since=params.validated_data.get('since')
+    )
+    fields = params.validated_data.get('fields')
+    group_by = params.validated_data.get('group_by')
+    paginator = AnswerPagination()
+    try:
+        queryset = paginator.page_queryset(answer_values(answers, select_fields(fields, group_by)), Request(request))
+    except exceptions.APIException as e:
+        return error_response(e)
+    rows = paginator.set_page([row async for row in queryset])
+    data = await aanswer_items(rows, select_fields(fields, group_by))
+    if group_by == GROUP_BY_SURVEY:
+        data = group_by_survey(data, fields or ANSWER_OUTPUT)
+    return json_response(OrderedDict([
+        ('user_id', external_id),
+        ('next', paginator.get_next_link()),
+        ('previous', paginator.get_previous_link()),
+        ('results', data)
+    ]))
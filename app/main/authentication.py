@@ -1,12 +1,110 @@
+import threading
+import time
+
+from django.conf import settings
+from rest_framework import exceptions
 from rest_framework_simplejwt import authentication
 
+from main.models import User, UserStatus
+
+ROLE_CLAIM = 'role'
+USER_CLAIM = 'uid'
+
+
+class RevokedUsers:
+    """
+    Множество id заблокированных и удаленных пользователей,
+    перечитывается из БД не чаще раза в ttl секунд
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._ids = frozenset()
+        self._expires = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, user_id):
+        if self.expired():
+            with self._lock:
+                if self.expired():
+                    self.set(self.queryset())
+        return user_id in self._ids
+
+    async def arefresh(self):
+        """
+        Перечитывает множество асинхронным ORM, чтобы проверка в async view не шла в БД
+        """
+        if self.expired():
+            self.set([user_id async for user_id in self.queryset()])
+
+    def expired(self):
+        return time.monotonic() >= self._expires
+
+    def queryset(self):
+        return User.objects.filter(
+            status__in=(UserStatus.BLOCKED, UserStatus.DELETED)
+        ).values_list('id', flat=True)
+
+    def set(self, ids):
+        self._ids = frozenset(ids)
+        self._expires = time.monotonic() + self.ttl
+
+    def reset(self):
+        self._expires = 0
+
+
+revoked_users = RevokedUsers(settings.REVOKED_USERS_TTL)
+
+
+class TokenRole:
+    """
+    Данные main.models.User, нужные для проверки прав, из claims токена
+    """
+
+    def __init__(self, user_id, role):
+        self.id = self.pk = user_id
+        self.role = role
+
+
+class TokenUser:
+    """
+    Пользователь запроса, собранный из токена без обращения к БД
+    user повторяет связь auth_user -> main.models.User для roles_required
+    """
+    is_active = True
+    is_authenticated = True
+    is_anonymous = False
+    is_staff = False
+    is_superuser = False
+
+    def __init__(self, validated_token):
+        self.id = self.pk = validated_token[authentication.api_settings.USER_ID_CLAIM]
+        self.user = TokenRole(validated_token[USER_CLAIM], validated_token[ROLE_CLAIM])
+
+    def __str__(self):
+        return f'user_{self.user.id}'
+
+
+def add_user_claims(token, user):
+    """
+    Добавляет в токен роль и id пользователя для TokenUser
+    """
+    token[ROLE_CLAIM] = user.role
+    token[USER_CLAIM] = user.pk
+    return token
+
+
+def has_user_claims(validated_token):
+    return ROLE_CLAIM in validated_token and USER_CLAIM in validated_token
+
 
 class JWTAuthentication(authentication.JWTAuthentication):
     def get_user(self, validated_token):
+        if has_user_claims(validated_token):
+            if validated_token[USER_CLAIM] in revoked_users:
+                raise exceptions.AuthenticationFailed('Пользователь заблокирован', code='user_inactive')
+            return TokenUser(validated_token)
         try:
             return super().get_user(validated_token)
         except Exception:
             return None
-
-
-
@@ -0,0 +1,105 @@
+"""
+Замеры производительности API опросов
+
+Каждый сценарий - модуль пакета с функцией run(options),
+возвращающей словарь с результатами замеров.
+Запуск: python manage.py bench <сценарий> [--output результат.json] [--compare прошлый.json]
+"""
+import math
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.runner import DiscoverRunner
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+
+SCENARIOS = (
+    'endpoints',
+    'take',
+    'export',
+    'login',
+    'concurrency',
+    'connections',
+    'storage',
+    'answers',
+    'serializers',
+)
+
+# Метрики, рост которых означает ухудшение, и метрики, ухудшение которых - падение
+HIGHER_IS_WORSE = (
+    'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_call', 'heap_mb_per_1k', 'bytes_per_answer', 'rebuild_ms', 'read_ms'
+)
+LOWER_IS_WORSE = ('throughput', 'rows_per_second', 'logins_per_core', 'surveys_per_second')
+
+
+def percentile(values, p):
+    """
+    Перцентиль p (0-100) по отсортированной копии значений
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = max(0, math.ceil(len(ordered) * p / 100) - 1)
+    return ordered[index]
+
+
+def measure(func, repeat, database=connection):
+    """
+    Вызывает func repeat раз и собирает задержки и число запросов к БД
+    :param func: функция без аргументов
+    :param int repeat: число повторов
+    :param database: соединение Django, запросы которого считаются
+    """
+    timings = []
+    queries = 0
+    for _ in range(repeat):
+        with CaptureQueriesContext(database) as context:
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        queries += len(context.captured_queries)
+    total = sum(timings)
+    return {
+        'calls': repeat,
+        'queries_per_call': queries / repeat if repeat else 0,
+        'throughput': repeat / total if total else 0.0,
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p95_ms': percentile(timings, 95) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+    }
+
+
+@contextmanager
+def isolated_database():
+    """
+    Создает отдельную тестовую БД, чтобы замеры не трогали рабочие данные
+    """
+    runner = DiscoverRunner(interactive=False, verbosity=0)
+    setup_test_environment()
+    old_config = runner.setup_databases()
+    try:
+        yield
+    finally:
+        runner.teardown_databases(old_config)
+        teardown_test_environment()
+
+
+def compare(current, baseline, threshold, path=''):
+    """
+    Сравнивает результаты двух запусков
+    :param float threshold: допустимое относительное ухудшение, например 0.2
+    :return: список описаний регрессий
+    """
+    regressions = []
+    for key, value in current.items():
+        old = baseline.get(key) if isinstance(baseline, dict) else None
+        name = f'{path}.{key}' if path else key
+        if isinstance(value, dict):
+            regressions.extend(compare(value, old or {}, threshold, name))
+        elif not isinstance(old, (int, float)) or not old:
+            continue
+        elif key in HIGHER_IS_WORSE and value > old * (1 + threshold):
+            regressions.append(f'{name}: {old:.2f} -> {value:.2f}')
+        elif key in LOWER_IS_WORSE and value < old * (1 - threshold):
+            regressions.append(f'{name}: {old:.2f} -> {value:.2f}')
+    return regressions
@@ -0,0 +1,67 @@
+"""
+Замер сборки ответов /api/surveys/answers для одного пользователя с --rows ответами:
+прежний обход экземпляров моделей против values() с аннотациями
+"""
+import time
+
+from django.db import transaction
+
+from main.answers import GROUP_BY_SURVEY, STREAM_JSON, STREAM_NDJSON, answer_items, answer_values, \
+    filter_answers, group_by_survey, select_fields, stream_answers
+from main.benchmarks.data import generate
+from main.models import User
+
+ROWS = 100000
+
+
+def legacy_items(answers):
+    """
+    Прежняя сборка: экземпляры Answer с select_related и обход атрибутов
+    """
+    return [
+        {
+            'survey_id': answer.question.survey.id,
+            'question_id': answer.question.id,
+            'question': answer.question.body,
+            'answer': answer.body if answer.body else answer.choice and answer.choice.body
+        } for answer in answers.select_related('question', 'choice', 'question__survey').order_by('-created', '-id')
+    ]
+
+
+def rows_per_second(func, rows):
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    return {
+        'seconds': elapsed,
+        'rows_per_second': rows / elapsed if elapsed else 0.0,
+    }
+
+
+def run(options):
+    rows = options['rows']
+    chunk_size = options['chunk_size']
+    with transaction.atomic():
+        dataset = generate(options['surveys'], options['questions'], options['choices'], 1, rows)
+        user_id = User.objects.get(external_id=dataset.user_ids[0]).id
+        answers = filter_answers(user_id)
+        fields = select_fields(None)
+        grouped_fields = select_fields(('answer',), GROUP_BY_SURVEY)
+        results = {
+            'rows': rows,
+            'legacy': rows_per_second(lambda: legacy_items(answers), rows),
+            'values': rows_per_second(
+                lambda: answer_items(answer_values(answers.order_by('-created', '-id'), fields), fields), rows
+            ),
+            'grouped_projection': rows_per_second(lambda: group_by_survey(
+                answer_items(answer_values(answers, grouped_fields), grouped_fields), ('answer',)
+            ), rows),
+            'stream_json': rows_per_second(
+                lambda: list(stream_answers(dataset.user_ids[0], answers, STREAM_JSON, chunk_size)), rows
+            ),
+            'stream_ndjson_grouped': rows_per_second(lambda: list(stream_answers(
+                dataset.user_ids[0], answers, STREAM_NDJSON, chunk_size, ('answer',), GROUP_BY_SURVEY
+            )), rows),
+        }
+        transaction.set_rollback(True)
+    return results
@@ -0,0 +1,165 @@
+"""
+Сравнение синхронных и асинхронных view респондента при множестве одновременных запросов
+
+Синхронные view (/api/surveys/...) вызываются из отдельного потока на запрос,
+как в WSGI, асинхронные (/api/async/surveys/...) - корутинами в одном цикле
+событий через AsyncClient, как под ASGI. Для retrieve, take и answers при 10
+и 100 запросах в полете сценарий показывает пропускную способность, задержки,
+пик памяти Python на 1000 запросов и рост RSS процесса.
+"""
+import asyncio
+import resource
+import threading
+import time
+import tracemalloc
+from itertools import count
+
+from django.conf import settings
+from django.db import connection
+from django.test import AsyncClient
+from rest_framework.test import APIClient
+
+from main.actions import create_admin_user
+from main.benchmarks import percentile
+from main.benchmarks.data import generate
+
+IN_FLIGHT = (10, 100)
+SYNC_PREFIX = '/api/surveys'
+ASYNC_PREFIX = '/api/async/surveys'
+
+
+def respondent_requests(dataset):
+    """
+    :return: имя -> функция номера запроса, возвращающая (метод, путь без префикса, тело, ожидаемый статус)
+    """
+    new_user_ids = count(len(dataset.user_ids) + 1)
+
+    def retrieve(number):
+        survey_id = dataset.survey_ids[number % len(dataset.survey_ids)]
+        return 'get', f'/{survey_id}', None, 200
+
+    def take(number):
+        survey_id = dataset.survey_ids[number % len(dataset.survey_ids)]
+        return 'post', f'/{survey_id}/take', {
+            'user_id': next(new_user_ids),
+            'answers': [
+                {'question_id': question_id, 'choice_id': choice_id}
+                for question_id, choice_id in dataset.questions[survey_id]
+            ]
+        }, 201
+
+    def answers(number):
+        user_id = dataset.user_ids[number % len(dataset.user_ids)]
+        return 'get', f'/answers?user_id={user_id}', None, 200
+
+    return {'retrieve': retrieve, 'take': take, 'answers': answers}
+
+
+def run_sync(request, in_flight, token):
+    """
+    Запускает in_flight потоков, стартующих одновременно, по одному запросу в каждом
+    """
+    barrier = threading.Barrier(in_flight)
+    timings = []
+    errors = []
+
+    def worker(number):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        method, path, data, expected = request(number)
+        barrier.wait()
+        started = time.perf_counter()
+        try:
+            response = getattr(client, method)(SYNC_PREFIX + path, data, format='json')
+            if response.status_code != expected:
+                errors.append(response.status_code)
+        finally:
+            timings.append(time.perf_counter() - started)
+            connection.close()
+
+    def run_threads():
+        threads = [threading.Thread(target=worker, args=(number,)) for number in range(in_flight)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    return measure(run_threads, in_flight, timings, errors)
+
+
+def run_async(request, in_flight, token):
+    """
+    Запускает in_flight корутин в одном цикле событий, по одному запросу в каждой
+    """
+    timings = []
+    errors = []
+
+    headers = {'authorization': f'Bearer {token}'}
+
+    async def call(client, number):
+        method, path, data, expected = request(number)
+        started = time.perf_counter()
+        try:
+            if method == 'get':
+                response = await client.get(ASYNC_PREFIX + path, headers=headers)
+            else:
+                response = await client.post(
+                    ASYNC_PREFIX + path, data, content_type='application/json', headers=headers
+                )
+            if response.status_code != expected:
+                errors.append(response.status_code)
+        finally:
+            timings.append(time.perf_counter() - started)
+
+    async def run_coroutines():
+        client = AsyncClient()
+        await asyncio.gather(*(call(client, number) for number in range(in_flight)))
+
+    return measure(lambda: asyncio.run(run_coroutines()), in_flight, timings, errors)
+
+
+def measure(func, in_flight, timings, errors):
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    started = time.perf_counter()
+    func()
+    total = time.perf_counter() - started
+    heap_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if errors:
+        raise RuntimeError(f'Ошибочные ответы: {errors[:10]}')
+    return {
+        'calls': in_flight,
+        'throughput': in_flight / total if total else 0.0,
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+        'heap_mb_per_1k': heap_peak / in_flight * 1000 / 2 ** 20,
+        'rss_growth_mb': (rss_after - rss_before) / 1024,
+    }
+
+
+def run(options):
+    dataset = generate(
+        options['surveys'],
+        options['questions'],
+        options['choices'],
+        options['respondents'],
+        options['answers']
+    )
+    create_admin_user(settings.ADMIN_LOGIN, settings.ADMIN_PASSWORD)
+    token = APIClient().post('/api/login', {
+        'login': settings.ADMIN_LOGIN,
+        'password': settings.ADMIN_PASSWORD
+    }, format='json').data['access_token']
+    requests = respondent_requests(dataset)
+    return {
+        f'{in_flight}_in_flight': {
+            name: {
+                'sync': run_sync(request, in_flight, token),
+                'async': run_async(request, in_flight, token),
+            }
+            for name, request in requests.items()
+        }
+        for in_flight in IN_FLIGHT
+    }
@@ -0,0 +1,57 @@
+"""
+Замер стоимости соединения с БД для каждой настройки DATABASES:
+новое соединение на каждый запрос (CONN_MAX_AGE = 0), постоянное соединение
+(CONN_MAX_AGE > 0) и движок с пулом main.pool (только для Postgres)
+
+Для каждой настройки создается отдельное подключение Django с копией
+settings_dict основной БД. Вызов - ORM-запрос опроса по первичному ключу,
+как в retrieve, и close_if_unusable_or_obsolete, как по окончании запроса.
+Соединение с SQLite в памяти Django не закрывает, поэтому без Postgres
+fresh не отличается от persistent
+"""
+from itertools import cycle
+
+from django.db import connection, connections
+
+from main.benchmarks import measure
+from main.benchmarks.data import generate
+from main.models import Survey
+from main.pool import close_pool
+
+PERSISTENT_MAX_AGE = 600
+
+
+def configurations():
+    """
+    Настройки DATABASES для замера, движок с пулом - только поверх Postgres
+    """
+    configs = {
+        'fresh': {'CONN_MAX_AGE': 0},
+        'persistent': {'CONN_MAX_AGE': PERSISTENT_MAX_AGE},
+    }
+    if connection.vendor == 'postgresql':
+        configs['pooled'] = {'ENGINE': 'main.pool', 'CONN_MAX_AGE': 0}
+    return configs
+
+
+def run(options):
+    dataset = generate(options['surveys'], 1, 1, 1, 0)
+    survey_ids = cycle(dataset.survey_ids)
+    results = {}
+    for name, config in configurations().items():
+        alias = f'bench_{name}'
+        connections.settings[alias] = dict(connection.settings_dict, **config)
+        database = connections[alias]
+
+        def request():
+            Survey.objects.using(alias).filter(id=next(survey_ids)).first()
+            database.close_if_unusable_or_obsolete()
+
+        try:
+            results[name] = measure(request, options['repeat'], database)
+        finally:
+            database.close()
+            del connections[alias]
+            del connections.settings[alias]
+            close_pool(alias)
+    return results
@@ -0,0 +1,65 @@
+"""
+Генерация синтетических данных для замеров
+"""
+from collections import namedtuple
+
+from main.importing import create_surveys
+from main.models import Answer, AnswerChoice, Question, QuestionType, User
+
+Dataset = namedtuple('Dataset', ('survey_ids', 'questions', 'user_ids'))
+
+BATCH_SIZE = 10000
+
+
+def generate(surveys, questions, choices, respondents, answers):
+    """
+    Создает опросы, пользователей и ответы
+    :param int surveys: число опросов
+    :param int questions: число вопросов в опросе
+    :param int choices: число вариантов ответа у вопроса с выбором
+    :param int respondents: число пользователей
+    :param int answers: число ответов каждого пользователя
+    :return: Dataset, где questions - словарь survey_id -> список пар (question_id, choice_id)
+    """
+    created = create_surveys([
+        {
+            'name': f'Синтетический опрос {n}',
+            'start_date': '2021-01-01',
+            'end_date': '2031-01-01',
+            'questions': [
+                {
+                    'body': f'Вопрос {q}',
+                    'question_type': QuestionType.CHOICE,
+                    'choices': [f'Вариант {c}' for c in range(choices)]
+                } for q in range(questions)
+            ]
+        } for n in range(surveys)
+    ])
+    survey_ids = [survey.id for survey in created]
+    first_choices = {}
+    for question_id, choice_id in AnswerChoice.objects.filter(
+            question__survey_id__in=survey_ids
+    ).order_by('-id').values_list('question_id', 'id'):
+        first_choices[question_id] = choice_id
+    survey_questions = {survey_id: [] for survey_id in survey_ids}
+    for survey_id, question_id in Question.objects.filter(
+            survey_id__in=survey_ids
+    ).order_by('id').values_list('survey_id', 'id'):
+        survey_questions[survey_id].append((question_id, first_choices[question_id]))
+
+    User.objects.bulk_create([User(external_id=n, login='') for n in range(respondents)])
+    user_ids = list(User.objects.filter(external_id__in=range(respondents)).values_list('id', flat=True))
+    all_questions = [
+        (survey_id, question_id, choice_id)
+        for survey_id in survey_ids for question_id, choice_id in survey_questions[survey_id]
+    ]
+    batch = []
+    for user_id in user_ids:
+        for n in range(answers):
+            survey_id, question_id, choice_id = all_questions[n % len(all_questions)]
+            batch.append(Answer(user_id=user_id, survey_id=survey_id, question_id=question_id, choice_id=choice_id))
+            if len(batch) >= BATCH_SIZE:
+                Answer.objects.bulk_create(batch)
+                batch = []
+    Answer.objects.bulk_create(batch)
+    return Dataset(survey_ids, survey_questions, list(range(respondents)))
@@ -0,0 +1,62 @@
+"""
+Замер задержек и числа запросов основных эндпоинтов через URLconf приложения
+"""
+from itertools import count, cycle
+
+from django.conf import settings
+from rest_framework.test import APIClient
+
+from main.actions import create_admin_user
+from main.benchmarks import measure
+from main.benchmarks.data import generate
+
+
+def request(client, method, url, expected, **kwargs):
+    def call():
+        response = getattr(client, method)(url() if callable(url) else url, format='json', **kwargs)
+        if response.status_code != expected:
+            raise RuntimeError(f'{method.upper()} {response.status_code}: {response.content[:200]}')
+    return call
+
+
+def run(options):
+    dataset = generate(
+        options['surveys'],
+        options['questions'],
+        options['choices'],
+        options['respondents'],
+        options['answers']
+    )
+    create_admin_user(settings.ADMIN_LOGIN, settings.ADMIN_PASSWORD)
+    credentials = {'login': settings.ADMIN_LOGIN, 'password': settings.ADMIN_PASSWORD}
+    anonymous = APIClient()
+    admin = APIClient()
+    token = admin.post('/api/login', credentials, format='json').data['access_token']
+    admin.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    survey_ids = cycle(dataset.survey_ids)
+    user_ids = cycle(dataset.user_ids)
+    new_user_ids = count(len(dataset.user_ids))
+    take_surveys = cycle(dataset.survey_ids)
+
+    def take():
+        survey_id = next(take_surveys)
+        response = anonymous.post(f'/api/surveys/{survey_id}/take', {
+            'user_id': next(new_user_ids),
+            'answers': [
+                {'question_id': question_id, 'choice_id': choice_id}
+                for question_id, choice_id in dataset.questions[survey_id]
+            ]
+        }, format='json')
+        if response.status_code not in (201, 202):
+            raise RuntimeError(f'take {response.status_code}: {response.content[:200]}')
+
+    scenarios = {
+        'login': request(anonymous, 'post', '/api/login', 200, data=credentials),
+        'list': request(admin, 'get', '/api/surveys', 200),
+        'retrieve': request(admin, 'get', lambda: f'/api/surveys/{next(survey_ids)}', 200),
+        'take': take,
+        'answers': request(anonymous, 'get', lambda: f'/api/surveys/answers?user_id={next(user_ids)}', 200),
+        'results': request(admin, 'get', lambda: f'/api/surveys/{next(survey_ids)}/results', 200),
+    }
+    return {name: measure(func, options['repeat']) for name, func in scenarios.items()}
@@ -0,0 +1,79 @@
+"""
+Замер скорости выгрузки ответов опроса на синтетических данных,
+по умолчанию на ROWS ответах
+"""
+import os
+import tempfile
+import time
+
+from django.db import connection, transaction
+
+from main.export import available_formats, export_answers
+from main.models import Survey, Question, AnswerChoice, QuestionType, Answer, User
+
+ROWS = 10_000_000
+QUESTIONS = 20
+BATCH_SIZE = 10000
+
+
+def create_dataset(rows):
+    """
+    Опрос из QUESTIONS вопросов с выбором и rows ответами на него
+    """
+    survey = Survey.objects.create(name='Замер выгрузки', start_date='2021-01-01', end_date='2031-01-01')
+    choices = []
+    for number in range(QUESTIONS):
+        question = Question.objects.create(
+            survey=survey,
+            question_type=QuestionType.CHOICE,
+            body=f'Вопрос {number}'
+        )
+        choices.append((question.id, AnswerChoice.objects.create(question=question, body='Да').id))
+    respondents = rows // QUESTIONS + 1
+    User.objects.bulk_create([User(external_id=n, login='') for n in range(respondents)])
+    user_ids = list(User.objects.filter(external_id__isnull=False).values_list('id', flat=True))
+    if connection.vendor == 'postgresql':
+        # десятки миллионов строк быстрее собрать в БД, чем передавать пачками bulk_create
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                INSERT INTO {Answer._meta.db_table} (user_id, survey_id, question_id, choice_id, created)
+                SELECT (%s::bigint[])[n / %s + 1], %s, (%s::bigint[])[n %% %s + 1], (%s::bigint[])[n %% %s + 1], now()
+                FROM generate_series(0, %s - 1) AS n
+            """, [
+                user_ids, QUESTIONS, survey.id,
+                [question_id for question_id, _ in choices], QUESTIONS,
+                [choice_id for _, choice_id in choices], QUESTIONS,
+                rows
+            ])
+        return survey
+    batch = []
+    for n in range(rows):
+        question_id, choice_id = choices[n % QUESTIONS]
+        batch.append(Answer(
+            user_id=user_ids[n // QUESTIONS], survey_id=survey.id, question_id=question_id, choice_id=choice_id
+        ))
+        if len(batch) >= BATCH_SIZE:
+            Answer.objects.bulk_create(batch)
+            batch = []
+    Answer.objects.bulk_create(batch)
+    return survey
+
+
+def run(options):
+    rows = options['rows']
+    results = {'rows': rows}
+    with transaction.atomic():
+        survey = create_dataset(rows)
+        with tempfile.TemporaryDirectory() as tmp:
+            for export_format in available_formats():
+                path = os.path.join(tmp, f'answers.{export_format}')
+                started = time.perf_counter()
+                export_answers(survey.id, path, export_format, options['chunk_size'])
+                elapsed = time.perf_counter() - started
+                results[export_format] = {
+                    'seconds': elapsed,
+                    'rows_per_second': rows / elapsed if elapsed else 0.0,
+                    'bytes': os.path.getsize(path),
+                }
+        transaction.set_rollback(True)
+    return results
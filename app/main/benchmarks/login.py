@@ -0,0 +1,94 @@
+"""
+Замер входа: проверка пароля в потоке запроса, в пуле потоков и через кэш
+
+Клиенты - параллельные потоки, пользователи загружаются заранее,
+поэтому замеряется только проверка пароля без обращений к БД.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password
+
+from main.actions import create_admin_user
+from main.models import User
+from main.passwords import PasswordVerifier
+from main.benchmarks import percentile
+
+PASSWORD = 'bench-password'
+CLIENTS = (1, 4, 16)
+
+
+def legacy_login(verifier, user, password):
+    """
+    Прежний вход: KDF в потоке запроса при каждом вызове
+    """
+    return check_password(user.hash_password(password), user.auth_user.password)
+
+
+def pooled_login(verifier, user, password):
+    return verifier.check(user.hash_password(password), user.auth_user.password)
+
+
+def cached_login(verifier, user, password):
+    return verifier.verify(user, password)
+
+
+def warm_cache(verifier, users):
+    """
+    Повторные входы сервисов: каждый пароль уже проверялся
+    """
+    for user in users:
+        verifier.verify(user, PASSWORD)
+
+
+def run_clients(login, verifier, users, clients, repeat):
+    def client(offset):
+        timings = []
+        for number in range(repeat):
+            user = users[(offset + number) % len(users)]
+            started = time.perf_counter()
+            assert login(verifier, user, PASSWORD)
+            timings.append(time.perf_counter() - started)
+        return timings
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        timings = [t for result in executor.map(client, range(clients)) for t in result]
+    total = time.perf_counter() - started
+    throughput = len(timings) / total if total else 0.0
+    return {
+        'calls': len(timings),
+        'throughput': throughput,
+        'logins_per_core': throughput / (os.cpu_count() or 1),
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p95_ms': percentile(timings, 95) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+    }
+
+
+def run(options):
+    repeat = max(1, options['repeat'] // 10)
+    users = [
+        create_admin_user(f'bench_{number}', PASSWORD)
+        for number in range(min(options['respondents'], 20))
+    ]
+    users = list(User.objects.select_related('auth_user').filter(id__in=[user.id for user in users]))
+    results = {}
+    for clients in CLIENTS:
+        verifier = PasswordVerifier(
+            settings.LOGIN_WORKERS,
+            clients + settings.LOGIN_WORKERS,
+            settings.LOGIN_CACHE_SIZE,
+            settings.LOGIN_CACHE_TTL
+        )
+        result = {
+            'legacy': run_clients(legacy_login, verifier, users, clients, repeat),
+            'pooled': run_clients(pooled_login, verifier, users, clients, repeat),
+        }
+        warm_cache(verifier, users)
+        result['cached'] = run_clients(cached_login, verifier, users, clients, repeat)
+        results[f'{clients}_clients'] = result
+        verifier.executor.shutdown()
+    return results
@@ -0,0 +1,55 @@
+"""
+Замер сборки JSON опросов: вложенные сериализаторы DRF против деревьев из values()
+для опросов из 10, 100 и 1000 вопросов
+"""
+import time
+
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from main.benchmarks.data import generate
+from main.models import Survey
+from main.renderers import orjson, render_json
+from main.serializers import SurveySerializer
+from main.trees import SURVEY_COLUMNS, survey_trees
+
+TREE_SIZES = (10, 100, 1000)
+
+
+def drf_render(survey_id):
+    survey = Survey.objects.prefetch_related('questions__answer_choices').get(id=survey_id)
+    return JSONRenderer().render(SurveySerializer(survey).data)
+
+
+def fast_render(survey_id):
+    return render_json(survey_trees(Survey.objects.filter(id=survey_id).values(*SURVEY_COLUMNS))[0])
+
+
+def surveys_per_second(func, survey_id, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func(survey_id)
+    elapsed = time.perf_counter() - started
+    return {
+        'seconds': elapsed,
+        'surveys_per_second': repeat / elapsed if elapsed else 0.0,
+    }
+
+
+def run(options):
+    results = {'orjson': orjson is not None}
+    with transaction.atomic():
+        for size in TREE_SIZES:
+            survey_id = generate(1, size, options['choices'], 0, 0).survey_ids[0]
+            if drf_render(survey_id) != fast_render(survey_id):
+                raise AssertionError(f'JSON опроса из {size} вопросов отличается от SurveySerializer')
+            repeat = max(1, options['repeat'] * 10 // size)
+            drf = surveys_per_second(drf_render, survey_id, repeat)
+            fast = surveys_per_second(fast_render, survey_id, repeat)
+            results[f'questions_{size}'] = {
+                'drf': drf,
+                'fast': fast,
+                'speedup': fast['surveys_per_second'] / drf['surveys_per_second'] if drf['seconds'] else 0.0,
+            }
+        transaction.set_rollback(True)
+    return results
@@ -0,0 +1,94 @@
+"""
+Замер компактного хранения ответов против строки Answer на каждый ответ:
+размер таблиц, скорость записи прохождений, пересчета результатов и чтения ответов
+"""
+import time
+
+from django.db import connection, transaction
+from django.test.utils import override_settings
+
+from main.answers import answer_rows, filter_answers
+from main.benchmarks.data import generate
+from main.ingestion import write_submissions
+from main.models import Answer, AnswerChoice, Submission, SubmissionText, User
+from main.results import rebuild_results
+from main.submissions import STORAGE_COMPACT, STORAGE_ROWS
+
+TABLES = {
+    STORAGE_ROWS: (Answer,),
+    STORAGE_COMPACT: (Submission, SubmissionText),
+}
+BATCH_SIZE = 100
+
+
+def table_size(model):
+    """
+    Размер таблицы с индексами в байтах
+    """
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT pg_total_relation_size(%s)', [table])
+        else:
+            cursor.execute(
+                'SELECT SUM(pgsize) FROM dbstat WHERE name IN '
+                '(SELECT name FROM sqlite_master WHERE tbl_name = %s)',
+                [table]
+            )
+        return cursor.fetchone()[0] or 0
+
+
+def timed(func):
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+
+def run(options):
+    dataset = generate(options['surveys'], options['questions'], options['choices'], 0, 0)
+    survey_choices = {}
+    for survey_id, choice_id in AnswerChoice.objects.filter(
+            question__survey_id__in=dataset.survey_ids
+    ).values_list('question__survey_id', 'id'):
+        survey_choices.setdefault(survey_id, []).append(choice_id)
+    questions = dict(AnswerChoice.objects.filter(
+        question__survey_id__in=dataset.survey_ids
+    ).values_list('id', 'question_id'))
+
+    submissions = [
+        {
+            'user_id': respondent,
+            'answers': [
+                {'question_id': questions[choice_id], 'choice_id': choice_id}
+                for choice_id in survey_choices[survey_id][respondent % 2::2]
+            ]
+        }
+        for respondent in range(options['respondents'])
+        for survey_id in dataset.survey_ids
+    ]
+    ticks = sum(len(item['answers']) for item in submissions)
+
+    results = {}
+    for storage, models in TABLES.items():
+        with override_settings(ANSWER_STORAGE=storage), transaction.atomic():
+            write_time = sum(
+                timed(lambda: write_submissions(submissions[start:start + BATCH_SIZE]))
+                for start in range(0, len(submissions), BATCH_SIZE)
+            )
+            size = sum(table_size(model) for model in models)
+            rebuild_time = timed(lambda: rebuild_results(dataset.survey_ids))
+            user_ids = list(User.objects.filter(external_id__isnull=False).values_list('id', flat=True))
+            read_time = timed(lambda: [
+                list(answer_rows(filter_answers(user_id), 1000)) for user_id in user_ids
+            ])
+            results[storage] = {
+                'submissions': len(submissions),
+                'answers': ticks,
+                'bytes': size,
+                'bytes_per_answer': size / ticks if ticks else 0.0,
+                'rows_per_second': ticks / write_time if write_time else 0.0,
+                'rebuild_ms': rebuild_time * 1000,
+                'read_ms': read_time * 1000,
+            }
+            transaction.set_rollback(True)
+    return results
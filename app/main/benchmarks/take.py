@@ -0,0 +1,81 @@
+"""
+Замер записи ответов: построчные INSERT против одной пакетной вставки
+"""
+from itertools import count
+
+from django.db import transaction
+
+from main.models import Survey, Question, AnswerChoice, QuestionType, Answer, User
+from main.serializers import TakeSurveySerializer
+from main.benchmarks import measure
+
+ANSWER_COUNTS = (10, 50, 200)
+
+
+def create_survey(questions):
+    survey = Survey.objects.create(
+        name=f'Замер на {questions} вопросов',
+        start_date='2021-01-01',
+        end_date='2031-01-01'
+    )
+    question_ids = []
+    choice_ids = []
+    for number in range(questions):
+        question = Question.objects.create(
+            survey=survey,
+            question_type=QuestionType.CHOICE,
+            body=f'Вопрос {number}'
+        )
+        choice = AnswerChoice.objects.create(question=question, body='Да')
+        AnswerChoice.objects.create(question=question, body='Нет')
+        question_ids.append(question.id)
+        choice_ids.append(choice.id)
+    return survey, question_ids, choice_ids
+
+
+def legacy_take(survey, data):
+    """
+    Прежняя запись ответов: по одному INSERT на ответ без транзакции
+    """
+    user, created = User.objects.get_or_create(
+        external_id=data['user_id']
+    )
+    for item in data['answers']:
+        Answer.objects.create(
+            user_id=user.id,
+            survey_id=survey.id,
+            question_id=item['question_id'],
+            choice_id=item.get('choice_id'),
+            body=item.get('body')
+        )
+
+
+def bulk_take(survey, data):
+    serializer = TakeSurveySerializer(survey, data=data)
+    serializer.is_valid(raise_exception=True)
+    serializer.save()
+
+
+def run(options):
+    repeat = options['repeat']
+    user_ids = count(1)
+    results = {}
+    for answers in ANSWER_COUNTS:
+        with transaction.atomic():
+            survey, question_ids, choice_ids = create_survey(answers)
+
+            def payload():
+                return {
+                    'user_id': next(user_ids),
+                    'answers': [
+                        {'question_id': question_id, 'choice_id': choice_id}
+                        for question_id, choice_id in zip(question_ids, choice_ids)
+                    ]
+                }
+
+            results[f'{answers}_answers'] = {
+                'legacy': measure(lambda: legacy_take(survey, payload()), repeat),
+                'bulk': measure(lambda: bulk_take(survey, payload()), repeat),
+            }
+            transaction.set_rollback(True)
+    return results
@@ -0,0 +1,300 @@
+"""
+Кэш готовых JSON-описаний опросов
+
+Первый уровень - LRU в памяти процесса, второй - необязательный общий
+кэш Django (SURVEY_CACHE_BACKEND). При общем кэше в нем хранится номер
+ревизии опроса, поэтому сброс в одном процессе виден всем остальным.
+Без общего кэша сброс виден только своему процессу, поэтому записи
+живут не дольше SURVEY_CACHE_TTL секунд.
+
+Здесь же кэш множества открытых опросов для /api/surveys/active.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import date
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Survey
+from .renderers import render_json
+from .trees import SURVEY_COLUMNS, asurvey_trees, survey_tree
+
+SurveyDefinition = namedtuple('SurveyDefinition', ('content', 'etag', 'last_modified'))
+
+
+class LRUCache:
+    """
+    Потокобезопасный LRU с ограничением по числу записей
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SurveyDefinitionCache:
+    def __init__(self, max_size, backend_alias=None, ttl=None):
+        self.local = LRUCache(max_size)
+        self.backend_alias = backend_alias
+        self.ttl = ttl
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        return caches[self.backend_alias] if self.backend_alias else None
+
+    @staticmethod
+    def _revision_key(survey_id):
+        return f'survey-definition:{survey_id}:revision'
+
+    @staticmethod
+    def _content_key(survey_id, version):
+        return f'survey-definition:{survey_id}:{version[0]}'
+
+    def version(self, survey_id):
+        """
+        Версия записи: ревизия в общем кэше и локальный счетчик сбросов
+        """
+        revision = self.backend.get(self._revision_key(survey_id), 0) if self.backend else 0
+        return revision, self._generations.get(survey_id, 0)
+
+    def expires(self):
+        """
+        Срок локальной записи: с общим кэшем запись проверяется по ревизии и не истекает
+        """
+        if self.backend_alias or self.ttl is None:
+            return None
+        return time.monotonic() + self.ttl
+
+    def get(self, survey_id, version):
+        cached = self.local.get(survey_id)
+        if cached is not None and cached[0] == version and (cached[2] is None or time.monotonic() < cached[2]):
+            return cached[1]
+        if self.backend:
+            definition = self.backend.get(self._content_key(survey_id, version))
+            if definition is not None:
+                self.local.set(survey_id, (version, SurveyDefinition(*definition), None))
+                return SurveyDefinition(*definition)
+        return None
+
+    def set(self, survey_id, version, definition):
+        with self._lock:
+            if self._generations.get(survey_id, 0) != version[1]:
+                return
+            self.local.set(survey_id, (version, definition, self.expires()))
+        if self.backend:
+            self.backend.set(self._content_key(survey_id, version), tuple(definition))
+
+    def invalidate(self, survey_id):
+        with self._lock:
+            self._generations[survey_id] = self._generations.get(survey_id, 0) + 1
+            self.local.delete(survey_id)
+        if self.backend:
+            try:
+                self.backend.incr(self._revision_key(survey_id))
+            except ValueError:
+                self.backend.set(self._revision_key(survey_id), 1, None)
+
+
+survey_cache = SurveyDefinitionCache(
+    settings.SURVEY_CACHE_SIZE,
+    settings.SURVEY_CACHE_BACKEND,
+    settings.SURVEY_CACHE_TTL
+)
+
+
+def build_survey_definition(survey_id):
+    survey = Survey.objects.filter(id=survey_id).values(*SURVEY_COLUMNS, 'updated').first()
+    if survey is None:
+        return None
+    return survey_definition(survey, survey_tree(survey))
+
+
+async def abuild_survey_definition(survey_id):
+    survey = await Survey.objects.filter(id=survey_id).values(*SURVEY_COLUMNS, 'updated').afirst()
+    if survey is None:
+        return None
+    return survey_definition(survey, (await asurvey_trees([survey]))[0])
+
+
+def survey_definition(survey, tree):
+    return SurveyDefinition(
+        content=render_json(tree),
+        etag=f'"{survey["id"]}-{int(survey["updated"].timestamp() * 1000000)}"',
+        last_modified=int(survey['updated'].timestamp())
+    )
+
+
+def open_surveys_queryset(today):
+    """
+    Открытые опросы: не удалены, активны и сегодня между датами начала и окончания
+    Условие совпадает с частичным индексом survey_open_dates_idx
+    """
+    return Survey.objects.filter(is_deleted=False, is_active=True, start_date__lte=today, end_date__gte=today)
+
+
+def survey_is_open(survey, today):
+    """
+    То же условие, что в open_surveys_queryset, для уже прочитанного опроса
+    """
+    return not survey.is_deleted and survey.is_active and survey.start_date <= today <= survey.end_date
+
+
+class OpenSurveys:
+    """
+    Множество id открытых опросов в памяти процесса
+    Перечитывается с наступлением ближайшей даты начала или окончания опроса,
+    после изменения опросов в этом процессе и не реже раза в ttl секунд,
+    чтобы увидеть изменения, сделанные другими процессами
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._ids = None
+        self._valid = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def ids(self):
+        today = timezone.localdate()
+        now = time.monotonic()
+        with self._lock:
+            if self._ids is not None:
+                next_start, last_day, expires = self._valid
+                if today < next_start and today <= last_day and now < expires:
+                    return self._ids
+            generation = self._generation
+        ids, next_start, last_day = self.load(today)
+        with self._lock:
+            if generation == self._generation:
+                self._ids = ids
+                self._valid = (next_start, last_day, now + self.ttl)
+        return ids
+
+    @staticmethod
+    def load(today):
+        """
+        :return: (id открытых опросов, ближайшая дата начала, последний день, когда набор верен)
+        """
+        ids = set()
+        next_start = last_day = date.max
+        for survey_id, start_date, end_date in Survey.objects.filter(
+                is_deleted=False,
+                is_active=True,
+                end_date__gte=today
+        ).values_list('id', 'start_date', 'end_date'):
+            if start_date <= today:
+                ids.add(survey_id)
+                last_day = min(last_day, end_date)
+            else:
+                next_start = min(next_start, start_date)
+        return frozenset(ids), next_start, last_day
+
+    def is_open(self, survey_id):
+        """
+        :param survey_id: id опроса, в том числе строкой из URL
+        """
+        try:
+            survey_id = int(survey_id)
+        except (TypeError, ValueError):
+            return False
+        return survey_id in self.ids()
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._ids = None
+
+
+open_surveys = OpenSurveys(settings.OPEN_SURVEYS_TTL)
+
+
+def get_survey_definition(survey_id):
+    """
+    JSON-описание опроса из кэша или собранное заново
+    :return: SurveyDefinition или None, если опроса нет
+    """
+    version = survey_cache.version(survey_id)
+    definition = survey_cache.get(survey_id, version)
+    if definition is None:
+        definition = build_survey_definition(survey_id)
+        if definition is not None:
+            survey_cache.set(survey_id, version, definition)
+    return definition
+
+
+async def aget_survey_definition(survey_id):
+    """
+    get_survey_definition для асинхронных view
+    Общий кэш Django синхронный, поэтому с ним все выполняется в потоке
+    """
+    if survey_cache.backend_alias:
+        return await sync_to_async(get_survey_definition)(survey_id)
+    version = survey_cache.version(survey_id)
+    definition = survey_cache.get(survey_id, version)
+    if definition is None:
+        definition = await abuild_survey_definition(survey_id)
+        if definition is not None:
+            survey_cache.set(survey_id, version, definition)
+    return definition
+
+
+def invalidate_survey(survey_id):
+    """
+    Сбрасывает кэш опроса сразу и повторно после фиксации транзакции,
+    чтобы не закэшировать данные, прочитанные до ее завершения
+    """
+    survey_cache.invalidate(survey_id)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: survey_cache.invalidate(survey_id))
+    invalidate_open_surveys()
+
+
+def invalidate_open_surveys():
+    """
+    Сбрасывает множество открытых опросов сразу и после фиксации транзакции
+    """
+    open_surveys.invalidate()
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(open_surveys.invalidate)
+
+
+def touch_survey(survey_id):
+    """
+    Обновляет дату изменения опроса (и его ETag) при изменении вопросов
+    """
+    Survey.objects.filter(id=survey_id).update(updated=timezone.now())
+    invalidate_survey(survey_id)
@@ -15,7 +15,8 @@ def roles_required(roles):
     def decorator(f):
         @wraps(f)
         def wrapper(self, request, **kwargs):
-            role = request.user.user.role
+            user = getattr(request.user, 'user', None)
+            role = user.role if user is not None else None
             if role is None or role not in roles:
                 return Response(status=status.HTTP_403_FORBIDDEN)
             return f(self, request, **kwargs)
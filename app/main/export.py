@@ -0,0 +1,284 @@
+"""
+Выгрузка ответов опроса для аналитики
+
+CSV пишется через COPY ... TO STDOUT на Postgres или порциями
+серверного курсора на остальных БД, created в обоих случаях в одном
+формате. Parquet и Arrow доступны при установленном pyarrow. Память
+не зависит от числа ответов: в каждый момент в процессе находится
+не больше одной порции строк.
+"""
+import csv
+import io
+from datetime import timezone
+
+from django.db import connection
+from django.db.models import F, Func, TextField
+
+from .models import Answer, Submission
+from .submissions import compact_storage, iter_expanded
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMAT_CSV = 'csv'
+FORMAT_PARQUET = 'parquet'
+FORMAT_ARROW = 'arrow'
+FORMATS = (FORMAT_CSV, FORMAT_PARQUET, FORMAT_ARROW)
+CONTENT_TYPES = {
+    FORMAT_CSV: 'text/csv',
+    FORMAT_PARQUET: 'application/vnd.apache.parquet',
+    FORMAT_ARROW: 'application/vnd.apache.arrow.stream',
+}
+
+EXPORT_FIELDS = (
+    'id', 'survey_id', 'user__external_id', 'question_id', 'question__body',
+    'choice_id', 'choice__body', 'body', 'created'
+)
+EXPORT_COLUMNS = (
+    'answer_id', 'survey_id', 'user_id', 'question_id', 'question',
+    'choice_id', 'choice', 'body', 'created'
+)
+# created в CSV - время UTC с микросекундами
+CSV_CREATED_FORMAT = '%Y-%m-%d %H:%M:%S.%f+00:00'
+POSTGRES_CREATED_FORMAT = 'YYYY-MM-DD HH24:MI:SS.US"+00:00"'
+
+
+def available_formats():
+    return FORMATS if pyarrow else (FORMAT_CSV,)
+
+
+def export_queryset(survey_id):
+    return Answer.objects.filter(
+        survey_id=survey_id
+    ).order_by('id').values_list(*EXPORT_FIELDS)
+
+
+def copy_queryset(survey_id):
+    """
+    export_queryset для COPY: created уже отформатирован как в csv_row
+    """
+    return Answer.objects.filter(survey_id=survey_id).order_by('id').annotate(created_text=Func(
+        F('created'),
+        template=f"to_char(%(expressions)s AT TIME ZONE 'UTC', '{POSTGRES_CREATED_FORMAT}')",
+        output_field=TextField()
+    )).values_list(*EXPORT_FIELDS[:-1], 'created_text')
+
+
+def csv_row(row):
+    """
+    Строка в порядке EXPORT_FIELDS для CSV
+    """
+    return row[:-1] + (row[-1].astimezone(timezone.utc).strftime(CSV_CREATED_FORMAT),)
+
+
+def compact_export_rows(survey_id, chunk_size):
+    """
+    Строки в порядке EXPORT_FIELDS из компактного хранения, answer_id - id прохождения
+    """
+    submissions = Submission.objects.filter(survey_id=survey_id).order_by('id').values_list(
+        'id', 'survey_id', 'choices', 'created', 'user__external_id'
+    ).iterator(chunk_size=chunk_size)
+    for item in iter_expanded(submissions, chunk_size):
+        yield (
+            item['answer_id'], item['survey_id'], item['user'], item['question_id'], item['question'],
+            item['choice_id'], item['choice'], item['body'], item['created']
+        )
+
+
+def iter_chunks(survey_id, chunk_size):
+    """
+    Строки ответов опроса порциями по chunk_size
+    """
+    if compact_storage():
+        rows = compact_export_rows(survey_id, chunk_size)
+    else:
+        rows = export_queryset(survey_id).iterator(chunk_size=chunk_size)
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class CopyProgress(io.TextIOBase):
+    """
+    Файл для COPY ... TO STDOUT WITH CSV: передает текст в out и считает строки CSV,
+    переводы строк внутри кавычек не считаются. progress вызывается через каждые every строк
+    """
+
+    def __init__(self, out, progress, every):
+        super().__init__()
+        self.out = out
+        self.progress = progress
+        self.every = every
+        self.rows = 0
+        self.reported = 0
+        self.quoted = False
+
+    def write(self, data):
+        self.out.write(data)
+        for number, part in enumerate(data.split('"')):
+            if number:
+                self.quoted = not self.quoted
+            if not self.quoted:
+                self.rows += part.count('\n')
+        if self.rows - self.reported >= self.every:
+            self.reported = self.rows
+            self.progress(self.rows)
+        return len(data)
+
+    def finish(self):
+        if self.rows != self.reported:
+            self.reported = self.rows
+            self.progress(self.rows)
+
+
+def copy_csv(survey_id, out, chunk_size, progress=None):
+    """
+    CSV через COPY ... TO STDOUT, только для Postgres
+    :param out: текстовый файл для записи
+    :param progress: как у csv_chunks, вызывается примерно через каждые chunk_size строк
+    """
+    sql, params = copy_queryset(survey_id).query.sql_with_params()
+    if progress:
+        out = CopyProgress(out, progress, chunk_size)
+    with connection.cursor() as cursor:
+        query = cursor.mogrify(sql, params).decode('utf-8')
+        cursor.copy_expert(f'COPY ({query}) TO STDOUT WITH CSV', out)
+    if progress:
+        out.finish()
+
+
+def csv_chunks(survey_id, chunk_size, progress=None):
+    """
+    Генератор текста CSV с заголовком, по одной порции строк за шаг
+    :param progress: функция, получающая число выгруженных строк
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    rows = 0
+    for chunk in iter_chunks(survey_id, chunk_size):
+        writer.writerows(csv_row(row) for row in chunk)
+        rows += len(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        if progress:
+            progress(rows)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def arrow_schema():
+    return pyarrow.schema([
+        ('answer_id', pyarrow.int64()),
+        ('survey_id', pyarrow.int64()),
+        ('user_id', pyarrow.int64()),
+        ('question_id', pyarrow.int64()),
+        ('question', pyarrow.string()),
+        ('choice_id', pyarrow.int64()),
+        ('choice', pyarrow.string()),
+        ('body', pyarrow.string()),
+        ('created', pyarrow.timestamp('us', tz='UTC')),
+    ])
+
+
+def write_columnar(survey_id, out, export_format, chunk_size, progress=None):
+    """
+    Пишет ответы в Parquet или Arrow IPC stream по одной порции строк
+    :param out: бинарный файл для записи
+    """
+    schema = arrow_schema()
+    if export_format == FORMAT_PARQUET:
+        writer = pyarrow.parquet.ParquetWriter(out, schema)
+        write = writer.write_table
+    else:
+        writer = pyarrow.ipc.new_stream(out, schema)
+        write = writer.write
+    rows = 0
+    try:
+        for chunk in iter_chunks(survey_id, chunk_size):
+            write(pyarrow.Table.from_arrays(
+                [pyarrow.array(column, type=field.type) for column, field in zip(zip(*chunk), schema)],
+                schema=schema
+            ))
+            rows += len(chunk)
+            if progress:
+                progress(rows)
+            yield
+    finally:
+        writer.close()
+
+
+class ChunkBuffer(io.RawIOBase):
+    """
+    Файл, накапливающий записанные байты до следующего drain()
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def columnar_chunks(survey_id, export_format, chunk_size):
+    """
+    Генератор байтов Parquet или Arrow для потоковой отдачи по HTTP
+    """
+    buffer = ChunkBuffer()
+    for _ in write_columnar(survey_id, buffer, export_format, chunk_size):
+        data = buffer.drain()
+        if data:
+            yield data
+    data = buffer.drain()
+    if data:
+        yield data
+
+
+def export_chunks(survey_id, export_format, chunk_size):
+    if export_format == FORMAT_CSV:
+        return csv_chunks(survey_id, chunk_size)
+    return columnar_chunks(survey_id, export_format, chunk_size)
+
+
+def export_answers(survey_id, path, export_format, chunk_size, progress=None):
+    """
+    Выгружает ответы опроса в файл
+    """
+    if export_format != FORMAT_CSV:
+        with open(path, 'wb') as out:
+            for _ in write_columnar(survey_id, out, export_format, chunk_size, progress):
+                pass
+        return
+
+    with open(path, 'w', newline='', encoding='utf-8') as out:
+        if connection.vendor == 'postgresql' and not compact_storage():
+            csv.writer(out).writerow(EXPORT_COLUMNS)
+            copy_csv(survey_id, out, chunk_size, progress)
+            return
+        for text in csv_chunks(survey_id, chunk_size, progress):
+            out.write(text)
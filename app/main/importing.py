@@ -0,0 +1,225 @@
+"""
+Пакетная загрузка опросов
+
+Описания читаются потоком (JSON-массив, NDJSON или CSV), сначала все
+проверяются через SurveySerializerCreate, затем записываются одной
+транзакцией: bulk_create на каждый уровень (опросы, вопросы, варианты)
+для пачки из batch_size опросов. В памяти держится не больше одной пачки.
+"""
+import csv
+import io
+import json
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from rest_framework import exceptions
+
+from .cache import invalidate_open_surveys
+from .models import Survey, Question, AnswerChoice
+
+FORMAT_JSON = 'json'
+FORMAT_CSV = 'csv'
+CSV_COLUMNS = ('survey', 'description', 'start_date', 'end_date', 'question', 'question_type', 'choice')
+READ_SIZE = 1024 * 1024
+MAX_ITEM_SIZE = 64 * 1024 * 1024
+MAX_ERRORS = 100
+
+
+class SurveyImportError(Exception):
+    def __init__(self, errors):
+        super().__init__(f'Ошибки в {len(errors)} описаниях опросов')
+        self.errors = errors
+
+
+def read_json(stream):
+    """
+    Читает описания опросов из JSON-массива или NDJSON, не загружая файл целиком
+    :param stream: текстовый файл
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    eof = False
+    while True:
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,[]':
+                position += 1
+            if position == len(buffer):
+                break
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                break
+            if end == len(buffer) and not eof:
+                break
+            yield item
+            position = end
+        buffer = buffer[position:]
+        if eof:
+            if buffer.strip(' \t\r\n,[]'):
+                raise ValueError('Неполное описание опроса в конце файла')
+            return
+        if len(buffer) > MAX_ITEM_SIZE:
+            raise ValueError('Слишком большое или некорректное описание опроса')
+        chunk = stream.read(READ_SIZE)
+        eof = not chunk
+        buffer += chunk
+
+
+def read_csv(stream):
+    """
+    Читает описания опросов из CSV со столбцами CSV_COLUMNS
+    Строки одного опроса и одного вопроса должны идти подряд,
+    каждая строка с непустым choice добавляет вариант ответа
+    """
+    survey = None
+    survey_key = None
+    question = None
+    for row in csv.DictReader(stream):
+        key = (row['survey'], row['start_date'], row['end_date'])
+        if survey is None or key != survey_key:
+            if survey is not None:
+                yield survey
+            survey_key = key
+            survey = {
+                'name': row['survey'],
+                'description': row.get('description') or None,
+                'start_date': row['start_date'],
+                'end_date': row['end_date'],
+                'questions': []
+            }
+            question = None
+        if question is None or question['body'] != row['question']:
+            question = {'body': row['question'], 'question_type': row['question_type']}
+            survey['questions'].append(question)
+        if row.get('choice'):
+            question.setdefault('choices', []).append(row['choice'])
+    if survey is not None:
+        yield survey
+
+
+def read_surveys(stream, import_format):
+    if import_format == FORMAT_CSV:
+        return read_csv(stream)
+    return read_json(stream)
+
+
+def validate_survey(item):
+    """
+    :return: проверенные данные опроса и ошибки
+    """
+    from .serializers import SurveySerializerCreate
+
+    serializer = SurveySerializerCreate(data=item)
+    try:
+        if serializer.is_valid():
+            return serializer.validated_data, None
+        return None, serializer.errors
+    except exceptions.APIException as e:
+        return None, e.detail
+
+
+def validate_surveys(items):
+    """
+    Проверяет все описания, не сохраняя их в памяти
+    :return: число описаний и список первых MAX_ERRORS ошибок
+    """
+    errors = []
+    count = 0
+    for index, item in enumerate(items):
+        count += 1
+        data, error = validate_survey(item)
+        if error and len(errors) < MAX_ERRORS:
+            errors.append({'index': index, 'errors': error})
+    return count, errors
+
+
+def bulk_create_with_ids(model, objs):
+    """
+    bulk_create, после которого у объектов заполнены id
+    Если БД не возвращает id из пакетной вставки, объекты создаются по одному
+    """
+    if connection.features.can_return_rows_from_bulk_insert:
+        return model.objects.bulk_create(objs)
+    for obj in objs:
+        obj.save(force_insert=True)
+    return objs
+
+
+def create_surveys(items):
+    """
+    Создает опросы с вопросами и вариантами ответов тремя пакетными вставками
+    :param list items: проверенные данные SurveySerializerCreate
+    :return: список созданных опросов
+    """
+    with transaction.atomic():
+        surveys = bulk_create_with_ids(Survey, [
+            Survey(
+                name=item['name'],
+                description=item.get('description'),
+                start_date=item['start_date'],
+                end_date=item['end_date']
+            ) for item in items
+        ])
+        questions = []
+        question_choices = []
+        for survey, item in zip(surveys, items):
+            for question in item['questions']:
+                questions.append(Question(
+                    survey=survey,
+                    question_type=question['question_type'],
+                    body=question['body']
+                ))
+                question_choices.append(question.get('choices', []))
+        bulk_create_with_ids(Question, questions)
+        AnswerChoice.objects.bulk_create([
+            AnswerChoice(question=question, body=body)
+            for question, choices in zip(questions, question_choices)
+            for body in choices
+        ])
+    invalidate_open_surveys()
+    return surveys
+
+
+def import_surveys(open_stream, import_format, batch_size, progress=None):
+    """
+    Проверяет все описания, затем создает опросы одной транзакцией
+    :param open_stream: функция, открывающая файл описаний заново для каждого прохода
+    :param progress: функция, получающая число созданных опросов
+    :return: id созданных опросов
+    """
+    with open_stream() as stream:
+        count, errors = validate_surveys(read_surveys(stream, import_format))
+    if errors:
+        raise SurveyImportError(errors)
+
+    survey_ids = []
+    with transaction.atomic(), open_stream() as stream:
+        batch = []
+        for item in read_surveys(stream, import_format):
+            batch.append(validate_survey(item)[0])
+            if len(batch) >= batch_size:
+                survey_ids.extend(survey.id for survey in create_surveys(batch))
+                batch = []
+                if progress:
+                    progress(len(survey_ids))
+        if batch:
+            survey_ids.extend(survey.id for survey in create_surveys(batch))
+    if progress:
+        progress(len(survey_ids))
+    return survey_ids
+
+
+@contextmanager
+def reopen(binary):
+    """
+    Текстовый поток с начала бинарного файла, сам файл не закрывается
+    """
+    binary.seek(0)
+    stream = io.TextIOWrapper(binary, encoding='utf-8', newline='')
+    try:
+        yield stream
+    finally:
+        stream.detach()
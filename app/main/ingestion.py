@@ -0,0 +1,429 @@
+"""
+Запись ответов на опросы
+
+Синхронный путь (TakeSurveySerializer), пакетная выгрузка (/api/surveys/sync)
+и фоновый сброс очереди (команда flush_answers) пишут ответы через write_submissions.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .cache import LRUCache
+from .metrics import registry
+from .models import Answer, Question, User, SubmissionKey
+from .results import update_results
+from .submissions import compact_storage, write_compact
+
+
+def idempotency_key(value):
+    """
+    Приводит переданный клиентом ключ идемпотентности к длине поля SubmissionKey.key
+    """
+    if not value:
+        return None
+    if len(value) > SubmissionKey._meta.get_field('key').max_length:
+        return hashlib.sha256(value.encode('utf-8')).hexdigest()
+    return value
+
+
+# external_id -> id пользователя для повторно отвечающих респондентов
+respondent_ids = LRUCache(settings.RESPONDENT_CACHE_SIZE)
+
+UPSERT_BATCH_SIZE = 150
+UPSERT_COLUMNS = ('external_id', 'login', 'status', 'role', 'created', 'updated')
+
+
+def can_upsert():
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 35)
+
+
+def upsert_users(external_ids):
+    """
+    Находит или создает пользователей одним INSERT ... ON CONFLICT ... RETURNING на порцию
+    DO UPDATE нужен, чтобы RETURNING вернул и уже существующие строки
+    :return: словарь external_id -> id
+    """
+    now = User._meta.get_field('created').get_db_prep_value(timezone.now(), connection)
+    defaults = {field: User._meta.get_field(field).get_default() for field in ('login', 'status', 'role')}
+    users = {}
+    with connection.cursor() as cursor:
+        for start in range(0, len(external_ids), UPSERT_BATCH_SIZE):
+            batch = external_ids[start:start + UPSERT_BATCH_SIZE]
+            placeholders = ', '.join([f'({", ".join(["%s"] * len(UPSERT_COLUMNS))})'] * len(batch))
+            params = []
+            for external_id in batch:
+                params.extend((external_id, defaults['login'], defaults['status'], defaults['role'], now, now))
+            cursor.execute(
+                f'INSERT INTO {User._meta.db_table} ({", ".join(UPSERT_COLUMNS)}) VALUES {placeholders} '
+                f'ON CONFLICT (external_id) DO UPDATE SET external_id = EXCLUDED.external_id '
+                f'RETURNING external_id, id',
+                params
+            )
+            users.update(cursor.fetchall())
+    return users
+
+
+def resolve_users(external_ids):
+    """
+    Возвращает словарь external_id -> id пользователя, создавая недостающих
+    Известные id берутся из respondent_ids без запроса к БД, остальные -
+    одним upsert на порцию; в кэш id попадают только после фиксации транзакции
+    """
+    users = {}
+    missing = []
+    for external_id in set(external_ids):
+        user_id = respondent_ids.get(external_id)
+        if user_id is None:
+            missing.append(external_id)
+        else:
+            users[external_id] = user_id
+    if not missing:
+        return users
+    if can_upsert():
+        found = upsert_users(missing)
+    else:
+        User.objects.bulk_create([User(external_id=external_id) for external_id in missing], ignore_conflicts=True)
+        found = dict(User.objects.filter(external_id__in=missing).values_list('external_id', 'id'))
+    users.update(found)
+
+    def remember():
+        for external_id, user_id in found.items():
+            respondent_ids.set(external_id, user_id)
+    transaction.on_commit(remember)
+    return users
+
+
+def find_user_id(external_id):
+    """
+    id пользователя по external_id без создания, None если пользователя нет
+    """
+    user_id = respondent_ids.get(external_id)
+    if user_id is None:
+        user_id = User.objects.filter(external_id=external_id).values_list('id', flat=True).first()
+    return user_id
+
+
+async def afind_user_id(external_id):
+    """
+    find_user_id для асинхронных view
+    """
+    user_id = respondent_ids.get(external_id)
+    if user_id is None:
+        user_id = await User.objects.filter(external_id=external_id).values_list('id', flat=True).afirst()
+    return user_id
+
+
+def survey_questions(survey_ids):
+    """
+    Неудаленные вопросы опросов с неудаленными вариантами ответа, одним запросом к БД
+    :return: survey_id -> {question_id: множество choice_id}
+    """
+    return group_questions(survey_ids, question_choice_rows(survey_ids))
+
+
+async def asurvey_questions(survey_ids):
+    """
+    survey_questions для асинхронных view
+    """
+    return group_questions(survey_ids, [row async for row in question_choice_rows(survey_ids)])
+
+
+def question_choice_rows(survey_ids):
+    return Question.objects.filter(
+        survey_id__in=list(survey_ids),
+        is_deleted=False
+    ).values_list('survey_id', 'id', 'answer_choices__id', 'answer_choices__is_deleted')
+
+
+def group_questions(survey_ids, rows):
+    questions = {survey_id: {} for survey_id in survey_ids}
+    for survey_id, question_id, choice_id, choice_is_deleted in rows:
+        choices = questions[survey_id].setdefault(question_id, set())
+        if choice_id is not None and not choice_is_deleted:
+            choices.add(choice_id)
+    return questions
+
+
+def answers_error(answers, questions):
+    """
+    Проверяет ответы одного прохождения
+    :param dict questions: question_id -> множество choice_id, элемент результата survey_questions
+    :return: текст ошибки или None
+    """
+    for item in answers:
+        choices = questions.get(item['question_id'])
+        if choices is None:
+            return 'Вопрос не найден'
+        if item.get('choice_id') is not None and item['choice_id'] not in choices:
+            return 'Вариант ответа не найден'
+    return None
+
+
+def key_scopes(submissions):
+    """
+    Область уникальности ключа идемпотентности каждого прохождения с ключом
+    Прохождения из очереди, записанные до появления в ней survey_id, относятся к опросу первого ответа
+    :return: номер прохождения -> (survey_id, external_id респондента, ключ)
+    """
+    first_questions = {
+        item['answers'][0]['question_id'] for item in submissions
+        if item.get('key') and item.get('survey_id') is None and item['answers']
+    }
+    question_surveys = dict(Question.objects.filter(
+        id__in=first_questions
+    ).values_list('id', 'survey_id')) if first_questions else {}
+    scopes = {}
+    for position, item in enumerate(submissions):
+        if not item.get('key'):
+            continue
+        survey_id = item.get('survey_id')
+        if survey_id is None and item['answers']:
+            survey_id = question_surveys.get(item['answers'][0]['question_id'])
+        if survey_id is not None:
+            scopes[position] = (survey_id, item['user_id'], item['key'])
+    return scopes
+
+
+def claim_keys(scopes):
+    """
+    Вставляет ключи до записи ответов; уже записанный ключ, в том числе вставленный
+    параллельным запросом, не вставляется и не вызывает IntegrityError
+    :param set scopes: тройки (survey_id, external_id респондента, ключ)
+    :return: множество вставленных троек
+    """
+    scopes = list(scopes)
+    if not can_upsert():
+        claimed = set()
+        for survey_id, respondent, key in scopes:
+            try:
+                with transaction.atomic():
+                    SubmissionKey.objects.create(survey_id=survey_id, respondent=respondent, key=key)
+            except IntegrityError:
+                continue
+            claimed.add((survey_id, respondent, key))
+        return claimed
+    now = SubmissionKey._meta.get_field('created').get_db_prep_value(timezone.now(), connection)
+    claimed = set()
+    with connection.cursor() as cursor:
+        for start in range(0, len(scopes), UPSERT_BATCH_SIZE):
+            batch = scopes[start:start + UPSERT_BATCH_SIZE]
+            params = []
+            for scope in batch:
+                params.extend(scope + (now,))
+            cursor.execute(
+                f'INSERT INTO {SubmissionKey._meta.db_table} (survey_id, respondent, key, created) '
+                f'VALUES {", ".join(["(%s, %s, %s, %s)"] * len(batch))} '
+                f'ON CONFLICT (survey_id, respondent, key) DO NOTHING '
+                f'RETURNING survey_id, respondent, key',
+                params
+            )
+            claimed.update(tuple(row) for row in cursor.fetchall())
+    return claimed
+
+
+def write_submissions(submissions):
+    """
+    Записывает прохождения одной транзакцией
+    Ключи идемпотентности вставляются первыми, прохождения с уже записанным ключом
+    (в том числе параллельным запросом) пропускаются
+    :param list submissions: словари с ключами survey_id, user_id, answers и необязательным key
+    :return: список записанных прохождений, без пропущенных повторов
+    """
+    with transaction.atomic():
+        scopes = key_scopes(submissions)
+        claimed = claim_keys(set(scopes.values()))
+        new_submissions = []
+        for position, item in enumerate(submissions):
+            scope = scopes.get(position)
+            if scope is not None:
+                if scope not in claimed:
+                    continue
+                claimed.discard(scope)
+            new_submissions.append(item)
+        if not new_submissions:
+            return []
+
+        users = resolve_users([item['user_id'] for item in new_submissions])
+        question_surveys = update_results(new_submissions, users)
+        if compact_storage():
+            write_compact(new_submissions, users)
+            return new_submissions
+        Answer.objects.bulk_create([
+            Answer(
+                user_id=users[item['user_id']],
+                question_id=answer['question_id'],
+                survey_id=question_surveys[answer['question_id']],
+                choice_id=answer.get('choice_id'),
+                body=answer.get('body')
+            ) for item in new_submissions for answer in item['answers']
+        ])
+    return new_submissions
+
+
+def purge_submission_keys(days, chunk_size):
+    """
+    Удаляет ключи идемпотентности старше days дней порциями
+    :return: число удаленных ключей
+    """
+    before = timezone.now() - timedelta(days=days)
+    deleted = 0
+    while True:
+        ids = list(SubmissionKey.objects.filter(created__lt=before).values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        SubmissionKey.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+
+
+class AnswerQueue:
+    """
+    Локальная очередь прохождений в SQLite-файле в режиме WAL
+    Каждое прохождение хранится с ключом идемпотентности, поэтому
+    повторная выгрузка одной записи не создает дублей ответов
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=FULL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS queue ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'key TEXT NOT NULL UNIQUE, '
+                'payload TEXT NOT NULL, '
+                'created REAL NOT NULL)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS failed ('
+                'id INTEGER PRIMARY KEY, '
+                'key TEXT NOT NULL, '
+                'payload TEXT NOT NULL, '
+                'error TEXT, '
+                'created REAL NOT NULL)'
+            )
+            self._local.connection = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self.connection
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def put(self, submission, key=None):
+        """
+        Добавляет прохождение в очередь
+        Повтор с тем же ключом от того же респондента на тот же опрос не добавляется
+        :return: ключ идемпотентности
+        """
+        key = idempotency_key(key) or uuid.uuid4().hex
+        self.connection.execute(
+            'INSERT OR IGNORE INTO queue (key, payload, created) VALUES (?, ?, ?)',
+            (
+                f'{submission.get("survey_id")}:{submission["user_id"]}:{key}',
+                json.dumps(dict(submission, key=key)),
+                time.time()
+            )
+        )
+        return key
+
+    def peek(self, limit):
+        """
+        Первые limit прохождений очереди без удаления
+        :return: список пар (id записи, прохождение)
+        """
+        rows = self.connection.execute(
+            'SELECT id, key, payload FROM queue ORDER BY id LIMIT ?', (limit,)
+        ).fetchall()
+        return [(row_id, dict({'key': key}, **json.loads(payload))) for row_id, key, payload in rows]
+
+    def ack(self, ids):
+        with self._transaction() as conn:
+            conn.executemany('DELETE FROM queue WHERE id = ?', [(i,) for i in ids])
+
+    def fail(self, row_id, error):
+        """
+        Переносит прохождение, которое не удалось записать, в таблицу failed
+        """
+        with self._transaction() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO failed (id, key, payload, error, created) '
+                'SELECT id, key, payload, ?, created FROM queue WHERE id = ?',
+                (error, row_id)
+            )
+            conn.execute('DELETE FROM queue WHERE id = ?', (row_id,))
+
+    def depth(self):
+        return self.connection.execute('SELECT COUNT(*) FROM queue').fetchone()[0]
+
+    def failed_count(self):
+        return self.connection.execute('SELECT COUNT(*) FROM failed').fetchone()[0]
+
+
+_queues = {}
+
+
+def get_answer_queue():
+    """
+    Очередь прохождений по пути из настроек ANSWER_QUEUE_PATH
+    """
+    path = str(settings.ANSWER_QUEUE_PATH)
+    if path not in _queues:
+        _queues[path] = AnswerQueue(path)
+    return _queues[path]
+
+
+registry.gauge(
+    'survey_answer_queue_depth',
+    lambda: get_answer_queue().depth() if settings.ANSWER_QUEUE_ENABLED else None
+)
+
+
+def flush_queue(queue, batch_size):
+    """
+    Переносит одну пачку прохождений из очереди в БД
+    Если пачка не записывается целиком, прохождения пишутся по одному,
+    а ошибочные переносятся в таблицу failed
+    :return: число обработанных записей очереди
+    """
+    batch = queue.peek(batch_size)
+    if not batch:
+        return 0
+    try:
+        write_submissions([item for row_id, item in batch])
+    except Exception:
+        for row_id, item in batch:
+            try:
+                write_submissions([item])
+            except Exception as e:
+                queue.fail(row_id, str(e))
+            else:
+                queue.ack([row_id])
+    else:
+        queue.ack([row_id for row_id, item in batch])
+    return len(batch)
@@ -0,0 +1,117 @@
+"""
+Асинхронная запись журналов в файл
+
+QueueFileHandler кладет записи в ограниченную очередь и сразу возвращает
+управление, в файл их пишет фоновый поток QueueListener. При переполнении
+очереди запись отбрасывается и учитывается в survey_log_dropped_total.
+EndpointSampler ограничивает число записей от одного view в секунду.
+Обработчики подключаются через settings.LOGGING.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+from logging import Filter
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+
+from .metrics import current_request, registry
+
+
+class RotatingFileHandler(TimedRotatingFileHandler):
+    """
+    Ротация по времени (when, как в TimedRotatingFileHandler) и по размеру файла
+    При ротации по размеру внутри одного интервала к имени добавляется номер
+    """
+
+    def __init__(self, filename, max_bytes=0, when='midnight', backup_count=0, encoding='utf-8'):
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        super().__init__(filename, when=when, backupCount=backup_count, encoding=encoding, delay=True)
+        self.max_bytes = max_bytes
+
+    def shouldRollover(self, record):
+        if super().shouldRollover(record):
+            return 1
+        if not self.max_bytes:
+            return 0
+        if self.stream is None:
+            self.stream = self._open()
+        self.stream.seek(0, 2)
+        position = self.stream.tell()
+        return int(position > 0 and position + len(self.format(record)) + 1 >= self.max_bytes)
+
+    def rotation_filename(self, default_name):
+        name = super().rotation_filename(default_name)
+        number = 0
+        while os.path.exists(name):
+            number += 1
+            name = f'{default_name}.{number}'
+        return name
+
+
+class QueueFileHandler(QueueHandler):
+    """
+    Запись в RotatingFileHandler через очередь на queue_size записей
+    """
+
+    def __init__(self, filename, queue_size=10000, max_bytes=0, when='midnight', backup_count=0):
+        super().__init__(queue.Queue(queue_size))
+        self.target = RotatingFileHandler(filename, max_bytes, when, backup_count)
+        self.dropped = 0
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            registry.inc('survey_log_dropped_total', ())
+
+    def flush(self):
+        """
+        Ждет, пока фоновый поток запишет все записи из очереди
+        """
+        if self.listener is not None:
+            self.queue.join()
+        self.target.flush()
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        self.target.close()
+        super().close()
+
+
+class EndpointSampler(Filter):
+    """
+    Пропускает не больше limit записей за interval секунд от одного view,
+    limits задает свой предел для отдельных view (имя как в метриках, например
+    SurveyViewset.take). Отброшенные записи учитываются в survey_log_sampled_total
+    """
+
+    def __init__(self, limit=20, interval=1.0, limits=None):
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self.limits = limits or {}
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        stats = current_request.get()
+        view = stats.view if stats is not None and stats.view else 'unresolved'
+        limit = self.limits.get(view, self.limit)
+        now = time.monotonic()
+        with self._lock:
+            started, count = self._windows.get(view, (now, 0))
+            if now - started >= self.interval:
+                started, count = now, 0
+            self._windows[view] = (started, count + 1)
+        if count < limit:
+            return True
+        registry.inc('survey_log_sampled_total', (('view', view),))
+        return False
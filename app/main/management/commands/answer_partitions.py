@@ -0,0 +1,42 @@
+"""
+Обслуживание помесячных секций таблицы ответов
+"""
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from main.partitions import convert_to_partitioned, detach_partitions, ensure_partitions, is_partitioned, \
+    list_partitions
+
+
+class Command(BaseCommand):
+    help = 'Создает секции таблицы ответов на месяцы вперед, отсоединяет и архивирует старые'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true', help='Перевести таблицу ответов на секции')
+        parser.add_argument('--ahead', type=int, default=settings.ANSWER_PARTITIONS_AHEAD,
+                            help='На сколько месяцев вперед создавать секции')
+        parser.add_argument('--detach-before', type=date.fromisoformat,
+                            help='Отсоединить секции месяцев раньше даты, YYYY-MM-DD')
+        parser.add_argument('--archive-dir', help='Выгрузить отсоединенные секции в CSV и удалить их')
+        parser.add_argument('--list', action='store_true', help='Показать секции')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Секционирование поддерживается только для Postgres')
+        if options['convert'] and convert_to_partitioned(options['ahead']):
+            self.stdout.write(f'{connection.settings_dict["NAME"]}: ответы перенесены в секции')
+        with connection.cursor() as cursor:
+            if not is_partitioned(cursor):
+                raise CommandError('Таблица ответов не секционирована, запустите с --convert')
+        for name in ensure_partitions(options['ahead']):
+            self.stdout.write(f'created {name}')
+        if options['detach_before']:
+            for name in detach_partitions(options['detach_before'], options['archive_dir']):
+                self.stdout.write(f'detached {name}')
+        if options['list']:
+            with connection.cursor() as cursor:
+                for name in list_partitions(cursor):
+                    self.stdout.write(name)
@@ -0,0 +1,55 @@
+"""
+Запуск замеров производительности на отдельной тестовой БД
+"""
+import json
+from importlib import import_module
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from main.benchmarks import SCENARIOS, compare, isolated_database
+
+SCALE_OPTIONS = ('repeat', 'surveys', 'questions', 'choices', 'respondents', 'answers', 'rows')
+
+
+class Command(BaseCommand):
+    help = 'Замеры производительности API опросов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=SCENARIOS)
+        parser.add_argument('--repeat', type=int, default=100)
+        parser.add_argument('--surveys', type=int, default=20, help='Число синтетических опросов')
+        parser.add_argument('--questions', type=int, default=10, help='Число вопросов в опросе')
+        parser.add_argument('--choices', type=int, default=5, help='Число вариантов ответа у вопроса')
+        parser.add_argument('--respondents', type=int, default=200, help='Число пользователей')
+        parser.add_argument('--answers', type=int, default=50, help='Число ответов каждого пользователя')
+        parser.add_argument('--rows', type=int, help='Число строк для замеров export и answers, по умолчанию ROWS сценария')
+        parser.add_argument('--chunk-size', type=int, default=10000)
+        parser.add_argument('--output', help='Файл для сохранения результатов в JSON')
+        parser.add_argument('--compare', help='Файл результатов прошлого запуска для сравнения')
+        parser.add_argument('--threshold', type=float, default=0.2, help='Допустимое ухудшение, доля')
+
+    def handle(self, *args, **options):
+        scenario = import_module(f'main.benchmarks.{options["scenario"]}')
+        if options['rows'] is None:
+            options['rows'] = getattr(scenario, 'ROWS', None)
+        with isolated_database():
+            results = {
+                'scenario': options['scenario'],
+                'vendor': connection.vendor,
+                'scale': {key: options[key] for key in SCALE_OPTIONS},
+                'results': scenario.run(options),
+            }
+        report = json.dumps(results, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(report)
+        self.stdout.write(report)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            regressions = compare(results['results'], baseline.get('results', {}), options['threshold'])
+            if regressions:
+                raise CommandError('Ухудшение относительно прошлого запуска:\n' + '\n'.join(regressions))
+            self.stdout.write('Ухудшений нет')
@@ -0,0 +1,22 @@
+"""
+Перенос записанных ответов между хранениями при смене ANSWER_STORAGE
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main.submissions import STORAGE_COMPACT, STORAGE_ROWS, answers_to_compact, compact_to_answers
+
+
+class Command(BaseCommand):
+    help = 'Переносит ответы в хранение ANSWER_STORAGE (или --to) из другого хранения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--to', choices=(STORAGE_ROWS, STORAGE_COMPACT), help='По умолчанию ANSWER_STORAGE')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Число строк в одной транзакции')
+
+    def handle(self, *args, **options):
+        storage = options['to'] or settings.ANSWER_STORAGE
+        if storage == STORAGE_COMPACT:
+            self.stdout.write(f'answers moved={answers_to_compact(options["chunk_size"])}')
+        else:
+            self.stdout.write(f'submissions moved={compact_to_answers(options["chunk_size"])}')
@@ -0,0 +1,44 @@
+"""
+Выгрузка ответов опроса в CSV, Parquet или Arrow
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from main.export import FORMAT_CSV, FORMATS, available_formats, export_answers
+from main.models import Survey
+
+
+class Command(BaseCommand):
+    help = 'Выгружает ответы опроса вместе с текстами вопросов и вариантов ответов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('survey_id', type=int)
+        parser.add_argument('output', help='Путь к файлу выгрузки')
+        parser.add_argument('--format', choices=FORMATS, default=FORMAT_CSV)
+        parser.add_argument('--chunk-size', type=int, default=settings.EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if options['format'] not in available_formats():
+            raise CommandError(f'Для формата {options["format"]} нужен пакет pyarrow')
+        if not Survey.objects.filter(id=options['survey_id']).exists():
+            raise CommandError('Опрос не найден')
+
+        started = time.perf_counter()
+        exported = 0
+
+        def progress(rows):
+            nonlocal exported
+            exported = rows
+            elapsed = time.perf_counter() - started
+            self.stderr.write(f'exported {rows} rows, {rows / elapsed:.0f} rows/s')
+
+        export_answers(
+            options['survey_id'],
+            options['output'],
+            options['format'],
+            options['chunk_size'],
+            progress
+        )
+        self.stdout.write(f'done: {exported or "all"} rows in {time.perf_counter() - started:.1f}s')
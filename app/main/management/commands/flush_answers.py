@@ -0,0 +1,34 @@
+"""
+Перенос прохождений опросов из write-behind очереди в БД
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main.ingestion import get_answer_queue, flush_queue
+
+
+class Command(BaseCommand):
+    help = 'Переносит ответы из очереди ANSWER_QUEUE_PATH в БД'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.ANSWER_QUEUE_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=settings.ANSWER_QUEUE_FLUSH_INTERVAL)
+        parser.add_argument('--once', action='store_true', help='Разобрать очередь и завершиться')
+        parser.add_argument('--stats', action='store_true', help='Вывести глубину очереди и завершиться')
+
+    def handle(self, *args, **options):
+        queue = get_answer_queue()
+        if options['stats']:
+            self.stdout.write(f'depth={queue.depth()} failed={queue.failed_count()}')
+            return
+
+        while True:
+            flushed = flush_queue(queue, options['batch_size'])
+            if flushed:
+                self.stdout.write(f'flushed={flushed} depth={queue.depth()}')
+                continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
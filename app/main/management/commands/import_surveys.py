@@ -0,0 +1,34 @@
+"""
+Пакетная загрузка опросов из JSON, NDJSON или CSV
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from main.importing import import_surveys, SurveyImportError, FORMAT_CSV, FORMAT_JSON
+
+
+class Command(BaseCommand):
+    help = 'Проверяет все описания опросов из файла и создает их одной транзакцией'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл с описаниями опросов')
+        parser.add_argument('--format', choices=(FORMAT_JSON, FORMAT_CSV), help='По умолчанию по расширению файла')
+        parser.add_argument('--batch-size', type=int, default=settings.IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        import_format = options['format'] or (FORMAT_CSV if path.endswith('.csv') else FORMAT_JSON)
+        try:
+            survey_ids = import_surveys(
+                lambda: open(path, encoding='utf-8', newline=''),
+                import_format,
+                options['batch_size'],
+                lambda created: self.stderr.write(f'created {created} surveys')
+            )
+        except SurveyImportError as e:
+            for error in e.errors:
+                self.stderr.write(f'#{error["index"]}: {error["errors"]}')
+            raise CommandError(str(e))
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f'imported {len(survey_ids)} surveys')
@@ -0,0 +1,48 @@
+"""
+Планы канонических запросов на синтетических данных в отдельной тестовой БД
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from main.advisor import CANONICAL_QUERIES, advise
+from main.benchmarks import isolated_database
+from main.benchmarks.data import generate
+
+
+class Command(BaseCommand):
+    help = 'Выполняет канонические запросы под EXPLAIN и сообщает о полных просмотрах таблиц'
+
+    def add_arguments(self, parser):
+        parser.add_argument('query', nargs='*', help='Только эти запросы: ' + ', '.join(CANONICAL_QUERIES))
+        parser.add_argument('--surveys', type=int, default=200, help='Число синтетических опросов')
+        parser.add_argument('--questions', type=int, default=10, help='Число вопросов в опросе')
+        parser.add_argument('--choices', type=int, default=5, help='Число вариантов ответа у вопроса')
+        parser.add_argument('--respondents', type=int, default=1000, help='Число пользователей')
+        parser.add_argument('--answers', type=int, default=20, help='Число ответов каждого пользователя')
+        parser.add_argument('--analyze', action='store_true', help='EXPLAIN ANALYZE (только Postgres)')
+        parser.add_argument('--plans', action='store_true', help='Вывести планы целиком')
+        parser.add_argument('--fail-on-scan', action='store_true', help='Ошибка, если есть полные просмотры')
+
+    def handle(self, *args, **options):
+        unknown = set(options['query']) - set(CANONICAL_QUERIES)
+        if unknown:
+            raise CommandError('Неизвестные запросы: ' + ', '.join(sorted(unknown)))
+        with isolated_database():
+            dataset = generate(
+                options['surveys'],
+                options['questions'],
+                options['choices'],
+                options['respondents'],
+                options['answers']
+            )
+            report = advise(dataset, options['analyze'], options['query'])
+
+        scans = []
+        for name, tables, plan in report:
+            status = f'SCAN {", ".join(tables)}' if tables else 'ok'
+            self.stdout.write(f'{name}: {status}')
+            if options['plans']:
+                self.stdout.write(plan + '\n')
+            if tables:
+                scans.append(name)
+        if scans and options['fail_on_scan']:
+            raise CommandError('Полные просмотры таблиц: ' + ', '.join(scans))
@@ -0,0 +1,19 @@
+"""
+Удаление старых ключей идемпотентности прохождений
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main.ingestion import purge_submission_keys
+
+
+class Command(BaseCommand):
+    help = 'Удаляет ключи идемпотентности старше SUBMISSION_KEY_RETENTION_DAYS дней'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.SUBMISSION_KEY_RETENTION_DAYS)
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Число ключей в одном DELETE')
+
+    def handle(self, *args, **options):
+        deleted = purge_submission_keys(options['days'], options['chunk_size'])
+        self.stdout.write(f'deleted={deleted}')
@@ -0,0 +1,26 @@
+"""
+Пересчет агрегированных результатов опросов из таблицы ответов
+"""
+from django.core.management.base import BaseCommand
+
+from main.models import Survey
+from main.results import rebuild_results
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики результатов опросов порциями'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--survey-id', type=int, nargs='*', help='Только эти опросы')
+        parser.add_argument('--chunk-size', type=int, default=100, help='Число опросов в одной транзакции')
+
+    def handle(self, *args, **options):
+        surveys = Survey.objects.order_by('id')
+        if options['survey_id']:
+            surveys = surveys.filter(id__in=options['survey_id'])
+        survey_ids = list(surveys.values_list('id', flat=True))
+        chunk_size = options['chunk_size']
+        for start in range(0, len(survey_ids), chunk_size):
+            chunk = survey_ids[start:start + chunk_size]
+            rebuild_results(chunk)
+            self.stdout.write(f'rebuilt {start + len(chunk)}/{len(survey_ids)}')
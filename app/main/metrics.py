@@ -0,0 +1,221 @@
+"""
+Метрики запросов в памяти процесса
+
+RequestMetricsMiddleware для каждого запроса считает время ответа,
+число SQL-запросов, время в БД и время сериализации и складывает
+их в гистограммы, которые /api/metrics отдает в формате Prometheus.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERIES_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+current_request = ContextVar('current_request', default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """
+    Гистограммы и счетчики с метками
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = Counter()
+        self.gauges = {}
+
+    def observe(self, name, labels, value, buckets=SECONDS_BUCKETS):
+        key = (name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self.counters[name, labels] += value
+
+    def gauge(self, name, func):
+        """
+        Регистрирует значение, вычисляемое при каждом чтении метрик
+        """
+        self.gauges[name] = func
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def render(self):
+        """
+        Текстовый формат Prometheus
+        """
+        lines = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        typed = set()
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append(f'# TYPE {name} histogram')
+                typed.add(name)
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", str(bound)),))} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum}')
+            lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f'# TYPE {name} counter')
+                typed.add(name)
+            lines.append(f'{name}{format_labels(labels)} {value}')
+        for name, func in sorted(self.gauges.items()):
+            value = func()
+            if value is not None:
+                lines.append(f'# TYPE {name} gauge')
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    values = ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels
+    )
+    return '{' + values + '}'
+
+
+registry = Registry()
+
+
+class RequestStats:
+    """
+    Показатели одного запроса
+    """
+    __slots__ = ('view', 'queries', 'db_time', 'serializer_time', 'sql')
+
+    def __init__(self):
+        self.view = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.sql = []
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            self.sql.append(sql)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    execute_wrapper, который учитывает запрос в показателях текущего запроса
+    Стоит на соединениях постоянно, вне запроса (current_request не задан) ничего не делает
+    """
+    stats = current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats.execute_wrapper(execute, sql, params, many, context)
+
+
+class MeasuredStream:
+    """
+    Тело потокового ответа: при чтении задает current_request, чтобы запросы к БД
+    из генератора попадали в показатели запроса, после чтения или закрытия ответа
+    вызывает observe
+    """
+
+    def __init__(self, content, stats, observe):
+        self.content = content
+        self.stats = stats
+        self.observe = observe
+
+    def __iter__(self):
+        iterator = iter(self.content)
+        while True:
+            token = current_request.set(self.stats)
+            try:
+                part = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                current_request.reset(token)
+            yield part
+        self.close()
+
+    def close(self):
+        if self.observe is not None:
+            observe, self.observe = self.observe, None
+            observe()
+
+
+class AsyncMeasuredStream(MeasuredStream):
+    """
+    MeasuredStream для асинхронного тела ответа
+    """
+
+    async def __aiter__(self):
+        iterator = self.content.__aiter__()
+        while True:
+            token = current_request.set(self.stats)
+            try:
+                part = await iterator.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                current_request.reset(token)
+            yield part
+        self.close()
+
+
+@contextmanager
+def serializer_timing():
+    """
+    Добавляет время блока к времени сериализации текущего запроса
+    """
+    stats = current_request.get()
+    if stats is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serializer_time += time.perf_counter() - started
+
+
+FINGERPRINT_IN = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+FINGERPRINT_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def fingerprint(sql):
+    """
+    SQL без литералов и со свернутыми списками IN, чтобы одинаковые запросы совпадали
+    """
+    return FINGERPRINT_LITERALS.sub('?', FINGERPRINT_IN.sub('(...)', sql))
@@ -0,0 +1,148 @@
+import logging
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from rest_framework.permissions import SAFE_METHODS
+
+from .metrics import registry, current_request, record_query, RequestStats, MeasuredStream, AsyncMeasuredStream, \
+    fingerprint, QUERIES_BUCKETS
+from .routers import pinned_to_primary
+
+logger = logging.getLogger(__name__)
+
+
+class RequestMetricsMiddleware:
+    """
+    Собирает время ответа, число и время SQL-запросов и время сериализации
+    по каждому view, медленные запросы пишет в лог с отпечатками SQL
+    Запросы учитывает record_query, который ставится на соединения потока, где
+    работает ORM: для асинхронных view - в потоке sync_to_async. Показатели
+    потоковых ответов сохраняются после чтения тела ответа
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        install_query_recording()
+        stats = RequestStats()
+        started = time.perf_counter()
+        token = current_request.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.finish(request, response, stats, started)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        started = time.perf_counter()
+        token = current_request.set(stats)
+        try:
+            await sync_to_async(install_query_recording)()
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.finish(request, response, stats, started)
+
+    def finish(self, request, response, stats, started):
+        """
+        Сохраняет показатели запроса, у потокового ответа - после чтения тела
+        """
+        def observe():
+            self.observe(request, stats, time.perf_counter() - started)
+        if not response.streaming:
+            observe()
+        elif response.is_async:
+            response.streaming_content = AsyncMeasuredStream(response.streaming_content, stats, observe)
+        else:
+            response.streaming_content = MeasuredStream(response.streaming_content, stats, observe)
+        return response
+
+    def observe(self, request, stats, duration):
+        labels = (('view', stats.view or 'unresolved'), ('method', request.method))
+        registry.observe('survey_request_duration_seconds', labels, duration)
+        registry.observe('survey_request_db_seconds', labels, stats.db_time)
+        registry.observe('survey_request_serializer_seconds', labels, stats.serializer_time)
+        registry.observe('survey_request_queries', labels, stats.queries, QUERIES_BUCKETS)
+        if duration >= settings.SLOW_REQUEST_THRESHOLD:
+            registry.inc('survey_slow_requests_total', labels)
+            self.log_slow_request(request, stats, duration)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        stats = current_request.get()
+        if stats is None:
+            return None
+        cls = getattr(view_func, 'cls', None)
+        actions = getattr(view_func, 'actions', None)
+        if cls is not None and actions:
+            stats.view = f'{cls.__name__}.{actions.get(request.method.lower(), request.method.lower())}'
+        elif cls is not None:
+            stats.view = cls.__name__
+        else:
+            stats.view = getattr(view_func, '__name__', 'view')
+        return None
+
+    @staticmethod
+    def log_slow_request(request, stats, duration):
+        fingerprints = Counter(fingerprint(sql) for sql in stats.sql)
+        logger.warning(
+            'SLOW REQUEST %s %s view=%s duration=%.3fs queries=%d db=%.3fs serializer=%.3fs\n%s',
+            request.method,
+            request.path,
+            stats.view,
+            duration,
+            stats.queries,
+            stats.db_time,
+            stats.serializer_time,
+            '\n'.join(f'  {count} x {sql}' for sql, count in fingerprints.most_common(10))
+        )
+
+
+def install_query_recording():
+    """
+    Ставит record_query на соединения текущего потока, если его там еще нет
+    Первым в списке, чтобы не мешать вложенным connection.execute_wrapper
+    """
+    for connection in connections.all():
+        if record_query not in connection.execute_wrappers:
+            connection.execute_wrappers.insert(0, record_query)
+
+
+class PrimaryPinMiddleware:
+    """
+    Сбрасывает привязку к основной БД в начале каждого запроса,
+    запросы с небезопасными методами сразу привязывает к основной БД
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = pinned_to_primary.set(request.method not in SAFE_METHODS)
+        try:
+            return self.get_response(request)
+        finally:
+            pinned_to_primary.reset(token)
+
+    async def __acall__(self, request):
+        token = pinned_to_primary.set(request.method not in SAFE_METHODS)
+        try:
+            return await self.get_response(request)
+        finally:
+            pinned_to_primary.reset(token)
@@ -0,0 +1,39 @@
+# Generated by Django 2.2.10 on 2026-10-18 02:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SurveyResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('respondents', models.IntegerField(default=0, verbose_name='Число ответивших пользователей')),
+                ('completions', models.IntegerField(default=0, verbose_name='Число ответивших на все вопросы')),
+                ('survey', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='result', to='main.Survey')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='QuestionResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('answers', models.IntegerField(default=0, verbose_name='Число ответов')),
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='result', to='main.Question')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChoiceResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('answers', models.IntegerField(default=0, verbose_name='Число ответов')),
+                ('choice', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='result', to='main.AnswerChoice')),
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_answer_survey(apps, schema_editor):
+    Answer = apps.get_model('main', 'Answer')
+    Question = apps.get_model('main', 'Question')
+    Answer.objects.filter(survey__isnull=True).update(
+        survey_id=models.Subquery(Question.objects.filter(id=models.OuterRef('question_id')).values('survey_id')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+    # Заполнение и NOT NULL в одной транзакции Postgres не выполнит из-за
+    # отложенной проверки внешнего ключа, поэтому шаги идут без общей транзакции
+    atomic = False
+
+    dependencies = [
+        ('main', '0004_results'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='survey',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='main.survey'),
+        ),
+        migrations.RunPython(fill_answer_survey, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='answer',
+            name='survey',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='main.survey'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 2.2.10 on 2026-10-18 02:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_answer_survey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Submission',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('choices', models.BinaryField(verbose_name='Выбранные варианты ответа')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('survey', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='submissions', to='main.Survey')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='submissions', to='main.User')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SubmissionText',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('body', models.TextField(blank=True, null=True)),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='main.Question')),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='texts', to='main.Submission')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['user', 'created', 'id'], name='submission_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['survey', 'id'], name='submission_survey_id_idx'),
+        ),
+    ]
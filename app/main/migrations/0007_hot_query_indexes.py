@@ -0,0 +1,29 @@
+# Generated by Django 2.2.10 on 2026-10-18 02:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_compact_submissions'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(condition=models.Q(is_deleted=False), fields=['survey', 'created', 'id'], name='question_live_survey_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='survey',
+            index=models.Index(condition=models.Q(is_deleted=False), fields=['start_date', 'end_date'], name='survey_live_dates_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['external_id'], name='user_external_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['login'], name='user_login_idx'),
+        ),
+    ]
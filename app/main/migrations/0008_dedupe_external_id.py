@@ -0,0 +1,32 @@
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicate_users(apps, schema_editor):
+    """
+    Перед уникальным индексом по external_id объединяет дубли пользователей:
+    ответы переносятся на пользователя с наименьшим id, остальные удаляются
+    Счетчики результатов после этого пересчитывает команда rebuild_results
+    """
+    User = apps.get_model('main', 'User')
+    Answer = apps.get_model('main', 'Answer')
+    Submission = apps.get_model('main', 'Submission')
+    duplicates = User.objects.filter(external_id__isnull=False).values('external_id').annotate(
+        n=Count('id'), keep=Min('id')
+    ).filter(n__gt=1).values_list('external_id', 'keep')
+    for external_id, keep in duplicates.iterator():
+        extra = User.objects.filter(external_id=external_id).exclude(id=keep)
+        Answer.objects.filter(user__in=extra).update(user_id=keep)
+        Submission.objects.filter(user__in=extra).update(user_id=keep)
+        extra.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_users, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.2.10 on 2026-10-18 02:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_dedupe_external_id'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='user',
+            name='user_external_id_idx',
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='external_id',
+            field=models.BigIntegerField(blank=True, null=True, unique=True),
+        ),
+    ]
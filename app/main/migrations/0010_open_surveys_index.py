@@ -0,0 +1,21 @@
+# Generated by Django 2.2.10 on 2026-10-18 02:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_unique_external_id'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='survey',
+            name='survey_live_dates_idx',
+        ),
+        migrations.AddIndex(
+            model_name='survey',
+            index=models.Index(condition=models.Q(('is_active', True), ('is_deleted', False)), fields=['start_date', 'end_date'], name='survey_open_dates_idx'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+import struct
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 1000
+
+
+def unpack(data):
+    data = bytes(data)
+    return list(struct.unpack(f'<{len(data) // 4}I', data))
+
+
+def move_text_choices(apps, schema_editor):
+    """
+    Раньше вариант с текстом хранился дважды: в упакованном массиве прохождения
+    и строкой SubmissionText без варианта. Вариант переносится в строку текста
+    и убирается из массива, счетчики результатов пересчитывает rebuild_results
+    """
+    Submission = apps.get_model('main', 'Submission')
+    SubmissionText = apps.get_model('main', 'SubmissionText')
+    AnswerChoice = apps.get_model('main', 'AnswerChoice')
+    submission_ids = SubmissionText.objects.filter(
+        choice__isnull=True, body__isnull=False
+    ).exclude(body='').order_by('submission_id').values_list('submission_id', flat=True).distinct()
+    batch = []
+    for submission_id in submission_ids.iterator():
+        batch.append(submission_id)
+        if len(batch) >= BATCH_SIZE:
+            move_batch(Submission, SubmissionText, AnswerChoice, batch)
+            batch = []
+    if batch:
+        move_batch(Submission, SubmissionText, AnswerChoice, batch)
+
+
+def move_batch(Submission, SubmissionText, AnswerChoice, submission_ids):
+    submissions = {row.id: row for row in Submission.objects.filter(id__in=submission_ids)}
+    packed = {submission_id: unpack(row.choices) for submission_id, row in submissions.items()}
+    questions = dict(AnswerChoice.objects.filter(
+        id__in={choice_id for choice_ids in packed.values() for choice_id in choice_ids}
+    ).values_list('id', 'question_id'))
+    texts = []
+    for text in SubmissionText.objects.filter(
+            submission_id__in=submission_ids, choice__isnull=True, body__isnull=False
+    ).exclude(body='').order_by('id'):
+        choice_ids = packed[text.submission_id]
+        choice_id = next((c for c in choice_ids if questions.get(c) == text.question_id), None)
+        if choice_id is not None:
+            choice_ids.remove(choice_id)
+            text.choice_id = choice_id
+            texts.append(text)
+    changed = {text.submission_id for text in texts}
+    for submission_id in changed:
+        choice_ids = sorted(packed[submission_id])
+        submissions[submission_id].choices = struct.pack(f'<{len(choice_ids)}I', *choice_ids)
+    SubmissionText.objects.bulk_update(texts, ['choice'])
+    Submission.objects.bulk_update([submissions[submission_id] for submission_id in changed], ['choices'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_open_surveys_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submissiontext',
+            name='choice',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='main.answerchoice'),
+        ),
+        migrations.RunPython(move_text_choices, migrations.RunPython.noop),
+    ]
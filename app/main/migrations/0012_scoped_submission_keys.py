@@ -0,0 +1,54 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def delete_global_keys(apps, schema_editor):
+    """
+    Ключи без опроса и респондента нельзя отнести к области, в которой они уникальны,
+    поэтому удаляются: повтор такого прохождения будет записан еще раз
+    """
+    apps.get_model('main', 'SubmissionKey').objects.filter(survey__isnull=True).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_submission_text_choice'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submissionkey',
+            name='survey',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.survey'),
+        ),
+        migrations.AddField(
+            model_name='submissionkey',
+            name='respondent',
+            field=models.BigIntegerField(null=True, verbose_name='external_id респондента'),
+        ),
+        migrations.RunPython(delete_global_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='submissionkey',
+            name='survey',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.survey'),
+        ),
+        migrations.AlterField(
+            model_name='submissionkey',
+            name='respondent',
+            field=models.BigIntegerField(verbose_name='external_id респондента'),
+        ),
+        migrations.AlterField(
+            model_name='submissionkey',
+            name='key',
+            field=models.CharField(max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name='submissionkey',
+            constraint=models.UniqueConstraint(fields=('survey', 'respondent', 'key'), name='submission_key_scope_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='submissionkey',
+            index=models.Index(fields=['created'], name='submission_key_created_idx'),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_scoped_submission_keys'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='survey',
+            index=models.Index(condition=models.Q(is_deleted=False), fields=['start_date', 'end_date'], name='survey_live_dates_idx'),
+        ),
+    ]
@@ -43,7 +43,7 @@ class QuestionType:
 
 
 class User(models.Model):
-    external_id = models.BigIntegerField(null=True, blank=True)
+    external_id = models.BigIntegerField(null=True, blank=True, unique=True)
     login = models.CharField(max_length=100)
     phone = models.CharField(max_length=15, null=True, blank=True)
     email = models.EmailField(max_length=40, null=True, blank=True)
@@ -56,6 +56,11 @@ class User(models.Model):
     created = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
     updated = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['login'], name='user_login_idx'),
+        ]
+
     def hash_password(self, password):
         h = hashlib.sha256()
         h.update(password.encode('utf-8'))
@@ -73,6 +78,21 @@ class Survey(models.Model):
     is_deleted = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created', 'id'], name='survey_created_id_idx'),
+            models.Index(
+                fields=['start_date', 'end_date'],
+                name='survey_live_dates_idx',
+                condition=models.Q(is_deleted=False)
+            ),
+            models.Index(
+                fields=['start_date', 'end_date'],
+                name='survey_open_dates_idx',
+                condition=models.Q(is_deleted=False, is_active=True)
+            ),
+        ]
+
 
 class Question(models.Model):
     survey = models.ForeignKey(Survey, on_delete=models.PROTECT, related_name='questions')
@@ -82,6 +102,17 @@ class Question(models.Model):
     created = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
     updated = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created', 'id'], name='question_created_id_idx'),
+            models.Index(fields=['survey', 'id'], name='question_survey_id_idx'),
+            models.Index(
+                fields=['survey', 'created', 'id'],
+                name='question_live_survey_idx',
+                condition=models.Q(is_deleted=False)
+            ),
+        ]
+
 
 class AnswerChoice(models.Model):
     question = models.ForeignKey(Question, on_delete=models.PROTECT, related_name='answer_choices')
@@ -93,9 +124,82 @@ class AnswerChoice(models.Model):
 
 class Answer(models.Model):
     question = models.ForeignKey(Question, on_delete=models.PROTECT, related_name='all_answers')
+    # опрос вопроса, хранится в ответе для отбора по опросу без join и секционирования по нему
+    survey = models.ForeignKey(Survey, on_delete=models.PROTECT, related_name='+')
     user = models.ForeignKey(User, on_delete=models.PROTECT, related_name='answers')
     choice = models.ForeignKey(AnswerChoice, on_delete=models.PROTECT, blank=True, null=True)
     body = models.TextField(null=True, blank=True)
     created = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created', 'id'], name='answer_user_created_id_idx'),
+        ]
+
+
+
+
+class SubmissionKey(models.Model):
+    """
+    Ключ идемпотентности записанного прохождения опроса
+    Ключ уникален в пределах опроса и респондента, старые ключи удаляет purge_submission_keys
+    """
+    survey = models.ForeignKey(Survey, on_delete=models.CASCADE, related_name='+')
+    respondent = models.BigIntegerField(verbose_name="external_id респондента")
+    key = models.CharField(max_length=64)
+    created = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['survey', 'respondent', 'key'], name='submission_key_scope_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['created'], name='submission_key_created_idx'),
+        ]
+
+
+class SurveyResult(models.Model):
+    """
+    Счетчики прохождений опроса
+    Обновляются при записи ответов, пересчитываются командой rebuild_results
+    """
+    survey = models.OneToOneField(Survey, on_delete=models.CASCADE, related_name='result')
+    respondents = models.IntegerField(default=0, verbose_name="Число ответивших пользователей")
+    completions = models.IntegerField(default=0, verbose_name="Число ответивших на все вопросы")
+
+
+class QuestionResult(models.Model):
+    question = models.OneToOneField(Question, on_delete=models.CASCADE, related_name='result')
+    answers = models.IntegerField(default=0, verbose_name="Число ответов")
+
+
+class ChoiceResult(models.Model):
+    choice = models.OneToOneField(AnswerChoice, on_delete=models.CASCADE, related_name='result')
+    answers = models.IntegerField(default=0, verbose_name="Число ответов")
+
+
+class Submission(models.Model):
+    """
+    Прохождение опроса в компактном хранении (ANSWER_STORAGE = 'compact')
+    Выбранные варианты ответа хранятся одним массивом id, см. main.submissions
+    """
+    user = models.ForeignKey(User, on_delete=models.PROTECT, related_name='submissions')
+    survey = models.ForeignKey(Survey, on_delete=models.PROTECT, related_name='submissions')
+    choices = models.BinaryField(verbose_name="Выбранные варианты ответа")
+    created = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created', 'id'], name='submission_user_created_idx'),
+            models.Index(fields=['survey', 'id'], name='submission_survey_id_idx'),
+        ]
+
 
+class SubmissionText(models.Model):
+    """
+    Ответ без варианта (текстом или пустой) или вариант с текстом в компактном хранении
+    """
+    submission = models.ForeignKey(Submission, on_delete=models.CASCADE, related_name='texts')
+    question = models.ForeignKey(Question, on_delete=models.PROTECT)
+    choice = models.ForeignKey(AnswerChoice, on_delete=models.PROTECT, blank=True, null=True)
+    body = models.TextField(null=True, blank=True)
@@ -0,0 +1,117 @@
+"""
+Keyset-пагинация списков
+
+Курсор хранит значение поля сортировки и id последней записи страницы,
+следующая страница выбирается условием (поле, id) > (значение, id)
+по составному индексу, без OFFSET и без загрузки всего списка.
+"""
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Сортировка берется из параметра ordering (OrderingFilter) или из view.ordering,
+    учитывается только первое поле, к нему добавляется id для однозначности
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = settings.MAX_PAGE_SIZE
+    ordering = None
+
+    def get_ordering(self, request, queryset, view):
+        if self.ordering:
+            return self.ordering
+        ordering = OrderingFilter().get_ordering(request, queryset, view)
+        return ordering[0]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.page_queryset(queryset, request, view)))
+
+    def page_queryset(self, queryset, request, view=None):
+        """
+        Запрос строк страницы (на одну больше размера страницы, чтобы узнать о следующей)
+        Строки передаются в set_page, так страницу можно прочитать и асинхронно
+        """
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        ordering = self.get_ordering(request, queryset, view)
+        self.field = ordering.lstrip('-')
+        descending = ordering.startswith('-')
+
+        cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor[2])
+        if descending != reverse:
+            queryset = queryset.order_by(f'-{self.field}', '-id')
+            lookup = 'lt'
+        else:
+            queryset = queryset.order_by(self.field, 'id')
+            lookup = 'gt'
+        if cursor:
+            value = queryset.model._meta.get_field(self.field).to_python(cursor[0])
+            queryset = queryset.filter(
+                Q(**{f'{self.field}__{lookup}': value}) |
+                Q(**{self.field: value, f'id__{lookup}': cursor[1]})
+            )
+
+        self.reverse = reverse
+        self.has_cursor = cursor is not None
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, rows):
+        reverse = self.reverse
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = self.has_cursor, has_more
+        return self.page
+
+    def _position(self, row, reverse):
+        if isinstance(row, dict):
+            value, pk = row[self.field], row['id']
+        else:
+            value, pk = getattr(row, self.field), row.pk
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        return [value, pk, int(reverse)]
+
+    def encode_cursor(self, position):
+        encoded = urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            value, pk, reverse = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            return value, int(pk), bool(reverse)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self._position(self.page[-1], reverse=False))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self._position(self.page[0], reverse=True))
+
+
+class AnswerPagination(KeysetPagination):
+    ordering = '-created'
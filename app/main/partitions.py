@@ -0,0 +1,212 @@
+"""
+Помесячное секционирование таблицы ответов по created, только для Postgres 12+
+
+Таблица main_answer становится секционированной по диапазону created,
+каждая секция - один месяц, строки вне созданных секций попадают в секцию
+по умолчанию. Месячная секция делится по хешу survey_id на
+ANSWER_PARTITION_SURVEY_BUCKETS частей. Запросы с условием на created
+(since в get_answers) читают только нужные месяцы, с условием на survey_id
+(выгрузка, результаты) - одну часть каждого месяца. Старые секции
+отсоединяются и при желании выгружаются в CSV и удаляются.
+Таблицу на секции переводит команда answer_partitions --convert.
+"""
+import os
+from datetime import date
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Answer
+
+PARENT = Answer._meta.db_table
+UNPARTITIONED = f'{PARENT}_unpartitioned'
+DEFAULT_PARTITION = f'{PARENT}_default'
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    """
+    Имя секции месяца, например main_answer_2024_01
+    """
+    return f'{PARENT}_{month:%Y_%m}'
+
+
+def partition_month(name):
+    """
+    Месяц секции по ее имени, None для секции по умолчанию и чужих таблиц
+    """
+    try:
+        year, month = name[len(PARENT) + 1:].split('_')
+        return date(int(year), int(month), 1)
+    except ValueError:
+        return None
+
+
+def is_partitioned(cursor, name=PARENT):
+    cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [name])
+    return cursor.fetchone() is not None
+
+
+def list_partitions(cursor):
+    """
+    :return: список имен секций таблицы ответов
+    """
+    cursor.execute(
+        'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+        'WHERE i.inhparent = %s::regclass ORDER BY c.relname',
+        [PARENT]
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def month_range(month):
+    return [month.isoformat(), add_months(month, 1).isoformat()]
+
+
+def create_month(cursor, month):
+    """
+    Секция месяца, разделенная по хешу survey_id
+    Число частей берется из настроек при создании, у прежних месяцев оно не меняется
+    """
+    name = partition_name(month)
+    buckets = settings.ANSWER_PARTITION_SURVEY_BUCKETS
+    cursor.execute(
+        f'CREATE TABLE {name} PARTITION OF {PARENT} FOR VALUES FROM (%s) TO (%s) PARTITION BY HASH (survey_id)',
+        month_range(month)
+    )
+    for remainder in range(buckets):
+        cursor.execute(
+            f'CREATE TABLE {name}_p{remainder} PARTITION OF {name} '
+            f'FOR VALUES WITH (MODULUS {buckets}, REMAINDER {remainder})'
+        )
+    return name
+
+
+def create_partitions(cursor, first, last):
+    """
+    Создает недостающие секции с месяца first по месяц last включительно
+    Postgres не создает секцию, если строки ее диапазона уже лежат в секции
+    по умолчанию, поэтому она на это время отсоединяется, а строки переносятся
+    :return: имена созданных секций
+    """
+    existing = set(list_partitions(cursor))
+    months = []
+    month = month_start(first)
+    while month <= month_start(last):
+        if partition_name(month) not in existing:
+            months.append(month)
+        month = add_months(month, 1)
+    moved = [month for month in months if DEFAULT_PARTITION in existing and default_has_rows(cursor, month)]
+    if moved:
+        cursor.execute(f'ALTER TABLE {PARENT} DETACH PARTITION {DEFAULT_PARTITION}')
+    created = [create_month(cursor, month) for month in months]
+    if moved:
+        for month in moved:
+            cursor.execute(
+                f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE created >= %s AND created < %s RETURNING *) '
+                f'INSERT INTO {PARENT} SELECT * FROM moved',
+                month_range(month)
+            )
+        cursor.execute(f'ALTER TABLE {PARENT} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT')
+    return created
+
+
+def default_has_rows(cursor, month):
+    cursor.execute(
+        f'SELECT 1 FROM {DEFAULT_PARTITION} WHERE created >= %s AND created < %s LIMIT 1',
+        month_range(month)
+    )
+    return cursor.fetchone() is not None
+
+
+def ensure_partitions(ahead):
+    """
+    Секции с текущего месяца на ahead месяцев вперед
+    """
+    today = timezone.now().date()
+    with transaction.atomic(), connection.cursor() as cursor:
+        return create_partitions(cursor, today, add_months(month_start(today), ahead))
+
+
+def convert_to_partitioned(ahead):
+    """
+    Переносит ответы в секционированную таблицу с теми же внешними ключами
+    и последовательностью id, индексы создаются заново по модели Answer.
+    Столбец id может быть serial (таблица создана Django до 4.1) или identity,
+    у identity продолжается новая последовательность с того же значения.
+    Первичный ключ становится (id, created, survey_id), так как Postgres
+    требует ключи секционирования в уникальных ограничениях
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        if is_partitioned(cursor):
+            return False
+        cursor.execute(f'ALTER TABLE {PARENT} RENAME TO {UNPARTITIONED}')
+        cursor.execute(
+            'SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint '
+            'WHERE conrelid = %s::regclass AND contype = %s',
+            [UNPARTITIONED, 'f']
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [UNPARTITIONED, 'id'])
+        sequence = cursor.fetchone()[0]
+        cursor.execute(
+            'SELECT attidentity FROM pg_attribute WHERE attrelid = %s::regclass AND attname = %s',
+            [UNPARTITIONED, 'id']
+        )
+        identity = bool(cursor.fetchone()[0])
+
+        cursor.execute(
+            f'CREATE TABLE {PARENT} (LIKE {UNPARTITIONED} INCLUDING DEFAULTS INCLUDING IDENTITY) '
+            f'PARTITION BY RANGE (created)'
+        )
+        cursor.execute(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {PARENT} DEFAULT')
+        cursor.execute(f'SELECT min(created) FROM {UNPARTITIONED}')
+        oldest = cursor.fetchone()[0] or timezone.now()
+        create_partitions(cursor, oldest, add_months(month_start(timezone.now()), ahead))
+        cursor.execute(f'INSERT INTO {PARENT} SELECT * FROM {UNPARTITIONED}')
+        if identity:
+            cursor.execute(
+                f'SELECT setval(pg_get_serial_sequence(%s, %s), last_value, is_called) FROM {sequence}',
+                [PARENT, 'id']
+            )
+        else:
+            cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {PARENT}.id')
+        cursor.execute(f'DROP TABLE {UNPARTITIONED}')
+
+        cursor.execute(f'ALTER TABLE {PARENT} ADD PRIMARY KEY (id, created, survey_id)')
+        with connection.schema_editor(atomic=False) as schema_editor:
+            for sql in schema_editor._model_indexes_sql(Answer):
+                schema_editor.execute(sql)
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE {PARENT} ADD CONSTRAINT {name} {definition}')
+    return True
+
+
+def detach_partitions(before, archive_dir=None):
+    """
+    Отсоединяет секции месяцев раньше before
+    Если передан archive_dir, секция выгружается в archive_dir/<имя>.csv и удаляется
+    :return: имена отсоединенных секций
+    """
+    detached = []
+    with connection.cursor() as cursor:
+        for name in list_partitions(cursor):
+            month = partition_month(name)
+            if month is None or month >= month_start(before):
+                continue
+            cursor.execute(f'ALTER TABLE {PARENT} DETACH PARTITION {name}')
+            if archive_dir:
+                with open(os.path.join(archive_dir, f'{name}.csv'), 'w') as out:
+                    cursor.copy_expert(f'COPY (SELECT * FROM {name}) TO STDOUT WITH CSV HEADER', out)
+                cursor.execute(f'DROP TABLE {name}')
+            detached.append(name)
+    return detached
@@ -0,0 +1,90 @@
+"""
+Проверка паролей при входе
+
+Хэширование PBKDF2 выполняется в ограниченном пуле потоков
+(hashlib отпускает GIL), при переполнении очереди вход сразу
+отклоняется с 429. Недавно проверенные пары логин/пароль хранятся
+в кэше по HMAC-дайджесту, повторный вход сервисов не запускает KDF.
+Как и django.contrib.auth.authenticate, вход неактивного пользователя
+отклоняется, о неудачном входе отправляется сигнал user_login_failed.
+"""
+import hashlib
+import hmac
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password
+from django.contrib.auth.signals import user_login_failed
+
+from .cache import LRUCache
+
+
+class LoginBusy(Exception):
+    """
+    Очередь проверки паролей заполнена
+    """
+
+
+def login_failed(login, request=None):
+    """
+    Сигнал user_login_failed с логином, как при неудачном authenticate
+    """
+    user_login_failed.send(sender=__name__, credentials={'username': login}, request=request)
+
+
+class PasswordVerifier:
+    def __init__(self, workers, queue_limit, cache_size, cache_ttl):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='login')
+        self.slots = threading.BoundedSemaphore(queue_limit)
+        self.cache = LRUCache(cache_size)
+        self.cache_ttl = cache_ttl
+
+    @staticmethod
+    def digest(login, password):
+        message = f'{login}\0{password}'.encode('utf-8')
+        return hmac.new(settings.SECRET_KEY.encode('utf-8'), message, hashlib.sha256).digest()
+
+    def check(self, password, encoded):
+        """
+        check_password в пуле потоков
+        :raises LoginBusy: если в очереди уже queue_limit проверок
+        """
+        if not self.slots.acquire(blocking=False):
+            raise LoginBusy()
+        try:
+            future = self.executor.submit(check_password, password, encoded)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda f: self.slots.release())
+        return future.result()
+
+    def verify(self, user, password, request=None):
+        """
+        Проверяет пароль пользователя main.models.User
+        Запись кэша действительна, пока не изменился хэш пароля auth_user
+        """
+        auth_user = user.auth_user
+        if auth_user is None or not auth_user.is_active or not user.salt:
+            login_failed(user.login, request)
+            return False
+        hashed = user.hash_password(password)
+        key = self.digest(user.login, hashed)
+        cached = self.cache.get(key)
+        if cached is not None and cached[0] == auth_user.password and cached[1] > time.monotonic():
+            return True
+        if not self.check(hashed, auth_user.password):
+            login_failed(user.login, request)
+            return False
+        self.cache.set(key, (auth_user.password, time.monotonic() + self.cache_ttl))
+        return True
+
+
+password_verifier = PasswordVerifier(
+    settings.LOGIN_WORKERS,
+    settings.LOGIN_QUEUE_LIMIT,
+    settings.LOGIN_CACHE_SIZE,
+    settings.LOGIN_CACHE_TTL
+)
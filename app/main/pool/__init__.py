@@ -0,0 +1,152 @@
+"""
+Пул соединений с БД внутри процесса
+
+Движок main.pool (см. base.py) берет соединения из пула вместо
+psycopg2.connect и возвращает их в пул при закрытии соединения Django.
+"""
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+
+class PoolTimeout(Exception):
+    """
+    Свободное соединение не появилось за отведенное время
+    """
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул с ограничением числа соединений
+    :param int min_size: сколько соединений открыть при первом обращении
+    :param int max_size: предел одновременно открытых соединений
+    :param float timeout: сколько ждать свободного соединения, секунд
+    :param float check_interval: проверять соединения, простоявшие дольше, секунд
+    :param check: функция conn -> bool, проверка живости соединения
+    :param reset: функция conn -> bool, возврат соединения в исходное состояние
+    """
+
+    def __init__(self, min_size, max_size, timeout, check_interval, check, reset):
+        self.min_size = min(min_size, max_size)
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.check = check
+        self.reset = reset
+        self.size = 0
+        self._idle = deque()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    def _open(self, connect, up_to=None):
+        """
+        Открывает одно соединение или, если передан up_to, столько, чтобы их стало up_to
+        """
+        with self._lock:
+            count = 1 if up_to is None else max(up_to - self.size, 0)
+            self.size += count
+        opened = []
+        try:
+            for _ in range(count):
+                opened.append(connect())
+        finally:
+            with self._lock:
+                self.size -= count - len(opened)
+        return opened
+
+    def _discard(self, conn):
+        with self._lock:
+            self.size -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _healthy(self, conn):
+        try:
+            return self.check(conn)
+        except Exception:
+            return False
+
+    def get(self, connect):
+        """
+        Выдает соединение из пула, при необходимости открывает новое
+        :param connect: функция без аргументов, открывающая соединение
+        :raises PoolTimeout: если все max_size соединений заняты дольше timeout
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f'Нет свободных соединений за {self.timeout} с')
+        try:
+            for conn in self._open(connect, self.min_size):
+                self._idle.append((conn, time.monotonic()))
+            while True:
+                try:
+                    conn, returned = self._idle.pop()
+                except IndexError:
+                    return self._open(connect)[0]
+                if time.monotonic() - returned > self.check_interval and not self._healthy(conn):
+                    self._discard(conn)
+                    continue
+                return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def put(self, conn):
+        """
+        Возвращает соединение в пул, неисправное закрывает
+        """
+        try:
+            usable = self.reset(conn)
+        except Exception:
+            usable = False
+        if usable:
+            self._idle.append((conn, time.monotonic()))
+        else:
+            self._discard(conn)
+        self._slots.release()
+
+    def close(self):
+        """
+        Закрывает свободные соединения
+        """
+        while self._idle:
+            conn, returned = self._idle.pop()
+            self._discard(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, check, reset):
+    """
+    Пул для подключения alias, размеры берутся из настроек DB_POOL_*
+    """
+    with _pools_lock:
+        if alias not in _pools:
+            _pools[alias] = ConnectionPool(
+                settings.DB_POOL_MIN_SIZE,
+                settings.DB_POOL_MAX_SIZE,
+                settings.DB_POOL_TIMEOUT,
+                settings.DB_POOL_CHECK_INTERVAL,
+                check,
+                reset
+            )
+        return _pools[alias]
+
+
+def close_pool(alias):
+    """
+    Закрывает свободные соединения пула подключения alias и забывает пул
+    """
+    with _pools_lock:
+        pool = _pools.pop(alias, None)
+    if pool is not None:
+        pool.close()
@@ -0,0 +1,51 @@
+"""
+Движок PostgreSQL с пулом соединений: ENGINE = 'main.pool'
+"""
+from django.db.backends.postgresql.base import DatabaseWrapper as PostgresDatabaseWrapper
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from main.pool import get_pool, PoolTimeout
+
+
+def check_connection(conn):
+    if conn.closed:
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT 1')
+    if not conn.autocommit:
+        conn.rollback()
+    return True
+
+
+def reset_connection(conn):
+    if conn.closed:
+        return False
+    if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+        conn.rollback()
+    return True
+
+
+class DatabaseWrapper(PostgresDatabaseWrapper):
+    @property
+    def pool(self):
+        return get_pool(self.alias, check_connection, reset_connection)
+
+    def get_new_connection(self, conn_params):
+        """
+        Соединение из пула, новое открывается обычным get_new_connection Django
+        """
+        connect = super().get_new_connection
+        try:
+            connection = self.pool.get(lambda: connect(conn_params))
+        except PoolTimeout as e:
+            raise self.Database.OperationalError(str(e)) from e
+        self.isolation_level = IsolationLevel(
+            self.settings_dict['OPTIONS'].get('isolation_level', IsolationLevel.READ_COMMITTED)
+        )
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.put(self.connection)
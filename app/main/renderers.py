@@ -0,0 +1,47 @@
+"""
+Быстрое кодирование JSON через orjson, если пакет установлен
+
+Вывод побайтно совпадает с rest_framework.renderers.JSONRenderer:
+компактные разделители, UTF-8 без экранирования, U+2028 и U+2029
+экранированы. Без orjson используется обычный JSONRenderer.
+"""
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+LINE_SEPARATORS = (
+    ('\u2028'.encode('utf-8'), b'\\u2028'),
+    ('\u2029'.encode('utf-8'), b'\\u2029'),
+)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Даты и время отдаются кодировщику DRF, поэтому их формат тот же.
+    Данные, которые orjson не кодирует (ключи-числа, очень большие целые),
+    кодируются обычным JSONRenderer. Числа с плавающей точкой orjson
+    записывает иначе (1e16 вместо 1e+16), для деревьев опросов это не важно.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or not self.compact or \
+                self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            content = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME
+            )
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        for separator, escaped in LINE_SEPARATORS:
+            content = content.replace(separator, escaped)
+        return content
+
+
+def render_json(data):
+    return FastJSONRenderer().render(data)
@@ -4,9 +4,11 @@ USER_NOT_FOUND = 'Пользователь не найден'
 TOKEN_NOT_FOUND = 'Не передан токен'
 BAD_REQUEST = 'Ошибка входных данных.'
 ACCESS_FORBIDDEN = 'Недостаточно прав.'
+TOO_MANY_REQUESTS = 'Слишком много запросов, повторите позже.'
+SURVEY_CLOSED = 'Опрос не найден или закрыт.'
+STREAM_NOT_SUPPORTED = 'Потоковая выдача доступна только в /api/surveys/answers.'
 
 # -- Success responses ---
 SUCCESS_RESPONSE = 'Успешный ответ'
-
-
-
+ACCEPTED_RESPONSE = 'Принято в обработку'
+NOT_MODIFIED = 'Опрос не изменился'
@@ -0,0 +1,214 @@
+"""
+Агрегированные результаты опросов
+
+Счетчики в SurveyResult, QuestionResult и ChoiceResult увеличиваются
+в той же транзакции, что и запись ответов (ingestion.write_submissions),
+поэтому для результатов не нужно читать таблицу ответов.
+rebuild_results пересчитывает их из Answer или, при компактном хранении, из Submission
+для заполнения и исправления расхождений.
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Value, When
+
+from .models import Answer, AnswerChoice, Question, SurveyResult, QuestionResult, ChoiceResult
+from .submissions import compact_storage, answered_questions, submission_counts
+
+
+def increment(model, key, counters):
+    """
+    Увеличивает счетчики одним UPDATE, создавая недостающие строки
+    :param model: модель счетчиков
+    :param str key: поле, по которому ищется строка счетчиков
+    :param dict counters: {поле счетчика: {значение key: прирост}}
+    """
+    keys = set()
+    for deltas in counters.values():
+        keys.update(k for k, delta in deltas.items() if delta)
+    if not keys:
+        return
+    model.objects.bulk_create([model(**{key: k}) for k in keys], ignore_conflicts=True)
+    model.objects.filter(**{f'{key}__in': keys}).update(**{
+        field: F(field) + Case(
+            *[When(**{key: k}, then=Value(delta)) for k, delta in deltas.items() if delta],
+            default=Value(0),
+            output_field=IntegerField()
+        ) for field, deltas in counters.items()
+    })
+
+
+def update_results(submissions, users):
+    """
+    Учитывает прохождения в счетчиках результатов
+    Вызывается до вставки ответов, чтобы по уже записанным ответам
+    определить новых респондентов и завершенные прохождения
+    :param list submissions: прохождения в формате ingestion.write_submissions
+    :param dict users: external_id -> id пользователя
+    :return: question_id -> survey_id для вопросов прохождений
+    """
+    question_ids = {answer['question_id'] for item in submissions for answer in item['answers']}
+    if not question_ids:
+        return {}
+    question_surveys = dict(Question.objects.filter(
+        id__in=question_ids
+    ).values_list('id', 'survey_id'))
+    survey_ids = set(question_surveys.values())
+    active_questions = defaultdict(set)
+    for survey_id, question_id in Question.objects.filter(
+            survey_id__in=survey_ids,
+            is_deleted=False
+    ).values_list('survey_id', 'id'):
+        active_questions[survey_id].add(question_id)
+
+    user_ids = {users[item['user_id']] for item in submissions}
+    if compact_storage():
+        answered = answered_questions(user_ids, survey_ids)
+    else:
+        answered = defaultdict(set)
+        for user_id, survey_id, question_id in Answer.objects.filter(
+                user_id__in=user_ids,
+                survey_id__in=survey_ids
+        ).values_list('user_id', 'survey_id', 'question_id').distinct():
+            answered[user_id, survey_id].add(question_id)
+
+    respondents = Counter()
+    completions = Counter()
+    question_answers = Counter()
+    choice_answers = Counter()
+    for item in submissions:
+        user_id = users[item['user_id']]
+        submitted = defaultdict(set)
+        for answer in item['answers']:
+            submitted[question_surveys[answer['question_id']]].add(answer['question_id'])
+            question_answers[answer['question_id']] += 1
+            if answer.get('choice_id') is not None:
+                choice_answers[answer['choice_id']] += 1
+        for survey_id, survey_questions in submitted.items():
+            previous = answered[user_id, survey_id]
+            if not previous:
+                respondents[survey_id] += 1
+            active = active_questions[survey_id]
+            if not active <= previous and active <= previous | survey_questions:
+                completions[survey_id] += 1
+            previous.update(survey_questions)
+
+    increment(SurveyResult, 'survey_id', {'respondents': respondents, 'completions': completions})
+    increment(QuestionResult, 'question_id', {'answers': question_answers})
+    increment(ChoiceResult, 'choice_id', {'answers': choice_answers})
+    return question_surveys
+
+
+def row_results(survey_ids):
+    """
+    Счетчики опросов из таблицы ответов
+    :return: словари respondents, completions по опросам, ответы по вопросам и по вариантам
+    """
+    answers = Answer.objects.filter(survey_id__in=survey_ids)
+    active_counts = dict(Question.objects.filter(
+        survey_id__in=survey_ids,
+        is_deleted=False
+    ).values('survey_id').annotate(n=Count('id')).values_list('survey_id', 'n'))
+    respondents = dict(answers.values('survey_id').annotate(
+        n=Count('user_id', distinct=True)).values_list('survey_id', 'n'))
+    completions = Counter()
+    for survey_id, answered in answers.filter(
+            question__is_deleted=False
+    ).values('survey_id', 'user_id').annotate(
+        n=Count('question_id', distinct=True)
+    ).values_list('survey_id', 'n').iterator():
+        if answered == active_counts.get(survey_id):
+            completions[survey_id] += 1
+    question_answers = dict(answers.values('question_id').annotate(
+        n=Count('id')).values_list('question_id', 'n'))
+    choice_answers = dict(answers.filter(choice__isnull=False).values('choice_id').annotate(
+        n=Count('id')).values_list('choice_id', 'n'))
+    return respondents, completions, question_answers, choice_answers
+
+
+def compact_results(survey_ids):
+    """
+    Счетчики опросов из компактного хранения, в том же формате, что row_results
+    """
+    active_questions = defaultdict(set)
+    for survey_id, question_id in Question.objects.filter(
+            survey_id__in=survey_ids,
+            is_deleted=False
+    ).values_list('survey_id', 'id'):
+        active_questions[survey_id].add(question_id)
+    answered, question_answers, choice_answers = submission_counts(survey_ids)
+    respondents = {survey_id: len(users) for survey_id, users in answered.items()}
+    completions = Counter()
+    for survey_id, users in answered.items():
+        active = active_questions[survey_id]
+        for questions in users.values():
+            if active <= questions:
+                completions[survey_id] += 1
+    return respondents, completions, question_answers, choice_answers
+
+
+def rebuild_results(survey_ids):
+    """
+    Пересчитывает счетчики опросов из сохраненных ответов
+    :param list survey_ids: id опросов одной порции
+    """
+    with transaction.atomic():
+        question_ids = list(Question.objects.filter(survey_id__in=survey_ids).values_list('id', flat=True))
+        choice_ids = list(AnswerChoice.objects.filter(question_id__in=question_ids).values_list('id', flat=True))
+        if compact_storage():
+            respondents, completions, question_answers, choice_answers = compact_results(survey_ids)
+        else:
+            respondents, completions, question_answers, choice_answers = row_results(survey_ids)
+
+        SurveyResult.objects.filter(survey_id__in=survey_ids).delete()
+        QuestionResult.objects.filter(question_id__in=question_ids).delete()
+        ChoiceResult.objects.filter(choice_id__in=choice_ids).delete()
+        SurveyResult.objects.bulk_create([
+            SurveyResult(
+                survey_id=survey_id,
+                respondents=respondents.get(survey_id, 0),
+                completions=completions[survey_id]
+            ) for survey_id in survey_ids
+        ])
+        QuestionResult.objects.bulk_create([
+            QuestionResult(question_id=question_id, answers=question_answers.get(question_id, 0))
+            for question_id in question_ids
+        ])
+        ChoiceResult.objects.bulk_create([
+            ChoiceResult(choice_id=choice_id, answers=choice_answers.get(choice_id, 0))
+            for choice_id in choice_ids
+        ])
+
+
+def get_results(survey):
+    """
+    Результаты опроса только из таблиц счетчиков
+    """
+    result = SurveyResult.objects.filter(survey_id=survey.id).first()
+    choices = defaultdict(list)
+    for choice in AnswerChoice.objects.filter(
+            question__survey_id=survey.id,
+            is_deleted=False
+    ).order_by('id').values('id', 'question_id', 'body', 'result__answers'):
+        choices[choice['question_id']].append({
+            'id': choice['id'],
+            'body': choice['body'],
+            'answers': choice['result__answers'] or 0
+        })
+    return {
+        'survey_id': survey.id,
+        'respondents': result.respondents if result else 0,
+        'completions': result.completions if result else 0,
+        'questions': [
+            {
+                'id': question['id'],
+                'body': question['body'],
+                'question_type': question['question_type'],
+                'answers': question['result__answers'] or 0,
+                'choices': choices[question['id']]
+            } for question in Question.objects.filter(
+                survey_id=survey.id,
+                is_deleted=False
+            ).order_by('id').values('id', 'body', 'question_type', 'result__answers')
+        ]
+    }
@@ -0,0 +1,113 @@
+"""
+Маршрутизация запросов к БД между основной базой и репликами
+
+Чтение идет на реплики из settings.REPLICA_DATABASES, запись - на default.
+После первой записи в рамках запроса (и во всех небезопасных HTTP-методах)
+чтение тоже идет на default, чтобы видеть только что записанное.
+Соединение с репликой проверяется запросом SELECT 1 не реже раза
+в REPLICA_PROBE_INTERVAL секунд, недоступная реплика исключается
+на REPLICA_RETRY_INTERVAL секунд.
+"""
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+pinned_to_primary = ContextVar('pinned_to_primary', default=False)
+
+
+class ReplicaHealth:
+    """
+    Отметки о недоступных репликах, общие для всех потоков
+    """
+
+    def __init__(self):
+        self._down_until = {}
+        self._lock = threading.Lock()
+
+    def is_down(self, alias):
+        with self._lock:
+            until = self._down_until.get(alias)
+            if until is not None and until <= time.monotonic():
+                del self._down_until[alias]
+                until = None
+        return until is not None
+
+    def mark_down(self, alias):
+        with self._lock:
+            self._down_until[alias] = time.monotonic() + settings.REPLICA_RETRY_INTERVAL
+
+    def reset(self):
+        with self._lock:
+            self._down_until.clear()
+
+    def available(self, alias):
+        """
+        Реплика доступна, если не отмечена и соединение этого потока отвечает на SELECT 1
+        Проверка выполняется не чаще раза в REPLICA_PROBE_INTERVAL секунд на соединение
+        """
+        if self.is_down(alias):
+            return False
+        connection = connections[alias]
+        if getattr(connection, 'probed_until', 0) > time.monotonic():
+            return True
+        try:
+            connection.ensure_connection()
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except DatabaseError:
+            logger.warning('Реплика %s недоступна, чтение переключено на основную БД', alias)
+            self.mark_down(alias)
+            self.close(connection)
+            return False
+        connection.probed_until = time.monotonic() + settings.REPLICA_PROBE_INTERVAL
+        return True
+
+    @staticmethod
+    def close(connection):
+        """
+        Закрывает сломанное соединение, чтобы после REPLICA_RETRY_INTERVAL подключиться заново
+        """
+        connection.probed_until = 0
+        try:
+            connection.close()
+        except DatabaseError:
+            pass
+
+
+replica_health = ReplicaHealth()
+
+
+def pin_to_primary():
+    """
+    Направляет все дальнейшие запросы текущего HTTP-запроса на основную БД
+    """
+    pinned_to_primary.set(True)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if pinned_to_primary.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        replicas = list(settings.REPLICA_DATABASES)
+        random.shuffle(replicas)
+        for alias in replicas:
+            if replica_health.available(alias):
+                return alias
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.REPLICA_DATABASES
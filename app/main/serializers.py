@@ -1,15 +1,15 @@
 import logging
 
+from django.db import transaction
 from rest_framework import serializers, exceptions, status
 
-from .models import Survey, Question, AnswerChoice, QuestionType, Answer, User
+from .models import Survey, Question, AnswerChoice, QuestionType
+from .answers import ANSWER_OUTPUT, GROUP_BY_NONE, GROUP_BY_SURVEY, STREAM_JSON, STREAM_NDJSON
+from .importing import create_surveys
+from .metrics import serializer_timing
+from .ingestion import answers_error, survey_questions, write_submissions
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-logger_handler = logging.FileHandler("logs/requests.log")
-logger_handler.setLevel(logging.INFO)
-logger_handler.setFormatter(logging.Formatter("%(message)s"))
-logger.addHandler(logger_handler)
 
 
 class ValidationError(exceptions.APIException):
@@ -23,18 +23,34 @@ class ValidationError(exceptions.APIException):
             logger.info(f"BAD REQUEST: {detail}")
 
 
+class TimedSerializerMixin:
+    """
+    Учитывает время сборки данных ответа в метриках запроса
+    """
+
+    @property
+    def data(self):
+        with serializer_timing():
+            return super().data
+
+
+class TimedListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    pass
+
+
 class AnswerChoiceSerializer(serializers.ModelSerializer):
     class Meta:
         model = AnswerChoice
         fields = ('body', 'id')
 
 
-class QuestionSerializer(serializers.ModelSerializer):
+class QuestionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     choices = serializers.ListField(required=False)
 
     class Meta:
         model = Question
         fields = ('body', 'question_type', 'choices')
+        list_serializer_class = TimedListSerializer
 
 
 class QuestionSerializerCreate(serializers.ModelSerializer):
@@ -68,31 +84,53 @@ class QuestionSerializerCreate(serializers.ModelSerializer):
 
 
 class QuestionSerializerUpdate(serializers.ModelSerializer):
-    choices = serializers.ListField(required=False)
+    choices = serializers.ListField(child=serializers.CharField(max_length=500), required=False)
 
     class Meta:
         model = Question
         fields = ('id', 'body', 'question_type', 'choices')
 
     def update(self, instance, data):
-        instance.name = data.get('name', instance.name)
+        """
+        Изменяет вопрос и его варианты ответа одной транзакцией
+        Варианты сравниваются по тексту: пропавшие помечаются удаленными одним bulk_update
+        (вместе с возвращаемыми ранее удаленными), новые добавляются одним bulk_create
+        """
         instance.body = data.get('body', instance.body)
         instance.question_type = data.get('question_type', instance.question_type)
-        choices = instance.answer_choices.all()
-        new_choices = data['choices']
-        for choice in choices:
-            if choice.body not in data['choices']:
+        with transaction.atomic():
+            instance.save(update_fields=['body', 'question_type', 'updated'])
+            if 'choices' in data:
+                self.update_choices(instance, data['choices'])
+        return instance
+
+    @staticmethod
+    def update_choices(question, bodies):
+        wanted = dict.fromkeys(bodies)
+        kept = set()
+        deleted = {}
+        changed = []
+        for choice in question.answer_choices.order_by('id'):
+            if choice.is_deleted:
+                deleted.setdefault(choice.body, choice)
+            elif choice.body in wanted and choice.body not in kept:
+                kept.add(choice.body)
+            else:
                 choice.is_deleted = True
-                choice.save()
+                changed.append(choice)
+        created = []
+        for body in wanted:
+            if body in kept:
+                continue
+            if body in deleted:
+                deleted[body].is_deleted = False
+                changed.append(deleted[body])
             else:
-                new_choices.remove(choice.body)
-        for item in new_choices:
-            AnswerChoice.objects.create(
-                question=instance,
-                body=item
-            )
-
-        return instance
+                created.append(AnswerChoice(question=question, body=body))
+        if changed:
+            AnswerChoice.objects.bulk_update(changed, ['is_deleted'])
+        if created:
+            AnswerChoice.objects.bulk_create(created)
 
 
 class QuestionSerializerList(serializers.ModelSerializer):
@@ -103,12 +141,13 @@ class QuestionSerializerList(serializers.ModelSerializer):
         fields = ('id', 'body', 'question_type', 'choices')
 
 
-class SurveySerializer(serializers.ModelSerializer):
+class SurveySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     questions = QuestionSerializerList(many=True)
 
     class Meta:
         model = Survey
         fields = ('id', 'name', 'start_date', 'end_date', 'questions')
+        list_serializer_class = TimedListSerializer
 
 
 class SurveySerializerCreate(serializers.ModelSerializer):
@@ -116,7 +155,7 @@ class SurveySerializerCreate(serializers.ModelSerializer):
 
     class Meta:
         model = Survey
-        fields = ('name', 'start_date', 'end_date', 'questions')
+        fields = ('name', 'description', 'start_date', 'end_date', 'questions')
 
     def validate(self, data):
         for item in data['questions']:
@@ -126,24 +165,12 @@ class SurveySerializerCreate(serializers.ModelSerializer):
         return data
 
     def create(self, data):
-        survey = Survey.objects.create(
-            name=data['name'],
-            start_date=data['start_date'],
-            end_date=data['end_date']
-        )
-        for item in data['questions']:
-            question = Question.objects.create(
-                survey=survey,
-                question_type=item['question_type'],
-                body=item['body']
-            )
-            for item_choice in item.get('choices', []):
-                AnswerChoice.objects.create(
-                    question=question,
-                    body=item_choice
-                )
+        return create_surveys([data])[0]
+
 
-        return survey
+class SurveyBulkSerializer(serializers.Serializer):
+    created = serializers.IntegerField()
+    ids = serializers.ListField(child=serializers.IntegerField())
 
 
 class SurveySerializerUpdate(serializers.ModelSerializer):
@@ -177,34 +204,94 @@ class TakeSurveySerializer(serializers.Serializer):
     user_id = serializers.IntegerField()
     answers = AnswerSerializer(many=True)
 
+    def validate(self, data):
+        """
+        Проверяет все вопросы и варианты ответов одним запросом к БД
+        Асинхронный view передает уже прочитанные вопросы в context['questions']
+        """
+        questions = self.context.get('questions')
+        if questions is None:
+            questions = survey_questions([self.instance.id])[self.instance.id]
+        error = answers_error(data['answers'], questions)
+        if error:
+            raise ValidationError(detail=error)
+        return data
+
     def update(self, instance, data):
-        user, created = User.objects.get_or_create(
-            external_id=data['user_id']
-        )
-        for item in data['answers']:
-            Answer.objects.create(
-                user_id=user.id,
-                question_id=item['question_id'],
-                choice_id=item.get('choice_id'),
-                body=item.get('body')
-            )
+        write_submissions([dict(data, survey_id=instance.id)])
         return instance
 
 
-class AnswerSerializerResults(serializers.Serializer):
+class SyncSubmissionSerializer(serializers.Serializer):
     survey_id = serializers.IntegerField()
+    user_id = serializers.IntegerField()
+    answers = AnswerSerializer(many=True)
+    key = serializers.CharField(required=False)
+
+
+class SyncResultSerializer(serializers.Serializer):
+    index = serializers.IntegerField()
+    status = serializers.CharField()
+    errors = serializers.JSONField(required=False)
+
+
+class SyncResponseSerializer(serializers.Serializer):
+    results = SyncResultSerializer(many=True)
+
+
+class AnswerSerializerItem(serializers.Serializer):
     question_id = serializers.IntegerField()
     question = serializers.CharField(max_length=1500)
     answer = serializers.CharField(max_length=1500)
 
 
+class AnswerSerializerResults(serializers.Serializer):
+    survey_id = serializers.IntegerField()
+    answers = AnswerSerializerItem(many=True)
+
+
 class AnswerSerializerList(serializers.Serializer):
     user_id = serializers.IntegerField()
+    next = serializers.URLField(allow_null=True)
+    previous = serializers.URLField(allow_null=True)
     results = AnswerSerializerResults(many=True)
 
 
+class ChoiceResultSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    body = serializers.CharField()
+    answers = serializers.IntegerField()
+
+
+class QuestionResultSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    body = serializers.CharField()
+    question_type = serializers.IntegerField()
+    answers = serializers.IntegerField()
+    choices = ChoiceResultSerializer(many=True)
+
+
+class SurveyResultSerializer(serializers.Serializer):
+    survey_id = serializers.IntegerField()
+    respondents = serializers.IntegerField()
+    completions = serializers.IntegerField()
+    questions = QuestionResultSerializer(many=True)
+
+
 class AnswerSerializerRequest(serializers.Serializer):
     user_id = serializers.IntegerField()
+    survey_id = serializers.IntegerField(required=False)
+    since = serializers.DateTimeField(required=False)
+    stream = serializers.ChoiceField(choices=(STREAM_JSON, STREAM_NDJSON), required=False)
+    fields = serializers.CharField(required=False)
+    group_by = serializers.ChoiceField(choices=(GROUP_BY_SURVEY, GROUP_BY_NONE), default=GROUP_BY_SURVEY)
+
+    def validate_fields(self, value):
+        fields = tuple(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+        unknown = set(fields) - set(ANSWER_OUTPUT)
+        if unknown or not fields:
+            raise ValidationError(f'Допустимые поля: {", ".join(ANSWER_OUTPUT)}')
+        return fields
 
 
 
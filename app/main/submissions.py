@@ -0,0 +1,312 @@
+"""
+Компактное хранение ответов: одна строка Submission на прохождение опроса
+
+Выбранные варианты ответа упакованы в массив 32-битных id (little-endian),
+ответы без варианта и варианты с текстом лежат в SubmissionText. Режим хранения задает
+settings.ANSWER_STORAGE, чтение (get_answers, результаты, выгрузка)
+идет из того же хранения, что и запись. При смене ANSWER_STORAGE уже
+записанные ответы переносит команда convert_answers.
+"""
+import struct
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from .importing import bulk_create_with_ids
+from .models import Answer, AnswerChoice, Question, Submission, SubmissionText
+
+STORAGE_ROWS = 'rows'
+STORAGE_COMPACT = 'compact'
+
+CHOICE_FORMAT = '<{}I'
+CHOICE_SIZE = struct.calcsize('<I')
+
+
+def compact_storage():
+    return settings.ANSWER_STORAGE == STORAGE_COMPACT
+
+
+def pack_choices(choice_ids):
+    choice_ids = sorted(choice_ids)
+    return struct.pack(CHOICE_FORMAT.format(len(choice_ids)), *choice_ids)
+
+
+def unpack_choices(data):
+    data = bytes(data)
+    return struct.unpack(CHOICE_FORMAT.format(len(data) // CHOICE_SIZE), data)
+
+
+def write_compact(submissions, users):
+    """
+    Пишет прохождения двумя пакетными вставками: Submission и SubmissionText
+    Ответы одного прохождения на разные опросы разделяются по опросам,
+    вариант с текстом хранится только в SubmissionText, чтобы ответ не учитывался дважды
+    :param list submissions: прохождения в формате ingestion.write_submissions
+    :param dict users: external_id -> id пользователя
+    :return: записанные Submission по порядку прохождений и опросов
+    """
+    question_surveys = dict(Question.objects.filter(
+        id__in={answer['question_id'] for item in submissions for answer in item['answers']}
+    ).values_list('id', 'survey_id'))
+    rows = []
+    texts = []
+    for item in submissions:
+        choices = defaultdict(list)
+        survey_texts = defaultdict(list)
+        for answer in item['answers']:
+            survey_id = question_surveys[answer['question_id']]
+            if answer.get('choice_id') is not None and not answer.get('body'):
+                choices[survey_id].append(answer['choice_id'])
+            else:
+                survey_texts[survey_id].append(answer)
+        for survey_id in choices.keys() | survey_texts.keys():
+            rows.append(Submission(
+                user_id=users[item['user_id']],
+                survey_id=survey_id,
+                choices=pack_choices(choices[survey_id])
+            ))
+            texts.append(survey_texts[survey_id])
+    rows = bulk_create_with_ids(Submission, rows)
+    SubmissionText.objects.bulk_create([
+        SubmissionText(
+            submission_id=row.id,
+            question_id=answer['question_id'],
+            choice_id=answer.get('choice_id'),
+            body=answer.get('body')
+        )
+        for row, answers in zip(rows, texts) for answer in answers
+    ])
+    return rows
+
+
+def choice_questions(choice_ids):
+    """
+    :return: choice_id -> question_id
+    """
+    return dict(AnswerChoice.objects.filter(id__in=set(choice_ids)).values_list('id', 'question_id'))
+
+
+def answered_questions(user_ids, survey_ids):
+    """
+    Вопросы, на которые пользователи уже ответили
+    :return: (user_id, survey_id) -> множество question_id
+    """
+    answered = defaultdict(set)
+    unpacked = [
+        (user_id, survey_id, unpack_choices(choices))
+        for user_id, survey_id, choices in Submission.objects.filter(
+            user_id__in=user_ids,
+            survey_id__in=survey_ids
+        ).values_list('user_id', 'survey_id', 'choices')
+    ]
+    questions = choice_questions(choice_id for _, _, choice_ids in unpacked for choice_id in choice_ids)
+    for user_id, survey_id, choice_ids in unpacked:
+        answered[user_id, survey_id].update(questions[choice_id] for choice_id in choice_ids)
+    for user_id, survey_id, question_id in SubmissionText.objects.filter(
+            submission__user_id__in=user_ids,
+            submission__survey_id__in=survey_ids
+    ).values_list('submission__user_id', 'submission__survey_id', 'question_id'):
+        answered[user_id, survey_id].add(question_id)
+    return answered
+
+
+def expand(rows):
+    """
+    Раскрывает прохождения в ответы, по три запроса на порцию
+    :param list rows: кортежи (id, survey_id, choices, created, user) - user передается как есть
+    :return: список словарей с ключами answer_id (id прохождения), survey_id, user,
+        question_id, question, choice_id, choice, body, created
+    """
+    unpacked = [(row, unpack_choices(row[2])) for row in rows]
+    return expanded_items(unpacked, choice_values(unpacked), text_values(rows))
+
+
+async def aexpand(rows):
+    """
+    expand для async view: те же запросы через асинхронный ORM
+    """
+    unpacked = [(row, unpack_choices(row[2])) for row in rows]
+    return expanded_items(
+        unpacked,
+        [row async for row in choice_values(unpacked)],
+        [row async for row in text_values(rows)]
+    )
+
+
+def choice_values(unpacked):
+    return AnswerChoice.objects.filter(
+        id__in={choice_id for _, choice_ids in unpacked for choice_id in choice_ids}
+    ).values_list('id', 'question_id', 'question__body', 'body')
+
+
+def text_values(rows):
+    return SubmissionText.objects.filter(
+        submission_id__in=[row[0] for row in rows]
+    ).values_list('submission_id', 'question_id', 'question__body', 'choice_id', 'choice__body', 'body')
+
+
+def expanded_items(unpacked, choice_rows, text_rows):
+    choices = {
+        choice_id: (question_id, question, body)
+        for choice_id, question_id, question, body in choice_rows
+    }
+    texts = defaultdict(list)
+    for submission_id, question_id, question, choice_id, choice, body in text_rows:
+        texts[submission_id].append((question_id, question, choice_id, choice, body))
+
+    items = []
+    for (submission_id, survey_id, _, created, user), choice_ids in unpacked:
+        answers = texts[submission_id] + [
+            choices[choice_id][:2] + (choice_id, choices[choice_id][2], None) for choice_id in choice_ids
+        ]
+        answers.sort(key=lambda answer: (answer[0], answer[2] or 0))
+        for question_id, question, choice_id, choice, body in answers:
+            items.append({
+                'answer_id': submission_id,
+                'survey_id': survey_id,
+                'user': user,
+                'question_id': question_id,
+                'question': question,
+                'choice_id': choice_id,
+                'choice': choice,
+                'body': body,
+                'created': created,
+            })
+    return items
+
+
+def iter_expanded(rows, chunk_size):
+    """
+    Раскрывает поток прохождений порциями по chunk_size
+    :param rows: итератор кортежей в формате expand
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield from expand(chunk)
+            chunk = []
+    if chunk:
+        yield from expand(chunk)
+
+
+def submission_counts(survey_ids):
+    """
+    Данные для пересчета результатов из компактного хранения
+    :return: (survey_id -> {user_id: множество question_id}, question_id -> число ответов,
+        choice_id -> число ответов)
+    """
+    question_answers = defaultdict(int)
+    choice_answers = defaultdict(int)
+    answered = defaultdict(lambda: defaultdict(set))
+    questions = dict(AnswerChoice.objects.filter(
+        question__survey_id__in=survey_ids
+    ).values_list('id', 'question_id'))
+    for user_id, survey_id, choices in Submission.objects.filter(
+            survey_id__in=survey_ids
+    ).values_list('user_id', 'survey_id', 'choices').iterator():
+        for choice_id in unpack_choices(choices):
+            choice_answers[choice_id] += 1
+            question_answers[questions[choice_id]] += 1
+            answered[survey_id][user_id].add(questions[choice_id])
+    for user_id, survey_id, question_id, choice_id in SubmissionText.objects.filter(
+            submission__survey_id__in=survey_ids
+    ).values_list('submission__user_id', 'submission__survey_id', 'question_id', 'choice_id').iterator():
+        question_answers[question_id] += 1
+        if choice_id is not None:
+            choice_answers[choice_id] += 1
+        answered[survey_id][user_id].add(question_id)
+    return answered, question_answers, choice_answers
+
+
+
+def answers_to_compact(chunk_size):
+    """
+    Переносит ответы из Answer в компактное хранение порциями, каждая в своей транзакции
+    Подряд идущие ответы пользователя на один опрос (прохождение пишется одной вставкой)
+    становятся одним Submission с датой первого ответа. Счетчики результатов не меняются
+    :return: число перенесенных ответов
+    """
+    moved = 0
+    last_id = 0
+    while True:
+        limit = chunk_size
+        while True:
+            rows = list(Answer.objects.filter(id__gt=last_id).order_by('id').values_list(
+                'id', 'user_id', 'survey_id', 'question_id', 'choice_id', 'body', 'created'
+            )[:limit])
+            groups = answer_groups(rows)
+            # прохождение длиннее порции читается целиком
+            if len(rows) < limit or len(groups) > 1:
+                break
+            limit *= 2
+        if not rows:
+            return moved
+        if len(rows) == limit:
+            # последнее прохождение может продолжиться в следующей порции
+            groups.pop()
+        with transaction.atomic():
+            created = write_compact([
+                {
+                    'user_id': user_id,
+                    'answers': [
+                        {'question_id': question_id, 'choice_id': choice_id, 'body': body}
+                        for _, _, _, question_id, choice_id, body, _ in answers
+                    ]
+                } for (user_id, _), answers in groups
+            ], {user_id: user_id for (user_id, _), _ in groups})
+            for row, (_, answers) in zip(created, groups):
+                row.created = answers[0][6]
+            Submission.objects.bulk_update(created, ['created'])
+            answer_ids = [answer[0] for _, answers in groups for answer in answers]
+            Answer.objects.filter(id__in=answer_ids).delete()
+        moved += len(answer_ids)
+        last_id = answer_ids[-1]
+
+
+def answer_groups(rows):
+    """
+    Подряд идущие строки с одинаковыми (user_id, survey_id)
+    :return: список пар ((user_id, survey_id), строки)
+    """
+    groups = []
+    for row in rows:
+        if groups and groups[-1][0] == row[1:3]:
+            groups[-1][1].append(row)
+        else:
+            groups.append((row[1:3], [row]))
+    return groups
+
+
+def compact_to_answers(chunk_size):
+    """
+    Обратный перенос: прохождения из компактного хранения раскрываются в строки Answer
+    с датой прохождения, прохождения удаляются
+    :return: число перенесенных прохождений
+    """
+    moved = 0
+    last_id = 0
+    while True:
+        rows = list(Submission.objects.filter(id__gt=last_id).order_by('id').values_list(
+            'id', 'survey_id', 'choices', 'created', 'user_id'
+        )[:chunk_size])
+        if not rows:
+            return moved
+        with transaction.atomic():
+            items = expand(rows)
+            answers = bulk_create_with_ids(Answer, [
+                Answer(
+                    user_id=item['user'],
+                    question_id=item['question_id'],
+                    survey_id=item['survey_id'],
+                    choice_id=item['choice_id'],
+                    body=item['body']
+                ) for item in items
+            ])
+            for answer, item in zip(answers, items):
+                answer.created = item['created']
+            Answer.objects.bulk_update(answers, ['created'])
+            Submission.objects.filter(id__in=[row[0] for row in rows]).delete()
+        moved += len(rows)
+        last_id = rows[-1][0]
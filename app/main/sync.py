@@ -0,0 +1,125 @@
+"""
+Пакетная выгрузка прохождений с полевых клиентов (/api/surveys/sync)
+
+Тело запроса - JSON-массив или NDJSON прохождений {survey_id, user_id, answers, key},
+читается потоком пачками по SYNC_BATCH_SIZE. Вопросы всех опросов пачки читаются
+одним запросом, респонденты находятся одним upsert, ответы пишутся пакетными
+вставками write_submissions. Для каждого прохождения возвращается статус,
+поэтому при частичной ошибке клиент повторяет только отклоненные прохождения.
+"""
+from django.conf import settings
+from django.utils import timezone
+
+from .cache import open_surveys_queryset
+from .ingestion import answers_error, get_answer_queue, idempotency_key, survey_questions, write_submissions
+
+STATUS_CREATED = 'created'
+STATUS_QUEUED = 'queued'
+STATUS_DUPLICATE = 'duplicate'
+STATUS_INVALID = 'invalid'
+STATUS_CLOSED = 'closed'
+STATUS_FAILED = 'failed'
+
+
+def result(index, status, errors=None):
+    item = {'index': index, 'status': status}
+    if errors is not None:
+        item['errors'] = errors
+    return item
+
+
+def sync_submissions(items, batch_size):
+    """
+    :param items: итератор разобранных прохождений, например importing.read_json
+    :return: статусы прохождений в порядке items; если тело оборвано или
+        некорректно, последним идет статус invalid для первого неразобранного прохождения
+    """
+    results = []
+    batch = []
+    error = None
+    try:
+        for index, item in enumerate(items):
+            batch.append((index, item))
+            if len(batch) >= batch_size:
+                results.extend(sync_batch(batch))
+                batch = []
+    except ValueError as e:
+        error = str(e)
+    if batch:
+        results.extend(sync_batch(batch))
+    if error is not None:
+        results.append(result(len(results), STATUS_INVALID, [error]))
+    return results
+
+
+def sync_batch(batch):
+    """
+    Проверяет и записывает одну пачку
+    :param list batch: пары (номер прохождения в запросе, прохождение)
+    """
+    from .serializers import SyncSubmissionSerializer
+
+    results = {}
+    parsed = []
+    for index, item in batch:
+        serializer = SyncSubmissionSerializer(data=item)
+        if not serializer.is_valid():
+            results[index] = result(index, STATUS_INVALID, serializer.errors)
+        else:
+            parsed.append((index, serializer.validated_data))
+
+    open_ids = set(open_surveys_queryset(timezone.localdate()).filter(
+        id__in={data['survey_id'] for _, data in parsed}
+    ).values_list('id', flat=True))
+    valid = []
+    for index, data in parsed:
+        if data['survey_id'] in open_ids:
+            valid.append((index, data))
+        else:
+            results[index] = result(index, STATUS_CLOSED)
+
+    questions = survey_questions({data['survey_id'] for _, data in valid})
+    submissions = []
+    for index, data in valid:
+        error = answers_error(data['answers'], questions[data['survey_id']])
+        if error:
+            results[index] = result(index, STATUS_INVALID, [error])
+        else:
+            submissions.append((index, {
+                'survey_id': data['survey_id'],
+                'user_id': data['user_id'],
+                'answers': data['answers'],
+                'key': idempotency_key(data.get('key')),
+            }))
+    if submissions:
+        results.update(write_batch(submissions))
+    return [results[index] for index, _ in batch]
+
+
+def write_batch(submissions):
+    """
+    Пишет проверенные прохождения одной транзакцией, при ошибке - по одному
+    :return: номер прохождения -> статус
+    """
+    if settings.ANSWER_QUEUE_ENABLED:
+        queue = get_answer_queue()
+        for index, item in submissions:
+            queue.put({field: item[field] for field in ('survey_id', 'user_id', 'answers')}, key=item['key'])
+        return {index: result(index, STATUS_QUEUED) for index, _ in submissions}
+    try:
+        written = write_submissions([item for _, item in submissions])
+    except Exception:
+        results = {}
+        for index, item in submissions:
+            try:
+                written = write_submissions([item])
+            except Exception as e:
+                results[index] = result(index, STATUS_FAILED, [str(e)])
+            else:
+                results[index] = result(index, STATUS_CREATED if written else STATUS_DUPLICATE)
+        return results
+    written = {id(item) for item in written}
+    return {
+        index: result(index, STATUS_CREATED if id(item) in written else STATUS_DUPLICATE)
+        for index, item in submissions
+    }
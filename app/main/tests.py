@@ -1,13 +1,56 @@
+import csv
+import io
+import json
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from functools import partial
+from unittest import mock
+
 from django.conf import settings as django_settings
-from django.test import TestCase, override_settings
+from django.contrib.auth.signals import user_login_failed
+from django.core.management import call_command, CommandError
+from django.db import IntegrityError, OperationalError, connection, transaction
+from asgiref.sync import async_to_sync
+from django.test import AsyncClient, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
 
+from main.advisor import CANONICAL_QUERIES, advise, sequential_scans
+from main.authentication import revoked_users
+from main.benchmarks import compare
+from main.benchmarks.data import generate
+from main.cache import open_surveys, survey_cache
+from main.export import EXPORT_COLUMNS, available_formats
+from main.ingestion import find_user_id, resolve_users, respondent_ids
+from main.logqueue import EndpointSampler, QueueFileHandler
+from main.metrics import RequestStats, current_request, registry
+from main.middleware import PrimaryPinMiddleware
+from main.passwords import password_verifier
+from main.renderers import render_json
+from main.partitions import DEFAULT_PARTITION, add_months, convert_to_partitioned, create_partitions, \
+    month_start, partition_month, partition_name
+from main.pool import ConnectionPool, PoolTimeout
+from main.routers import ReplicaRouter, pinned_to_primary, replica_health
+from main.serializers import SurveySerializer
+from main.trees import SURVEY_COLUMNS, survey_trees
 from main.models import *
 from main.management.commands.start_server import start_server
 
 
 class TestDataMixin(TestCase):
     def setUp(self):
+        survey_cache.local.clear()
+        open_surveys.invalidate()
+        revoked_users.reset()
+        respondent_ids.clear()
         start_server()
         self.admin = APIClient()
         self.user = APIClient()
@@ -16,7 +59,7 @@ class TestDataMixin(TestCase):
             'password': django_settings.ADMIN_PASSWORD
         }, format='json')
         self.assertEqual(response.status_code, 200)
-        access_token = response.data['access_token']
+        access_token = self.access_token = response.data['access_token']
         self.admin.credentials(HTTP_AUTHORIZATION='Bearer %s' % access_token)
 
     def test_admin(self):
@@ -25,7 +68,7 @@ class TestDataMixin(TestCase):
         response = self.admin.post('/api/surveys', {
             'name': 'Тестовый опрос',
             'start_date': '2021-12-01',
-            'end_date': '2022-01-01',
+            'end_date': '2099-01-01',
             'questions': [
                 {
                     'body': 'Укажите ваш пол.',
@@ -44,7 +87,7 @@ class TestDataMixin(TestCase):
         self.assertEqual(len(question.answer_choices.all()), 2)
         response = self.admin.get('/api/surveys')
         self.assertEqual(response.status_code, 200)
-        survey_id = response.data[0]['id']
+        survey_id = response.data['results'][0]['id']
         survey = Survey.objects.get(id=survey_id)
 
         self.assertEqual(survey.name, 'Тестовый опрос')
@@ -54,12 +97,12 @@ class TestDataMixin(TestCase):
         self.assertEqual(response.status_code, 200)
         survey.refresh_from_db()
         self.assertEqual(survey.name, 'Тестовый опрос2')
-        response = self.admin.get('/api/questions?survey_id=1')
-        self.assertEqual(len(response.data), 2)
+        response = self.admin.get(f'/api/questions?survey_id={survey_id}')
+        self.assertEqual(len(response.data['results']), 2)
         response = self.admin.delete(f'/api/questions/{question.id}')
         self.assertEqual(response.status_code, 204)
-        response = self.admin.get('/api/questions?survey_id=1')
-        self.assertEqual(len(response.data), 1)
+        response = self.admin.get(f'/api/questions?survey_id={survey_id}')
+        self.assertEqual(len(response.data['results']), 1)
         question.refresh_from_db()
         self.assertEqual(question.is_deleted, True)
 
@@ -67,7 +110,7 @@ class TestDataMixin(TestCase):
         response = self.admin.post('/api/surveys', {
             'name': 'Тестовый опрос3',
             'start_date': '2021-11-01',
-            'end_date': '2022-01-01',
+            'end_date': '2099-01-01',
             'questions': [
                 {
                     'body': 'Укажите ваш пол.',
@@ -82,7 +125,7 @@ class TestDataMixin(TestCase):
         }, format='json')
         response = self.admin.get('/api/surveys')
         self.assertEqual(response.status_code, 200)
-        survey_id = response.data[0]['id']
+        survey_id = response.data['results'][0]['id']
         survey = Survey.objects.get(id=survey_id)
         first_question = Question.objects.filter(body='Укажите ваш пол.').first()
         second_question = Question.objects.filter(body='Как вас зовут?').first()
@@ -100,4 +143,854 @@ class TestDataMixin(TestCase):
             ],
         }, format='json')
         self.assertEqual(response.status_code, 201)
+        response = self.user.get('/api/surveys/answers?user_id=123&page_size=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['user_id'], 123)
+        self.assertEqual(response.data['results'][0]['survey_id'], survey_id)
+        self.assertEqual(response.data['results'][0]['answers'][0]['answer'], 'Петя Иванов')
+        response = self.user.get(response.data['next'])
+        self.assertEqual(response.data['results'][0]['answers'][0]['question_id'], first_question.id)
+        self.assertIsNone(response.data['next'])
+
+    def test_take_validation(self):
+        response = self.admin.post('/api/surveys', {
+            'name': 'Опрос для проверки ответов',
+            'start_date': '2021-11-01',
+            'end_date': '2099-01-01',
+            'questions': [
+                {
+                    'body': 'Любимый цвет?',
+                    'question_type': QuestionType.CHOICE,
+                    'choices': ['Красный', 'Синий']
+                }
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        survey_id = response.data['id']
+        question = Question.objects.get(survey_id=survey_id)
+        choice = question.answer_choices.first()
+        response = self.user.post(f'/api/surveys/{survey_id}/take', {
+            'user_id': 321,
+            'answers': [{'question_id': question.id + 1000}],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.user.post(f'/api/surveys/{survey_id}/take', {
+            'user_id': 321,
+            'answers': [{'question_id': question.id, 'choice_id': choice.id + 1000}],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Answer.objects.count(), 0)
+        response = self.user.post(f'/api/surveys/{survey_id}/take', {
+            'user_id': 321,
+            'answers': [{'question_id': question.id, 'choice_id': choice.id}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Answer.objects.filter(user__external_id=321, choice=choice).count(), 1)
+
+    def test_take_queue(self):
+        response = self.admin.post('/api/surveys', {
+            'name': 'Опрос через очередь',
+            'start_date': '2021-11-01',
+            'end_date': '2099-01-01',
+            'questions': [{'body': 'Как вас зовут?', 'question_type': QuestionType.TEXT}],
+        }, format='json')
+        survey_id = response.data['id']
+        question = Question.objects.get(survey_id=survey_id)
+        payload = {'user_id': 555, 'answers': [{'question_id': question.id, 'body': 'Вася'}]}
+        with tempfile.TemporaryDirectory() as tmp, override_settings(
+                ANSWER_QUEUE_ENABLED=True,
+                ANSWER_QUEUE_PATH=os.path.join(tmp, 'answers.sqlite3')):
+            for _ in range(2):
+                response = self.user.post(
+                    f'/api/surveys/{survey_id}/take', payload, format='json', HTTP_IDEMPOTENCY_KEY='abc'
+                )
+                self.assertEqual(response.status_code, 202)
+            self.assertEqual(Answer.objects.count(), 0)
+            call_command('flush_answers', '--once', stdout=io.StringIO())
+            self.assertEqual(Answer.objects.filter(user__external_id=555).count(), 1)
+            response = self.user.post(
+                f'/api/surveys/{survey_id}/take', payload, format='json', HTTP_IDEMPOTENCY_KEY='abc'
+            )
+            call_command('flush_answers', '--once', stdout=io.StringIO())
+            self.assertEqual(Answer.objects.filter(user__external_id=555).count(), 1)
+
+    def test_survey_cache(self):
+        response = self.admin.post('/api/surveys', {
+            'name': 'Кэшируемый опрос',
+            'start_date': '2021-11-01',
+            'end_date': '2099-01-01',
+            'questions': [
+                {'body': 'Первый вопрос', 'question_type': QuestionType.TEXT},
+                {'body': 'Второй вопрос', 'question_type': QuestionType.TEXT}
+            ],
+        }, format='json')
+        survey_id = response.data['id']
+        response = self.admin.get(f'/api/surveys/{survey_id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['questions']), 2)
+        etag = response['ETag']
+        with CaptureQueriesContext(connection) as context:
+            response = self.admin.get(f'/api/surveys/{survey_id}')
+            self.assertEqual(response.status_code, 200)
+            response = self.admin.get(f'/api/surveys/{survey_id}', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+        self.assertFalse([q for q in context.captured_queries if 'main_survey' in q['sql']])
+        question = Question.objects.filter(survey_id=survey_id).first()
+        response = self.admin.delete(f'/api/questions/{question.id}')
+        self.assertEqual(response.status_code, 204)
+        response = self.admin.get(f'/api/surveys/{survey_id}', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        response = self.admin.get('/api/surveys/100500')
+        self.assertEqual(response.status_code, 404)
+
+        Survey.objects.filter(id=survey_id).update(name='Изменен другим процессом')
+        self.assertEqual(self.admin.get(f'/api/surveys/{survey_id}').json()['name'], 'Кэшируемый опрос')
+        expired = time.monotonic() + django_settings.SURVEY_CACHE_TTL + 1
+        with mock.patch('main.cache.time.monotonic', return_value=expired):
+            response = self.admin.get(f'/api/surveys/{survey_id}')
+        self.assertEqual(response.json()['name'], 'Изменен другим процессом')
+
+    def test_pagination(self):
+        for number in range(5):
+            Survey.objects.create(name=f'Опрос {number}', start_date='2021-11-01', end_date='2099-01-01')
+        ids = []
+        url = '/api/surveys?page_size=2'
+        while url:
+            response = self.admin.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 2)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(ids, list(Survey.objects.order_by('-created', '-id').values_list('id', flat=True)))
+        response = self.admin.get(response.data['previous'])
+        self.assertEqual([item['id'] for item in response.data['results']], ids[2:4])
+        response = self.admin.get('/api/surveys?page_size=2&ordering=created')
+        self.assertEqual([item['id'] for item in response.data['results']], ids[::-1][:2])
+        response = self.admin.get('/api/surveys?cursor=bad')
+        self.assertEqual(response.status_code, 404)
+
+    def test_answers_stream(self):
+        survey = Survey.objects.create(name='Потоковый опрос', start_date='2021-11-01', end_date='2099-01-01')
+        other = Survey.objects.create(name='Другой опрос', start_date='2021-11-01', end_date='2099-01-01')
+        question = Question.objects.create(survey=survey, question_type=QuestionType.TEXT, body='Город?')
+        other_question = Question.objects.create(survey=other, question_type=QuestionType.TEXT, body='Имя?')
+        for survey_id, question_id in ((survey.id, question.id), (other.id, other_question.id)):
+            response = self.user.post(f'/api/surveys/{survey_id}/take', {
+                'user_id': 777,
+                'answers': [{'question_id': question_id, 'body': f'Ответ {n}'} for n in range(5)],
+            }, format='json')
+            self.assertEqual(response.status_code, 201)
+
+        response = self.user.get('/api/surveys/answers?user_id=777&stream=json')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data['user_id'], 777)
+        self.assertEqual([len(group['answers']) for group in data['results']], [5, 5])
+
+        response = self.user.get(f'/api/surveys/answers?user_id=777&stream=ndjson&group_by=none&survey_id={survey.id}')
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(json.loads(lines[0])['survey_id'], survey.id)
+
+        response = self.user.get('/api/surveys/answers?user_id=777&stream=json&since=2100-01-01T00:00:00')
+        self.assertEqual(json.loads(b''.join(response.streaming_content))['results'], [])
+        response = self.user.get('/api/surveys/answers?user_id=777&stream=xml')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.user.get('/api/surveys/answers?user_id=777&group_by=none&fields=answer,question_id')
+        self.assertEqual(set(response.json()['results'][0]), {'answer', 'question_id'})
+        response = self.user.get('/api/surveys/answers?user_id=777&fields=user')
+        self.assertEqual(response.status_code, 400)
+        response = self.user.get('/api/surveys/answers?user_id=777&group_by=survey&fields=answer')
+        groups = response.json()['results']
+        self.assertEqual({group['survey_id'] for group in groups}, {survey.id, other.id})
+        self.assertEqual([len(group['answers']) for group in groups], [5, 5])
+        self.assertEqual(set(groups[0]['answers'][0]), {'answer'})
+        response = self.user.get('/api/surveys/answers?user_id=777&group_by=survey&stream=ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(sorted(line['survey_id'] for line in lines), sorted([survey.id, other.id]))
+        self.assertEqual(set(lines[0]['answers'][0]), {'question_id', 'question', 'answer'})
+
+    def test_results(self):
+        survey = Survey.objects.create(name='Опрос с результатами', start_date='2021-11-01', end_date='2099-01-01')
+        color = Question.objects.create(survey=survey, question_type=QuestionType.MULTICHOICE, body='Цвета?')
+        name = Question.objects.create(survey=survey, question_type=QuestionType.TEXT, body='Имя?')
+        red = AnswerChoice.objects.create(question=color, body='Красный')
+        blue = AnswerChoice.objects.create(question=color, body='Синий')
+        submissions = (
+            (1, [{'question_id': color.id, 'choice_id': red.id}, {'question_id': color.id, 'choice_id': blue.id}]),
+            (2, [{'question_id': color.id, 'choice_id': red.id}]),
+            (2, [{'question_id': name.id, 'body': 'Маша'}]),
+        )
+        for user_id, answers in submissions:
+            response = self.user.post(f'/api/surveys/{survey.id}/take', {
+                'user_id': user_id, 'answers': answers
+            }, format='json')
+            self.assertEqual(response.status_code, 201)
+
+        response = self.admin.get(f'/api/surveys/{survey.id}/results')
+        self.assertEqual(response.status_code, 200)
+        expected = response.json()
+        self.assertEqual(expected['respondents'], 2)
+        self.assertEqual(expected['completions'], 1)
+        questions = {question['id']: question for question in expected['questions']}
+        self.assertEqual(questions[color.id]['answers'], 3)
+        self.assertEqual(questions[name.id]['answers'], 1)
+        self.assertEqual(
+            {choice['id']: choice['answers'] for choice in questions[color.id]['choices']},
+            {red.id: 2, blue.id: 1}
+        )
+
+        SurveyResult.objects.all().delete()
+        ChoiceResult.objects.all().delete()
+        call_command('rebuild_results', '--chunk-size', '1', stdout=io.StringIO())
+        response = self.admin.get(f'/api/surveys/{survey.id}/results')
+        self.assertEqual(response.json(), expected)
+        response = self.user.get(f'/api/surveys/{survey.id}/results')
+        self.assertEqual(response.status_code, 401)
+
+    def test_export(self):
+        survey = Survey.objects.create(name='Выгрузка', start_date='2021-11-01', end_date='2099-01-01')
+        question = Question.objects.create(survey=survey, question_type=QuestionType.CHOICE, body='Да или нет?')
+        choice = AnswerChoice.objects.create(question=question, body='Да')
+        for user_id in range(3):
+            self.user.post(f'/api/surveys/{survey.id}/take', {
+                'user_id': user_id, 'answers': [{'question_id': question.id, 'choice_id': choice.id}]
+            }, format='json')
+        response = self.admin.get(f'/api/surveys/{survey.id}/export')
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode('utf-8'))))
+        self.assertEqual(rows[0], list(EXPORT_COLUMNS))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1][4:7], ['Да или нет?', str(choice.id), 'Да'])
+        response = self.user.get(f'/api/surveys/{survey.id}/export')
+        self.assertEqual(response.status_code, 401)
+        if 'parquet' in available_formats():
+            import pyarrow.parquet
+            response = self.admin.get(f'/api/surveys/{survey.id}/export?export_format=parquet')
+            table = pyarrow.parquet.read_table(io.BytesIO(b''.join(response.streaming_content)))
+            self.assertEqual(table.num_rows, 3)
+            import pyarrow.ipc
+            response = self.admin.get(f'/api/surveys/{survey.id}/export?export_format=arrow')
+            table = pyarrow.ipc.open_stream(b''.join(response.streaming_content)).read_all()
+            self.assertEqual(table.column('choice').to_pylist(), ['Да'] * 3)
+        text = Question.objects.create(survey=survey, question_type=QuestionType.TEXT, body='Комментарий')
+        self.user.post(f'/api/surveys/{survey.id}/take', {
+            'user_id': 3, 'answers': [{'question_id': text.id, 'body': 'Первая строка\n"вторая" строка'}]
+        }, format='json')
+        response = self.admin.get(f'/api/surveys/{survey.id}/export')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode('utf-8'))))
+        self.assertRegex(rows[1][8], r'^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.\d{6}\+00:00$')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'answers.csv')
+            stderr = io.StringIO()
+            call_command('export_answers', survey.id, path, '--chunk-size', '2', stdout=io.StringIO(), stderr=stderr)
+            with open(path, newline='', encoding='utf-8') as f:
+                self.assertEqual(list(csv.reader(f)), rows)
+            self.assertIn('exported 4 rows', stderr.getvalue())
+
+    def test_bulk_import(self):
+        surveys = [
+            {
+                'name': f'Пакетный опрос {n}',
+                'start_date': '2021-11-01',
+                'end_date': '2099-01-01',
+                'questions': [
+                    {'body': 'Пол?', 'question_type': QuestionType.CHOICE, 'choices': ['Муж', 'Жен']},
+                    {'body': 'Имя?', 'question_type': QuestionType.TEXT}
+                ]
+            } for n in range(3)
+        ]
+        response = self.admin.post('/api/surveys/bulk', surveys, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(Question.objects.filter(survey_id__in=response.data['ids']).count(), 6)
+        self.assertEqual(AnswerChoice.objects.filter(question__survey_id__in=response.data['ids']).count(), 6)
+
+        invalid = surveys + [{'name': 'Без вариантов', 'start_date': '2021-11-01', 'end_date': '2099-01-01',
+                              'questions': [{'body': 'Пол?', 'question_type': QuestionType.CHOICE}]}]
+        response = self.admin.post('/api/surveys/bulk', invalid, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['errors'][0]['index'], 3)
+        self.assertEqual(Survey.objects.count(), 3)
+
+        rows = 'survey,description,start_date,end_date,question,question_type,choice\n' \
+               'CSV опрос,Анкета,2021-11-01,2022-01-01,Пол?,1,Муж\n' \
+               'CSV опрос,,2021-11-01,2022-01-01,Пол?,1,Жен\n' \
+               'CSV опрос,,2021-11-01,2022-01-01,Имя?,0,\n'
+        response = self.admin.generic('POST', '/api/surveys/bulk', rows.encode('utf-8'), content_type='text/csv')
+        self.assertEqual(response.status_code, 201)
+        survey = Survey.objects.get(name='CSV опрос')
+        self.assertEqual(survey.description, 'Анкета')
+        self.assertEqual(survey.questions.count(), 2)
+        self.assertEqual(AnswerChoice.objects.filter(question__survey=survey).count(), 2)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'surveys.ndjson')
+            with open(path, 'w', encoding='utf-8') as f:
+                for survey in surveys:
+                    f.write(json.dumps(survey, ensure_ascii=False) + '\n')
+            call_command('import_surveys', path, stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(Survey.objects.filter(name='Пакетный опрос 0').count(), 2)
+        response = self.user.post('/api/surveys/bulk', surveys, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_bench_compare(self):
+        baseline = {'take': {'p95_ms': 10.0, 'queries_per_call': 5, 'throughput': 100.0}}
+        self.assertEqual(compare(baseline, baseline, 0.2), [])
+        current = {'take': {'p95_ms': 13.0, 'queries_per_call': 5, 'throughput': 70.0}}
+        self.assertEqual(len(compare(current, baseline, 0.2)), 2)
+        self.assertEqual(compare(current, baseline, 0.5), [])
+
+    def test_metrics(self):
+        registry.clear()
+        self.admin.get('/api/surveys')
+        with override_settings(SLOW_REQUEST_THRESHOLD=0), self.assertLogs('main.middleware', 'WARNING') as logs:
+            self.admin.get('/api/questions')
+        self.assertIn('SLOW REQUEST GET /api/questions view=QuestionViewset.list', logs.output[0])
+        self.assertEqual(
+            [type(handler) for handler in logging.getLogger('main.middleware').handlers], [QueueFileHandler]
+        )
+        response = self.admin.get('/api/metrics')
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode('utf-8')
+        self.assertIn('survey_request_duration_seconds_count{view="SurveyViewset.list",method="GET"} 1', text)
+        self.assertIn('survey_request_queries_bucket{view="SurveyViewset.list",method="GET",le="+Inf"} 1', text)
+        self.assertIn('survey_slow_requests_total{view="QuestionViewset.list",method="GET"} 1', text)
+        self.assertEqual(self.user.get('/api/metrics').status_code, 401)
+
+        survey = Survey.objects.create(name='Опрос', start_date='2021-11-01', end_date='2099-01-01')
+        question = Question.objects.create(survey=survey, body='Имя?', question_type=QuestionType.TEXT)
+        self.user.post(f'/api/surveys/{survey.id}/take', {
+            'user_id': 900, 'answers': [{'question_id': question.id, 'body': 'Маша'}]
+        }, format='json')
+        key = ('survey_request_queries', (('view', 'SurveyViewset.get_answers'), ('method', 'GET')))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.user.get('/api/surveys/answers?user_id=900&stream=ndjson')
+            self.assertNotIn(key, registry.histograms)
+            self.assertIn('Маша', b''.join(response.streaming_content).decode('utf-8'))
+        self.assertEqual(registry.histograms[key].sum, len(queries))
+
+        async def call(path):
+            return await AsyncClient().get(path)
+        with CaptureQueriesContext(connection) as queries:
+            async_to_sync(call)('/api/async/surveys/answers?user_id=900')
+        key = ('survey_request_queries', (('view', 'get_answers'), ('method', 'GET')))
+        self.assertEqual(registry.histograms[key].sum, len(queries))
+        self.assertGreater(len(queries), 0)
+
+    def test_token_user(self):
+        self.admin.get('/api/metrics')
+        with self.assertNumQueries(0):
+            response = self.admin.get('/api/metrics')
+        self.assertEqual(response.status_code, 200)
+        User.objects.filter(login=django_settings.ADMIN_LOGIN).update(status=UserStatus.BLOCKED)
+        revoked_users.reset()
+        response = self.admin.get('/api/metrics')
+        self.assertEqual(response.status_code, 401)
+
+    def test_login_cache(self):
+        credentials = {
+            'login': django_settings.ADMIN_LOGIN,
+            'password': django_settings.ADMIN_PASSWORD
+        }
+        with mock.patch('main.passwords.check_password') as check:
+            response = self.user.post('/api/login', credentials, format='json')
+        self.assertEqual(response.status_code, 200)
+        check.assert_not_called()
+
+        failed = mock.MagicMock()
+        user_login_failed.connect(failed)
+        try:
+            response = self.user.post('/api/login', dict(credentials, password='wrong'), format='json')
+            self.assertEqual(response.status_code, 401)
+            response = self.user.post('/api/login', dict(credentials, login='nobody'), format='json')
+            self.assertEqual(response.status_code, 401)
+            auth_user = User.objects.get(login=django_settings.ADMIN_LOGIN).auth_user
+            auth_user.is_active = False
+            auth_user.save()
+            with mock.patch('main.passwords.check_password') as check:
+                response = self.user.post('/api/login', credentials, format='json')
+            self.assertEqual(response.status_code, 401)
+            check.assert_not_called()
+        finally:
+            user_login_failed.disconnect(failed)
+        self.assertEqual(
+            [call.kwargs['credentials'] for call in failed.call_args_list],
+            [{'username': login} for login in (django_settings.ADMIN_LOGIN, 'nobody', django_settings.ADMIN_LOGIN)]
+        )
+        auth_user.is_active = True
+        auth_user.save()
+
+        with mock.patch.object(password_verifier, 'slots', threading.BoundedSemaphore(1)) as slots:
+            slots.acquire()
+            response = self.user.post('/api/login', dict(credentials, password='other'), format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_connection_pool(self):
+        opened = []
+
+        def connect():
+            conn = sqlite3.connect(':memory:')
+            opened.append(conn)
+            return conn
+
+        def check(conn):
+            conn.execute('SELECT 1')
+            return True
+
+        pool = ConnectionPool(2, 3, 0.01, 0, check, lambda conn: True)
+        first = pool.get(connect)
+        self.assertEqual((pool.size, pool.idle), (2, 1))
+        pool.put(first)
+        self.assertIs(pool.get(connect), first)
+
+        pool.get(connect)
+        pool.get(connect)
+        self.assertEqual(pool.size, 3)
+        with self.assertRaises(PoolTimeout):
+            pool.get(connect)
+
+        pool.put(first)
+        first.close()
+        replacement = pool.get(connect)
+        self.assertIsNot(replacement, first)
+        self.assertEqual(len(opened), 4)
+        self.assertEqual(pool.size, 3)
+
+    def test_replica_router(self):
+        router = ReplicaRouter()
+        middleware = PrimaryPinMiddleware(lambda request: router.db_for_read(Survey))
+        factory = RequestFactory()
+        with override_settings(REPLICA_DATABASES=['replica']), \
+                mock.patch.object(replica_health, 'available', lambda alias: not replica_health.is_down(alias)), \
+                mock.patch.object(connection, 'in_atomic_block', False):
+            token = pinned_to_primary.set(False)
+            self.assertEqual(router.db_for_read(Survey), 'replica')
+            self.assertEqual(router.db_for_write(Survey), 'default')
+            self.assertEqual(router.db_for_read(Survey), 'default')
+            pinned_to_primary.reset(token)
+
+            self.assertEqual(middleware(factory.get('/api/surveys')), 'replica')
+            self.assertEqual(middleware(factory.post('/api/surveys')), 'default')
+
+            replica_health.mark_down('replica')
+            self.assertEqual(middleware(factory.get('/api/surveys')), 'default')
+            with override_settings(REPLICA_RETRY_INTERVAL=0):
+                replica_health.mark_down('replica')
+                self.assertEqual(middleware(factory.get('/api/surveys')), 'replica')
+        replica_health.reset()
+
+        replica = mock.MagicMock(probed_until=0)
+        execute = replica.cursor.return_value.__enter__.return_value.execute
+        with override_settings(REPLICA_DATABASES=['replica'], REPLICA_PROBE_INTERVAL=0), \
+                mock.patch('main.routers.connections', {'default': connection, 'replica': replica}), \
+                mock.patch.object(connection, 'in_atomic_block', False):
+            self.assertEqual(middleware(factory.get('/api/surveys')), 'replica')
+            execute.assert_called_with('SELECT 1')
+            execute.side_effect = OperationalError('server closed the connection unexpectedly')
+            with self.assertLogs('main.routers', 'WARNING'):
+                self.assertEqual(middleware(factory.get('/api/surveys')), 'default')
+            self.assertTrue(replica_health.is_down('replica'))
+            replica.close.assert_called_once()
+            execute.side_effect = None
+            self.assertEqual(middleware(factory.get('/api/surveys')), 'default')
+        replica_health.reset()
+
+    def test_answer_partitions(self):
+        self.assertEqual(add_months(date(2021, 11, 1), 3), date(2022, 2, 1))
+        self.assertEqual(partition_name(date(2022, 2, 1)), 'main_answer_2022_02')
+        self.assertEqual(partition_month('main_answer_2022_02'), date(2022, 2, 1))
+        self.assertIsNone(partition_month('main_answer_default'))
+        if connection.vendor != 'postgresql':
+            with self.assertRaises(CommandError):
+                call_command('answer_partitions')
+            return
+
+        convert_to_partitioned(0)
+        survey = Survey.objects.create(name='Секции', start_date='2021-11-01', end_date='2099-01-01')
+        question = Question.objects.create(survey=survey, question_type=QuestionType.TEXT, body='Имя?')
+        user = User.objects.create(external_id=4242, login='')
+        month = add_months(month_start(timezone.now()), 24)
+        answer = Answer.objects.create(survey=survey, question=question, user=user, body='Маша')
+        created = timezone.make_aware(datetime(month.year, month.month, 15))
+        Answer.objects.filter(id=answer.id).update(created=created)
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {DEFAULT_PARTITION}')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            self.assertEqual(create_partitions(cursor, month, month), [partition_name(month)])
+            cursor.execute(f'SELECT count(*) FROM {DEFAULT_PARTITION}')
+            self.assertEqual(cursor.fetchone()[0], 0)
+            cursor.execute(f'SELECT id FROM {partition_name(month)}')
+            self.assertEqual(cursor.fetchall(), [(answer.id,)])
+
+        plan = Answer.objects.filter(survey_id=survey.id, created__gte=created).explain()
+        self.assertEqual(len(set(re.findall(rf'{partition_name(month)}_p\d+', plan))), 1)
+        self.assertNotIn(partition_name(add_months(month, -1)), plan)
+
+    def test_compact_storage(self):
+        def submit_and_read(storage, first_user):
+            with override_settings(ANSWER_STORAGE=storage):
+                survey = Survey.objects.create(name=storage, start_date='2021-11-01', end_date='2099-01-01')
+                color = Question.objects.create(survey=survey, question_type=QuestionType.MULTICHOICE, body='Цвета?')
+                name = Question.objects.create(survey=survey, question_type=QuestionType.TEXT, body='Имя?')
+                red = AnswerChoice.objects.create(question=color, body='Красный')
+                blue = AnswerChoice.objects.create(question=color, body='Синий')
+                open_surveys.invalidate()
+                for user_id, answers in (
+                    (first_user, [{'question_id': color.id, 'choice_id': blue.id},
+                                  {'question_id': color.id, 'choice_id': red.id},
+                                  {'question_id': name.id, 'body': 'Маша'}]),
+                    (first_user + 1, [{'question_id': color.id, 'choice_id': red.id, 'body': 'Алый'}]),
+                ):
+                    response = self.user.post(f'/api/surveys/{survey.id}/take', {
+                        'user_id': user_id, 'answers': answers
+                    }, format='json')
+                    self.assertEqual(response.status_code, 201)
+                answers = self.user.get(f'/api/surveys/answers?user_id={first_user}&group_by=none').json()['results']
+                streamed = self.user.get(f'/api/surveys/answers?user_id={first_user}&group_by=none&stream=ndjson')
+                self.assertEqual(
+                    [json.loads(line) for line in b''.join(streamed.streaming_content).splitlines()],
+                    answers
+                )
+                results = self.admin.get(f'/api/surveys/{survey.id}/results').json()
+                call_command('rebuild_results', '--survey-id', str(survey.id), stdout=io.StringIO())
+                self.assertEqual(self.admin.get(f'/api/surveys/{survey.id}/results').json(), results)
+                export = list(csv.reader(io.StringIO(
+                    b''.join(self.admin.get(f'/api/surveys/{survey.id}/export').streaming_content).decode('utf-8')
+                )))
+            for item in answers:
+                item['survey_id'] = item['question_id'] = None
+            for question in results['questions']:
+                question['id'] = None
+                for choice in question['choices']:
+                    choice['id'] = None
+            results['survey_id'] = None
+            return (
+                sorted(answers, key=json.dumps),
+                results,
+                sorted(row[4:5] + row[6:8] for row in export[1:])
+            )
+
+        self.assertEqual(submit_and_read('compact', 10), submit_and_read('rows', 20))
+        self.assertEqual(Submission.objects.count(), 2)
+        self.assertEqual(SubmissionText.objects.count(), 2)
+
+        def read_answers(user_id):
+            return sorted(
+                self.user.get(f'/api/surveys/answers?user_id={user_id}&group_by=none').json()['results'], key=json.dumps
+            )
+        with override_settings(ANSWER_STORAGE='compact'):
+            answers = {user_id: read_answers(user_id) for user_id in (10, 11)}
+        answers.update({user_id: read_answers(user_id) for user_id in (20, 21)})
+        call_command('convert_answers', '--to', 'compact', '--chunk-size', '2', stdout=io.StringIO())
+        self.assertEqual(Answer.objects.count(), 0)
+        self.assertEqual(Submission.objects.count(), 4)
+        with override_settings(ANSWER_STORAGE='compact'):
+            self.assertEqual({user_id: read_answers(user_id) for user_id in answers}, answers)
+        call_command('convert_answers', '--to', 'rows', stdout=io.StringIO())
+        self.assertEqual(Submission.objects.count(), 0)
+        self.assertEqual({user_id: read_answers(user_id) for user_id in answers}, answers)
+
+    def test_index_advisor(self):
+        if connection.vendor == 'postgresql':
+            self.assertEqual(sequential_scans('Seq Scan on main_user  (cost=0.00..1.01 rows=1 width=4)'), ['main_user'])
+            self.assertEqual(sequential_scans('Index Scan using survey_created_id_idx on main_survey'), [])
+            # на малом наборе данных Postgres законно выбирает Seq Scan, без него план покажет,
+            # есть ли подходящий индекс
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        else:
+            self.assertEqual(sequential_scans('3 0 0 SCAN main_user'), ['main_user'])
+            self.assertEqual(sequential_scans('3 0 0 SCAN main_survey USING INDEX survey_created_id_idx'), [])
+        dataset = generate(surveys=5, questions=3, choices=2, respondents=5, answers=3)
+        report = advise(dataset)
+        self.assertEqual(len(report), len(CANONICAL_QUERIES))
+        self.assertEqual([(name, tables) for name, tables, plan in report if tables], [])
+
+    def test_respondent_upsert(self):
+        User.objects.create(external_id=700, login='')
+        with mock.patch('main.ingestion.transaction.on_commit', lambda func: func()):
+            with self.assertNumQueries(1):
+                users = resolve_users([700, 701, 701])
+            self.assertEqual(set(users), {700, 701})
+            self.assertEqual(User.objects.filter(external_id__in=[700, 701]).count(), 2)
+            with self.assertNumQueries(0):
+                self.assertEqual(resolve_users([700, 701]), users)
+        self.assertEqual(find_user_id(701), users[701])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            User.objects.create(external_id=700, login='')
+
+    def test_survey_trees(self):
+        survey = Survey.objects.create(name='Опрос "в кавычках"  \n', start_date='2021-11-01', end_date='2099-01-01')
+        Survey.objects.create(name='Пустой опрос', start_date='2021-11-01', end_date='2099-01-01')
+        question = Question.objects.create(survey=survey, body='Вопрос\t\\ 😀', question_type=QuestionType.CHOICE)
+        Question.objects.create(survey=survey, body='Удаленный', question_type=QuestionType.TEXT, is_deleted=True)
+        AnswerChoice.objects.create(question=question, body='Да\x01')
+        AnswerChoice.objects.create(question=question, body='Нет', is_deleted=True)
+        surveys = Survey.objects.order_by('id')
+        expected = JSONRenderer().render(SurveySerializer(
+            surveys.prefetch_related('questions__answer_choices'), many=True
+        ).data)
+        with self.assertNumQueries(3):
+            trees = survey_trees(surveys.values(*SURVEY_COLUMNS))
+        self.assertEqual(render_json(trees), expected)
+        with mock.patch('main.renderers.orjson', None):
+            self.assertEqual(render_json(trees), expected)
+        response = self.admin.get('/api/surveys?ordering=created')
+        self.assertEqual(response.json()['results'], json.loads(expected))
+        response = self.admin.get(f'/api/surveys/{survey.id}')
+        self.assertEqual(response.content, JSONRenderer().render(json.loads(expected)[0]))
+
+    def test_async_logging(self):
+        handler = logging.getLogger('main.serializers').handlers[0]
+        self.assertIsInstance(handler, QueueFileHandler)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'nested', 'requests.log')
+            handler = QueueFileHandler(filename, max_bytes=50)
+            logger = logging.getLogger('test_async_logging')
+            logger.addHandler(handler)
+            try:
+                for number in range(10):
+                    logger.warning('запись %d %s', number, 'x' * 30)
+                handler.flush()
+                self.assertEqual(len(os.listdir(os.path.dirname(filename))), 10)
+                self.assertEqual(handler.dropped, 0)
+            finally:
+                logger.removeHandler(handler)
+                handler.close()
+            handler = QueueFileHandler(filename, queue_size=2)
+            handler.listener.stop()
+            handler.listener = None
+            for number in range(3):
+                handler.handle(logging.makeLogRecord({'msg': f'запись {number}'}))
+            self.assertEqual(handler.dropped, 1)
+            handler.close()
+
+        sampler = EndpointSampler(limit=2, limits={'SurveyViewset.take': 1})
+        stats = RequestStats()
+        stats.view = 'SurveyViewset.take'
+        token = current_request.set(stats)
+        try:
+            self.assertEqual([sampler.filter(None) for _ in range(3)], [True, False, False])
+            stats.view = 'SurveyViewset.list'
+            self.assertEqual([sampler.filter(None) for _ in range(3)], [True, True, False])
+        finally:
+            current_request.reset(token)
+
+    def test_question_update(self):
+        survey = Survey.objects.create(name='Опрос', start_date='2021-11-01', end_date='2099-01-01')
+        question = Question.objects.create(survey=survey, body='Город', question_type=QuestionType.CHOICE)
+        AnswerChoice.objects.bulk_create([
+            AnswerChoice(question=question, body=body) for body in ('Москва', 'Казань', 'Омск')
+        ])
+        moscow = AnswerChoice.objects.get(question=question, body='Москва')
+        updated = question.updated
+        etag = self.admin.get(f'/api/surveys/{survey.id}')['ETag']
+        with CaptureQueriesContext(connection) as context:
+            response = self.admin.put(f'/api/questions/{question.id}', {
+                'body': 'Ваш город',
+                'question_type': QuestionType.CHOICE,
+                'choices': ['Казань', 'Омск', 'Пермь', 'Пермь'] + [f'Город {n}' for n in range(100)]
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        writes = [q['sql'] for q in context.captured_queries if 'main_answerchoice' in q['sql']
+                  and not q['sql'].startswith('SELECT')]
+        self.assertEqual(len(writes), 2)
+        question.refresh_from_db()
+        self.assertEqual(question.body, 'Ваш город')
+        self.assertGreater(question.updated, updated)
+        live = AnswerChoice.objects.filter(question=question, is_deleted=False)
+        self.assertEqual(live.count(), 103)
+        self.assertFalse(live.filter(body='Москва').exists())
+        self.assertNotEqual(self.admin.get(f'/api/surveys/{survey.id}')['ETag'], etag)
+        response = self.admin.put(f'/api/questions/{question.id}', {
+            'body': 'Ваш город',
+            'question_type': QuestionType.CHOICE,
+            'choices': ['Москва']
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(AnswerChoice.objects.filter(question=question, is_deleted=False)), [moscow])
+
+    def test_active_surveys(self):
+        today = date.today()
+        surveys = {}
+        for name, start, end in (
+                ('open', today - timedelta(days=1), today),
+                ('future', today + timedelta(days=1), today + timedelta(days=30)),
+                ('past', today - timedelta(days=30), today - timedelta(days=1)),
+        ):
+            response = self.admin.post('/api/surveys', {
+                'name': name, 'start_date': start, 'end_date': end,
+                'questions': [{'body': 'Имя?', 'question_type': QuestionType.TEXT}]
+            }, format='json')
+            surveys[name] = response.data['id']
+        Survey.objects.create(name='inactive', start_date=today, end_date=today, is_active=False)
+        response = self.admin.get('/api/surveys/active')
+        self.assertEqual([item['id'] for item in response.json()['results']], [surveys['open']])
+        question_id = Question.objects.get(survey_id=surveys['future']).id
+        payload = {'user_id': 900, 'answers': [{'question_id': question_id, 'body': 'Маша'}]}
+        with self.assertNumQueries(1):
+            response = self.user.post(f'/api/surveys/{surveys["future"]}/take', payload, format='json')
+        self.assertEqual(response.status_code, 404)
+        created_elsewhere = Survey.objects.create(name='other worker', start_date=today, end_date=today)
+        name = Question.objects.create(survey=created_elsewhere, question_type=QuestionType.TEXT, body='Имя?')
+        response = self.user.post(f'/api/surveys/{created_elsewhere.id}/take', {
+            'user_id': 901, 'answers': [{'question_id': name.id, 'body': 'Оля'}]
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.user.post('/api/surveys/abc/take', payload, format='json').status_code, 404)
+        open_question = Question.objects.get(survey_id=surveys['open'])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.user.post(f'/api/surveys/{surveys["open"]}/take', {
+                'user_id': 902, 'answers': [{'question_id': open_question.id, 'body': 'Аня'}]
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT "main_survey"')])
+        with mock.patch('main.cache.timezone.localdate', return_value=today + timedelta(days=1)):
+            response = self.admin.get('/api/surveys/active')
+            self.assertEqual([item['id'] for item in response.json()['results']], [surveys['future']])
+            response = self.user.post(f'/api/surveys/{surveys["future"]}/take', payload, format='json')
+            self.assertEqual(response.status_code, 201)
+        self.admin.delete(f'/api/surveys/{surveys["open"]}')
+        self.assertFalse(open_surveys.is_open(surveys['open']))
+
+    def test_sync(self):
+        response = self.admin.post('/api/surveys', {
+            'name': 'Полевой опрос', 'start_date': '2021-11-01', 'end_date': '2099-01-01',
+            'questions': [
+                {'body': 'Имя?', 'question_type': QuestionType.TEXT},
+                {'body': 'Пол?', 'question_type': QuestionType.CHOICE, 'choices': ['Муж', 'Жен']},
+            ]
+        }, format='json')
+        survey_id = response.data['id']
+        closed = Survey.objects.create(name='Закрытый', start_date='2021-11-01', end_date='2021-12-01')
+        name, gender = Question.objects.filter(survey_id=survey_id).order_by('id')
+        choice = AnswerChoice.objects.filter(question=gender).first()
+        submissions = [
+            {'survey_id': survey_id, 'user_id': 800, 'key': 'a',
+             'answers': [{'question_id': name.id, 'body': 'Маша'}, {'question_id': gender.id, 'choice_id': choice.id}]},
+            {'survey_id': survey_id, 'user_id': 800, 'key': 'a', 'answers': [{'question_id': name.id, 'body': 'Петя'}]},
+            {'survey_id': survey_id, 'user_id': 802, 'answers': [{'question_id': gender.id, 'choice_id': 100500}]},
+            {'survey_id': closed.id, 'user_id': 803, 'answers': []},
+            {'survey_id': survey_id, 'user_id': 'x', 'answers': []},
+            {'survey_id': survey_id, 'user_id': 804, 'answers': [{'question_id': name.id, 'body': 'Оля'}]},
+        ]
+        body = '\n'.join(json.dumps(item) for item in submissions) + '\n{"survey_id": '
+        response = self.user.generic('POST', '/api/surveys/sync', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([item['index'] for item in results], list(range(7)))
+        self.assertEqual(
+            [item['status'] for item in results],
+            ['created', 'duplicate', 'invalid', 'closed', 'invalid', 'created', 'invalid']
+        )
+        self.assertEqual(Answer.objects.filter(question__survey_id=survey_id).count(), 3)
+        self.assertEqual(set(User.objects.filter(external_id__gte=800).values_list('external_id', flat=True)),
+                         {800, 804})
+
+        response = self.user.post('/api/surveys/sync', submissions[:1], format='json')
+        self.assertEqual([item['status'] for item in response.json()['results']], ['duplicate'])
+        with self.settings(SYNC_BATCH_SIZE=100):
+            with CaptureQueriesContext(connection) as context:
+                response = self.user.post('/api/surveys/sync', [
+                    dict(submissions[5], user_id=900 + n) for n in range(50)
+                ], format='json')
+        self.assertEqual({item['status'] for item in response.json()['results']}, {'created'})
+        self.assertLessEqual(len(context.captured_queries), 13)
+
+        replay = [
+            {'survey_id': survey_id, 'user_id': 950 + n, 'key': f'replay-{n}',
+             'answers': [{'question_id': name.id, 'body': 'Повтор'}]} for n in range(4)
+        ]
+        SubmissionKey.objects.bulk_create([
+            SubmissionKey(survey_id=survey_id, respondent=item['user_id'], key=item['key']) for item in replay[:2]
+        ])
+        response = self.user.post('/api/surveys/sync', replay + [dict(replay[3], user_id=960)], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item['status'] for item in response.json()['results']],
+            ['duplicate', 'duplicate', 'created', 'created', 'created']
+        )
+        self.assertEqual(Answer.objects.filter(body='Повтор').count(), 3)
+        with mock.patch('main.ingestion.can_upsert', return_value=False):
+            response = self.user.post('/api/surveys/sync', replay + [dict(replay[0], user_id=961)], format='json')
+        self.assertEqual(
+            [item['status'] for item in response.json()['results']],
+            ['duplicate', 'duplicate', 'duplicate', 'duplicate', 'created']
+        )
+        response = self.user.post(f'/api/surveys/{survey_id}/take', {
+            'user_id': 950, 'answers': [{'question_id': name.id, 'body': 'Повтор'}]
+        }, format='json', HTTP_IDEMPOTENCY_KEY='replay-0')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Answer.objects.filter(body='Повтор').count(), 4)
+
+        SubmissionKey.objects.filter(key='replay-0').update(created=timezone.now() - timedelta(days=40))
+        call_command('purge_submission_keys', '--days', '30', stdout=io.StringIO())
+        self.assertFalse(SubmissionKey.objects.filter(key='replay-0').exists())
+        self.assertTrue(SubmissionKey.objects.filter(key='replay-1').exists())
+
+    def test_async_views(self):
+        response = self.admin.post('/api/surveys', {
+            'name': 'Асинхронный опрос', 'start_date': '2021-11-01', 'end_date': '2099-01-01',
+            'questions': [
+                {'body': 'Имя?', 'question_type': QuestionType.TEXT},
+                {'body': 'Пол?', 'question_type': QuestionType.CHOICE, 'choices': ['Муж', 'Жен']},
+            ]
+        }, format='json')
+        survey_id = response.data['id']
+        closed = Survey.objects.create(name='Закрытый', start_date='2021-11-01', end_date='2021-12-01')
+        name, gender = Question.objects.filter(survey_id=survey_id).order_by('id')
+        choice = AnswerChoice.objects.filter(question=gender).first()
+        client = AsyncClient()
+
+        async def call(method, *args, **kwargs):
+            return await method(*args, **kwargs)
+        get, post = partial(async_to_sync(call), client.get), partial(async_to_sync(call), client.post)
+        authorization = {'authorization': f'Bearer {self.access_token}'}
+
+        self.assertEqual(get(f'/api/async/surveys/{survey_id}').status_code, 401)
+        response = get(f'/api/async/surveys/{survey_id}', headers=authorization)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, self.admin.get(f'/api/surveys/{survey_id}').content)
+        response = get(f'/api/async/surveys/{survey_id}', headers=dict(authorization, if_none_match=response['ETag']))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(get('/api/async/surveys/100500', headers=authorization).status_code, 404)
+
+        answers = [{'question_id': name.id, 'body': 'Маша'}, {'question_id': gender.id, 'choice_id': choice.id}]
+        response = post(f'/api/async/surveys/{survey_id}/take', {'user_id': 700, 'answers': answers},
+                        content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.user.post(f'/api/surveys/{survey_id}/take', {'user_id': 701, 'answers': answers}, format='json')
+        invalid = {'user_id': 700, 'answers': [{'question_id': gender.id, 'choice_id': 100500}]}
+        response = post(f'/api/async/surveys/{survey_id}/take', invalid, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json(), self.user.post(f'/api/surveys/{survey_id}/take', invalid, format='json').json()
+        )
+        response = post(f'/api/async/surveys/{survey_id}/take', {'user_id': 'x'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = post(f'/api/async/surveys/{closed.id}/take', {'user_id': 700, 'answers': []},
+                        content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(get(f'/api/async/surveys/{survey_id}/take').status_code, 405)
+
+        for user_id in (700, 701):
+            response = get(f'/api/async/surveys/answers?user_id={user_id}&page_size=1')
+            self.assertEqual(response.status_code, 200)
+            expected = self.user.get(f'/api/surveys/answers?user_id={user_id}&page_size=1').json()
+            self.assertEqual(response.json()['results'], expected['results'])
+            response = get(response.json()['next'])
+            self.assertEqual(response.json()['results'], self.user.get(expected['next']).json()['results'])
+        self.assertEqual(get('/api/async/surveys/answers?user_id=100500').status_code, 404)
+        self.assertEqual(get('/api/async/surveys/answers?user_id=700&stream=json').status_code, 400)
+        call_command('convert_answers', '--to', 'compact', stdout=io.StringIO())
+        with override_settings(ANSWER_STORAGE='compact'):
+            response = get('/api/async/surveys/answers?user_id=700')
+            self.assertEqual(response.json()['results'], self.user.get('/api/surveys/answers?user_id=700').json()['results'])
 
+        User.objects.filter(login=django_settings.ADMIN_LOGIN).update(status=UserStatus.BLOCKED)
+        revoked_users.reset()
+        self.assertEqual(get(f'/api/async/surveys/{survey_id}', headers=authorization).status_code, 401)
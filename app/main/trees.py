@@ -0,0 +1,77 @@
+"""
+Быстрая сборка деревьев опросов для чтения
+
+Опросы, вопросы и варианты ответа читаются тремя запросами values_list
+и группируются в словари той же схемы, что и SurveySerializer,
+без вызова to_representation для каждого поля. Удаленные вопросы и варианты
+попадают в дерево так же, как и в SurveySerializer.
+"""
+from collections import defaultdict
+
+from .metrics import serializer_timing
+from .models import AnswerChoice, Question
+
+SURVEY_COLUMNS = ('id', 'name', 'start_date', 'end_date')
+
+
+def survey_trees(surveys):
+    """
+    :param surveys: словари values() с колонками SURVEY_COLUMNS, остальные колонки не выводятся
+    :return: список словарей в схеме SurveySerializer в порядке surveys
+    """
+    surveys = list(surveys)
+    questions, choices = tree_querysets([survey['id'] for survey in surveys])
+    return group_trees(surveys, list(questions), list(choices))
+
+
+async def asurvey_trees(surveys):
+    """
+    То же, что survey_trees, для асинхронных view: строки читаются через async for
+    :param surveys: список словарей values() с колонками SURVEY_COLUMNS
+    """
+    questions, choices = tree_querysets([survey['id'] for survey in surveys])
+    question_rows = [row async for row in questions]
+    choice_rows = [row async for row in choices]
+    return group_trees(surveys, question_rows, choice_rows)
+
+
+def tree_querysets(survey_ids):
+    questions = Question.objects.filter(
+        survey_id__in=survey_ids
+    ).order_by('id').values_list('survey_id', 'id', 'body', 'question_type')
+    choices = AnswerChoice.objects.filter(
+        question__survey_id__in=survey_ids
+    ).order_by('id').values_list('question_id', 'id', 'body')
+    return questions, choices
+
+
+def group_trees(surveys, question_rows, choice_rows):
+    with serializer_timing():
+        choices = defaultdict(list)
+        for question_id, choice_id, body in choice_rows:
+            choices[question_id].append({'body': body, 'id': choice_id})
+        questions = defaultdict(list)
+        for survey_id, question_id, body, question_type in question_rows:
+            questions[survey_id].append({
+                'id': question_id,
+                'body': body,
+                'question_type': question_type,
+                'choices': choices.get(question_id, []),
+            })
+        return [
+            {
+                'id': survey['id'],
+                'name': survey['name'],
+                'start_date': iso_date(survey['start_date']),
+                'end_date': iso_date(survey['end_date']),
+                'questions': questions.get(survey['id'], []),
+            } for survey in surveys
+        ]
+
+
+def iso_date(value):
+    return value.isoformat() if value else None
+
+
+def survey_tree(survey):
+    return survey_trees([survey])[0]
@@ -1,7 +1,7 @@
 from django.urls import path, include
 from rest_framework import routers
 
-from main import views
+from main import async_views, views
 
 
 router = routers.SimpleRouter(trailing_slash=False)
@@ -10,5 +10,9 @@ router.register('questions', views.QuestionViewset)
 router.register('', views.UserViewSet)
 
 urlpatterns = [
+    path('metrics', views.MetricsView.as_view()),
+    path('async/surveys/answers', async_views.get_answers),
+    path('async/surveys/<int:pk>', async_views.retrieve),
+    path('async/surveys/<int:pk>/take', async_views.take),
     path('', include(router.urls)),
 ]
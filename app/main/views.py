@@ -1,12 +1,23 @@
+from collections import OrderedDict
+import codecs
+import io
+import shutil
+import tempfile
 from datetime import datetime
 
 from django_filters.rest_framework import DjangoFilterBackend
-from django.contrib.auth import authenticate
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from rest_framework import viewsets, status
 from rest_framework.mixins import RetrieveModelMixin, ListModelMixin
 from rest_framework.decorators import action, authentication_classes, permission_classes
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.filters import OrderingFilter
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.permissions import AllowAny, IsAuthenticated
@@ -14,11 +25,27 @@ from rest_framework_simplejwt.settings import api_settings
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 
-from .models import Survey, Question, AnswerChoice, User, UserRole, Answer
+from .models import Survey, Question, AnswerChoice, User, UserRole
 from .serializers import SurveySerializer, SurveySerializerCreate, SurveySerializerUpdate, \
-    LoginSerializer, CredentialsSerializer, QuestionSerializer, TakeSurveySerializer, AnswerSerializerList, \
-    AnswerSerializerRequest
+    LoginSerializer, CredentialsSerializer, QuestionSerializer, QuestionSerializerUpdate, TakeSurveySerializer, \
+    AnswerSerializerList, AnswerSerializerRequest, SurveyResultSerializer, SurveyBulkSerializer, \
+    SyncSubmissionSerializer, SyncResponseSerializer, ValidationError
+from main.answers import filter_answers, stream_answers, answer_values, answer_items, select_fields, \
+    group_by_survey, ANSWER_OUTPUT, GROUP_BY_NONE, GROUP_BY_SURVEY, STREAM_JSON, STREAM_NDJSON, STREAM_CONTENT_TYPES
+from main.authentication import add_user_claims
+from main.cache import get_survey_definition, invalidate_survey, touch_survey, open_surveys, survey_is_open
 from main.decorators import admin_required
+from main.export import FORMAT_CSV, FORMATS, CONTENT_TYPES, available_formats, export_chunks
+from main.importing import import_surveys, read_json, reopen, SurveyImportError, FORMAT_CSV as IMPORT_CSV, \
+    FORMAT_JSON as IMPORT_JSON
+from main.metrics import registry
+from main.pagination import AnswerPagination
+from main.passwords import password_verifier, login_failed, LoginBusy
+from main.renderers import FastJSONRenderer
+from main.results import get_results
+from main.ingestion import get_answer_queue, idempotency_key, find_user_id
+from main.sync import sync_submissions
+from main.trees import SURVEY_COLUMNS, survey_trees
 from main.responses import *
 
 
@@ -44,7 +71,7 @@ class UserViewSet(
 
     def __get_credentials_response(self, user, refresh_token=None):
         if refresh_token is None:
-            refresh_token = RefreshToken.for_user(user.auth_user)
+            refresh_token = add_user_claims(RefreshToken.for_user(user.auth_user), user)
 
         serializer = CredentialsSerializer(data={
             'access_token': str(refresh_token.access_token),
@@ -62,7 +89,8 @@ class UserViewSet(
 
     @swagger_auto_schema(responses={
         200: login_response,
-        400: BAD_REQUEST
+        400: BAD_REQUEST,
+        429: TOO_MANY_REQUESTS
     })
     @action(
         detail=False,
@@ -78,21 +106,17 @@ class UserViewSet(
         """
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        current_user = User.objects.filter(
+        current_user = User.objects.select_related('auth_user').filter(
             login=serializer.validated_data['login']
         ).first()
         if not current_user:
+            login_failed(serializer.validated_data['login'], request)
             return Response(status=status.HTTP_401_UNAUTHORIZED)
-        password = current_user.hash_password(
-            serializer.validated_data['password'],
-        )
-
-        auth_user = authenticate(
-            request=request,
-            username=f'user_{current_user.id}',
-            password=password
-        )
-        if auth_user is None:
+        try:
+            verified = password_verifier.verify(current_user, serializer.validated_data['password'], request)
+        except LoginBusy:
+            return Response(status=status.HTTP_429_TOO_MANY_REQUESTS, headers={'Retry-After': '1'})
+        if not verified:
             return Response(status=status.HTTP_401_UNAUTHORIZED)
 
         return self.__get_credentials_response(current_user)
@@ -107,10 +131,25 @@ class SurveyViewset(viewsets.GenericViewSet, ListModelMixin, RetrieveModelMixin)
     filterset_fields = ['id', 'start_date', 'end_date', 'is_deleted']
     ordering_fields = ['created', 'start_date', 'end_date']
     ordering = ['-created']
-
-    answer_param = openapi.Parameter('user_id', openapi.IN_QUERY, type=openapi.TYPE_INTEGER)
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    answer_params = [
+        openapi.Parameter('user_id', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, required=True),
+        openapi.Parameter('survey_id', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+        openapi.Parameter('since', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME),
+        openapi.Parameter('stream', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=[STREAM_JSON, STREAM_NDJSON]),
+        openapi.Parameter('fields', openapi.IN_QUERY, type=openapi.TYPE_STRING, description=','.join(ANSWER_OUTPUT)),
+        openapi.Parameter(
+            'group_by', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=[GROUP_BY_SURVEY, GROUP_BY_NONE],
+            default=GROUP_BY_SURVEY
+        ),
+    ]
     survey_response = openapi.Response(SUCCESS_RESPONSE, SurveySerializer)
     answer_response = openapi.Response(SUCCESS_RESPONSE, AnswerSerializerList)
+    results_response = openapi.Response(SUCCESS_RESPONSE, SurveyResultSerializer)
+    bulk_response = openapi.Response(SUCCESS_RESPONSE, SurveyBulkSerializer)
+    sync_response = openapi.Response(SUCCESS_RESPONSE, SyncResponseSerializer)
+    export_param = openapi.Parameter('export_format', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=list(FORMATS))
 
     def get_serializer_class(self):
         if self.action == 'create':
@@ -135,6 +174,37 @@ class SurveyViewset(viewsets.GenericViewSet, ListModelMixin, RetrieveModelMixin)
         instance = serializer.save()
         return Response(data=SurveySerializer(instance).data, status=status.HTTP_201_CREATED)
 
+    @swagger_auto_schema(request_body=SurveySerializerCreate(many=True), responses={
+        201: bulk_response,
+        400: BAD_REQUEST
+    })
+    @action(
+        detail=False,
+        url_path='bulk',
+        methods=['post']
+    )
+    @admin_required
+    def bulk(self, request, *args, **kwargs):
+        """
+        Пакетное создание опросов из JSON-массива, NDJSON или CSV (Content-Type: text/csv)
+        Доступно только администратору
+        Опросы создаются, только если все описания корректны
+        """
+        import_format = IMPORT_CSV if request.content_type.startswith('text/csv') else IMPORT_JSON
+        with tempfile.TemporaryFile() as body:
+            if request.stream is not None:
+                shutil.copyfileobj(request.stream, body)
+            try:
+                survey_ids = import_surveys(lambda: reopen(body), import_format, settings.IMPORT_BATCH_SIZE)
+            except SurveyImportError as e:
+                raise ValidationError(detail={'errors': e.errors})
+            except (ValueError, KeyError) as e:
+                raise ValidationError(detail={'errors': [str(e)]})
+        return Response(
+            data={'created': len(survey_ids), 'ids': survey_ids},
+            status=status.HTTP_201_CREATED
+        )
+
     @swagger_auto_schema(responses={
         200: survey_response,
         400: BAD_REQUEST,
@@ -151,8 +221,66 @@ class SurveyViewset(viewsets.GenericViewSet, ListModelMixin, RetrieveModelMixin)
         serializer = self.get_serializer(instance, data=request.data)
         serializer.is_valid(raise_exception=True)
         instance = serializer.save()
+        invalidate_survey(instance.id)
         return Response(data=SurveySerializer(instance).data, status=status.HTTP_200_OK)
 
+    def list(self, request, *args, **kwargs):
+        """
+        Список опросов
+        Деревья опросов собираются из values() без вложенных сериализаторов
+        """
+        return self.tree_response(Survey.objects.all())
+
+    @swagger_auto_schema(responses={
+        200: survey_response
+    })
+    @action(
+        detail=False,
+        url_path='active',
+        methods=['get']
+    )
+    def active(self, request, *args, **kwargs):
+        """
+        Открытые опросы: не удалены, активны и сегодня между датами начала и окончания
+        Множество открытых опросов берется из кэша процесса
+        """
+        return self.tree_response(Survey.objects.filter(id__in=open_surveys.ids()))
+
+    def tree_response(self, queryset):
+        surveys = self.filter_queryset(queryset.values(*SURVEY_COLUMNS, 'created'))
+        page = self.paginate_queryset(surveys)
+        if page is None:
+            return Response(survey_trees(surveys))
+        return self.get_paginated_response(survey_trees(page))
+
+    @swagger_auto_schema(responses={
+        200: survey_response,
+        304: NOT_MODIFIED,
+        404: NOT_FOUND
+    })
+    def retrieve(self, request, pk=None):
+        """
+        Получение опроса
+        Ответ отдается из кэша, повторный запрос с If-None-Match
+        или If-Modified-Since получает 304 без обращения к БД
+        """
+        try:
+            definition = get_survey_definition(int(pk))
+        except ValueError:
+            definition = None
+        if definition is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        response = get_conditional_response(
+            request,
+            etag=definition.etag,
+            last_modified=definition.last_modified
+        )
+        if response is None:
+            response = HttpResponse(definition.content, content_type='application/json')
+        response['ETag'] = definition.etag
+        response['Last-Modified'] = http_date(definition.last_modified)
+        return response
+
     @admin_required
     def destroy(self, request, pk=None):
         """
@@ -163,10 +291,12 @@ class SurveyViewset(viewsets.GenericViewSet, ListModelMixin, RetrieveModelMixin)
         instance = get_object_or_404(self.queryset, pk=pk)
         instance.is_deleted = True
         instance.save()
+        invalidate_survey(instance.id)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @swagger_auto_schema(responses={
         201: SUCCESS_RESPONSE,
+        202: ACCEPTED_RESPONSE,
         400: BAD_REQUEST,
         404: NOT_FOUND
     })
@@ -179,13 +309,103 @@ class SurveyViewset(viewsets.GenericViewSet, ListModelMixin, RetrieveModelMixin)
     )
     @authentication_classes([])
     def take(self, request, *args, **kwargs):
-        instance = self.get_object()
+        """
+        Прохождение опроса
+        При включенной очереди ответы записываются в БД фоновой командой flush_answers,
+        повторы с тем же заголовком Idempotency-Key не создают дублей
+        Открытость опроса проверяется по кэшу открытых опросов, строка опроса читается из БД,
+        только если кэш считает опрос закрытым: опрос, созданный или открытый в другом процессе,
+        принимает ответы сразу
+        """
+        if open_surveys.is_open(kwargs.get('pk')):
+            instance = Survey(pk=int(kwargs.get('pk')))
+        else:
+            try:
+                instance = Survey.objects.filter(pk=int(kwargs.get('pk'))).first()
+            except (TypeError, ValueError):
+                instance = None
+            if instance is not None and not survey_is_open(instance, timezone.localdate()):
+                instance = None
+        if instance is None:
+            raise ValidationError(detail=SURVEY_CLOSED, status_code=status.HTTP_404_NOT_FOUND)
         serializer = self.get_serializer(instance, data=request.data)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        key = idempotency_key(request.META.get('HTTP_IDEMPOTENCY_KEY'))
+        if settings.ANSWER_QUEUE_ENABLED:
+            get_answer_queue().put(dict(serializer.validated_data, survey_id=instance.id), key=key)
+            return Response(status=status.HTTP_202_ACCEPTED)
+        serializer.save(key=key)
         return Response(status=status.HTTP_201_CREATED)
 
-    @swagger_auto_schema(manual_parameters=[answer_param], responses={
+    @swagger_auto_schema(request_body=SyncSubmissionSerializer(many=True), responses={
+        200: sync_response,
+    })
+    @action(
+        detail=False,
+        url_path='sync',
+        methods=['post'],
+        permission_classes=(AllowAny,)
+    )
+    @authentication_classes([])
+    def sync(self, request, *args, **kwargs):
+        """
+        Пакетная выгрузка прохождений опросов: JSON-массив или NDJSON объектов
+        {survey_id, user_id, answers, key}
+        Тело читается потоком, для каждого прохождения возвращается статус:
+        created, queued, duplicate, invalid, closed или failed
+        """
+        stream = codecs.getreader('utf-8')(request.stream) if request.stream is not None else io.StringIO()
+        results = sync_submissions(read_json(stream), settings.SYNC_BATCH_SIZE)
+        return Response(data={'results': results}, status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(responses={
+        200: results_response,
+        404: NOT_FOUND
+    })
+    @action(
+        detail=True,
+        url_path='results',
+        methods=['get'],
+        serializer_class=SurveyResultSerializer
+    )
+    @admin_required
+    def results(self, request, pk=None):
+        """
+        Результаты опроса
+        Доступно только администратору
+        Считаются по агрегированным счетчикам, без чтения ответов
+        """
+        survey = get_object_or_404(Survey.objects.all(), pk=pk)
+        return Response(data=get_results(survey), status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(manual_parameters=[export_param], responses={
+        200: SUCCESS_RESPONSE,
+        400: BAD_REQUEST,
+        404: NOT_FOUND
+    })
+    @action(
+        detail=True,
+        url_path='export',
+        methods=['get']
+    )
+    @admin_required
+    def export(self, request, pk=None):
+        """
+        Выгрузка всех ответов опроса файлом CSV, Parquet или Arrow
+        Доступно только администратору
+        """
+        survey = get_object_or_404(Survey.objects.all(), pk=pk)
+        export_format = request.query_params.get('export_format', FORMAT_CSV)
+        if export_format not in available_formats():
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        response = StreamingHttpResponse(
+            export_chunks(survey.id, export_format, settings.EXPORT_CHUNK_SIZE),
+            content_type=CONTENT_TYPES[export_format]
+        )
+        response['Content-Disposition'] = f'attachment; filename="survey_{survey.id}.{export_format}"'
+        return response
+
+    @swagger_auto_schema(manual_parameters=answer_params, responses={
         200: answer_response,
         400: BAD_REQUEST
     })
@@ -200,27 +420,43 @@ class SurveyViewset(viewsets.GenericViewSet, ListModelMixin, RetrieveModelMixin)
     def get_answers(self, request, *args, **kwargs):
         """
         Получение всех ответов по user_id
+        С параметром stream=json|ndjson ответы отдаются потоком целиком, без пагинации
+        fields=survey_id,question_id,question,answer - только перечисленные поля
+        Ответы сгруппированы по опросам, group_by=none - одним списком
         """
-        user = User.objects.filter(external_id=int(request.query_params.get('user_id', -1)))
-        if not user:
+        params = self.get_serializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        external_id = params.validated_data['user_id']
+        user_id = find_user_id(external_id)
+        if user_id is None:
             return Response(status=status.HTTP_404_NOT_FOUND)
-        answers = Answer.objects.select_related(
-            'question').select_related(
-            'choice').select_related(
-            'question__survey').filter(
-            user_id=user.id
-        ).order_by('-created').all()
-        data = []
-        for answer in answers:
-            item = {
-                'survey_id': answer.question.survey.id,
-                'question_id': answer.question.id,
-                'question': answer.question.body,
-                'answer': answer.body if answer.body else answer.choice.body
-            }
-        data.append(item)
+        answers = filter_answers(
+            user_id,
+            survey_id=params.validated_data.get('survey_id'),
+            since=params.validated_data.get('since')
+        )
+        fields = params.validated_data.get('fields')
+        group_by = params.validated_data.get('group_by')
+        stream_format = params.validated_data.get('stream')
+        if stream_format:
+            return StreamingHttpResponse(
+                stream_answers(
+                    external_id, answers, stream_format, settings.ANSWER_STREAM_CHUNK_SIZE, fields, group_by
+                ),
+                content_type=STREAM_CONTENT_TYPES[stream_format]
+            )
+        paginator = AnswerPagination()
+        rows = paginator.paginate_queryset(answer_values(answers, select_fields(fields, group_by)), request, self)
+        data = answer_items(rows, select_fields(fields, group_by))
+        if group_by == GROUP_BY_SURVEY:
+            data = group_by_survey(data, fields or ANSWER_OUTPUT)
         return Response(
-            data={'user_id': user.external_id, 'results': data},
+            data=OrderedDict([
+                ('user_id', external_id),
+                ('next', paginator.get_next_link()),
+                ('previous', paginator.get_previous_link()),
+                ('results', data)
+            ]),
             status=status.HTTP_200_OK
         )
 
@@ -235,6 +471,11 @@ class QuestionViewset(viewsets.GenericViewSet, ListModelMixin, RetrieveModelMixi
     ordering_fields = ['created', 'survey_id']
     ordering = ['created']
 
+    def get_serializer_class(self):
+        if self.action == 'update':
+            return QuestionSerializerUpdate
+        return self.serializer_class
+
     @admin_required
     def create(self, request, *args, **kwargs):
         """
@@ -244,6 +485,7 @@ class QuestionViewset(viewsets.GenericViewSet, ListModelMixin, RetrieveModelMixi
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         instance = serializer.save()
+        touch_survey(instance.survey_id)
         return Response(data=QuestionSerializer(instance).data, status=status.HTTP_201_CREATED)
 
     @admin_required
@@ -256,6 +498,7 @@ class QuestionViewset(viewsets.GenericViewSet, ListModelMixin, RetrieveModelMixi
         serializer = self.get_serializer(instance, data=request.data)
         serializer.is_valid(raise_exception=True)
         instance = serializer.save()
+        touch_survey(instance.survey_id)
         return Response(data=QuestionSerializer(instance).data, status=status.HTTP_200_OK)
 
     @admin_required
@@ -270,7 +513,18 @@ class QuestionViewset(viewsets.GenericViewSet, ListModelMixin, RetrieveModelMixi
             return Response(status=status.HTTP_404_NOT_FOUND)
         instance.is_deleted = True
         instance.save()
+        touch_survey(instance.survey_id)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-
+class MetricsView(APIView):
+    @swagger_auto_schema(responses={
+        200: SUCCESS_RESPONSE
+    })
+    @admin_required
+    def get(self, request, **kwargs):
+        """
+        Метрики запросов в формате Prometheus
+        Доступно только администратору
+        """
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')